@@ -0,0 +1,215 @@
+"""Distance and geofence math, vectorized with NumPy when it is installed
+
+Without NumPy every function falls back to the scalar haversine formula,
+so the server runs unchanged on a plain Python install.
+"""
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Below this many point/fence pairs NumPy's call overhead outweighs the
+# vectorization win, so the scalar loop is used
+VECTORIZE_MIN_PAIRS = 64
+# Widen bounding boxes slightly so rounding never excludes a boundary point
+BOX_EPSILON_DEG = 1e-9
+# Ground width of one 256 px Web Mercator tile pixel at the equator, zoom 0
+KM_PER_PIXEL_ZOOM_0 = 2 * math.pi * EARTH_RADIUS_KM / 256
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Calculate the great circle distance between two points on earth (specified in decimal degrees)"""
+    # Convert decimal degrees to radians
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+
+    # Haversine formula
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+    c = 2 * math.asin(math.sqrt(min(1.0, a)))
+    return c * EARTH_RADIUS_KM
+
+
+def longitude_span(latitude, radius_km):
+    """Half-width in degrees of longitude of a circle's bounding box
+
+    Returns 180 when the circle reaches a pole, where every longitude is
+    within range.
+    """
+    angular = radius_km / EARTH_RADIUS_KM
+    lat = math.radians(latitude)
+    if abs(lat) + angular >= math.pi / 2:
+        return 180.0
+    return math.degrees(math.asin(math.sin(angular) / math.cos(lat)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(min_lat, max_lat, min_lon, max_lon) enclosing a circle on the sphere
+
+    Boxes that would cross the antimeridian cover the full longitude range.
+    """
+    dlat = radius_km / KM_PER_DEGREE + BOX_EPSILON_DEG
+    dlon = longitude_span(latitude, radius_km) + BOX_EPSILON_DEG
+    min_lon, max_lon = longitude - dlon, longitude + dlon
+    if min_lon < -180 or max_lon > 180:
+        min_lon, max_lon = -180.0, 180.0
+    return (max(-90.0, latitude - dlat), min(90.0, latitude + dlat), min_lon, max_lon)
+
+
+def haversine_many(latitude, longitude, latitudes, longitudes):
+    """Distances in km from one point to many points"""
+    if np is None or len(latitudes) < VECTORIZE_MIN_PAIRS:
+        return [haversine_distance(latitude, longitude, lat, lon)
+                for lat, lon in zip(latitudes, longitudes)]
+    lat1 = math.radians(latitude)
+    lat2 = np.radians(np.asarray(latitudes, dtype=float))
+    dlat = lat2 - lat1
+    dlon = np.radians(np.asarray(longitudes, dtype=float) - longitude)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return (2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))).tolist()
+
+
+def _inside_scalar(latitudes, longitudes, fence_lats, fence_lons, radii):
+    return [
+        [haversine_distance(lat, lon, fence_lat, fence_lon) <= radius
+         for fence_lat, fence_lon, radius in zip(fence_lats, fence_lons, radii)]
+        for lat, lon in zip(latitudes, longitudes)
+    ]
+
+
+def inside_fences(latitudes, longitudes, fence_lats, fence_lons, radii):
+    """Which fences contain which points, as a points x fences matrix of bools
+
+    A bounding-box test over the whole matrix discards pairs that are
+    certainly outside; exact haversine only runs on the remaining
+    candidates. A point exactly on the boundary counts as inside.
+    """
+    if np is None or len(latitudes) * len(fence_lats) < VECTORIZE_MIN_PAIRS:
+        return _inside_scalar(latitudes, longitudes, fence_lats, fence_lons, radii)
+
+    lat = np.asarray(latitudes, dtype=float)[:, None]
+    lon = np.asarray(longitudes, dtype=float)[:, None]
+    flat = np.asarray(fence_lats, dtype=float)[None, :]
+    flon = np.asarray(fence_lons, dtype=float)[None, :]
+    radius = np.asarray(radii, dtype=float)[None, :]
+
+    # Latitude band: the meridional distance never exceeds the true distance
+    candidate = np.abs(lat - flat) <= radius / KM_PER_DEGREE + BOX_EPSILON_DEG
+
+    # Longitude band from the circle's bounding box, unbounded near poles
+    angular = radius / EARTH_RADIUS_KM
+    flat_rad = np.radians(flat)
+    reaches_pole = np.abs(flat_rad) + angular >= np.pi / 2
+    ratio = np.sin(angular) / np.maximum(np.cos(flat_rad), 1e-12)
+    span = np.where(reaches_pole, 180.0, np.degrees(np.arcsin(np.clip(ratio, 0.0, 1.0))))
+    dlon = np.abs((lon - flon + 180.0) % 360.0 - 180.0)
+    candidate &= dlon <= span + BOX_EPSILON_DEG
+
+    inside = np.zeros(candidate.shape, dtype=bool)
+    rows, cols = np.nonzero(candidate)
+    if len(rows):
+        lat1 = np.radians(lat[rows, 0])
+        lat2 = flat_rad[0, cols]
+        dlat = lat2 - lat1
+        dlon_rad = np.radians(flon[0, cols] - lon[rows, 0])
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon_rad / 2) ** 2
+        distance = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+        inside[rows, cols] = distance <= radius[0, cols]
+    return inside.tolist()
+
+
+def zoom_tolerance_km(zoom, latitude=0.0):
+    """Ground size of one map pixel at a Web Mercator zoom level and latitude"""
+    return KM_PER_PIXEL_ZOOM_0 * math.cos(math.radians(latitude)) / 2 ** zoom
+
+
+def _project(latitudes, longitudes):
+    """Equirectangular x/y in km around the track's mean latitude
+
+    Longitudes are unwrapped first so a track crossing the antimeridian
+    stays continuous.
+    """
+    unwrapped = [longitudes[0]]
+    for lon in longitudes[1:]:
+        unwrapped.append(unwrapped[-1] + (lon - unwrapped[-1] + 180.0) % 360.0 - 180.0)
+    scale = KM_PER_DEGREE * math.cos(math.radians(sum(latitudes) / len(latitudes)))
+    return [lon * scale for lon in unwrapped], [lat * KM_PER_DEGREE for lat in latitudes]
+
+
+def _farthest_scalar(x, y, first, last):
+    ax, ay = x[first], y[first]
+    dx, dy = x[last] - ax, y[last] - ay
+    length_sq = dx * dx + dy * dy
+    best, best_distance = first, -1.0
+    for i in range(first + 1, last):
+        px, py = x[i] - ax, y[i] - ay
+        t = 0.0 if length_sq == 0 else min(1.0, max(0.0, (px * dx + py * dy) / length_sq))
+        distance = math.hypot(px - t * dx, py - t * dy)
+        if distance > best_distance:
+            best, best_distance = i, distance
+    return best, best_distance
+
+
+def _farthest(x, y, first, last):
+    """Interior point farthest from the segment first-last, and its distance"""
+    if np is None or last - first - 1 < VECTORIZE_MIN_PAIRS:
+        return _farthest_scalar(x, y, first, last)
+    ax, ay = x[first], y[first]
+    dx, dy = x[last] - ax, y[last] - ay
+    length_sq = dx * dx + dy * dy
+    px = x[first + 1:last] - ax
+    py = y[first + 1:last] - ay
+    if length_sq == 0:
+        t = 0.0
+    else:
+        t = np.clip((px * dx + py * dy) / length_sq, 0.0, 1.0)
+    distances = np.hypot(px - t * dx, py - t * dy)
+    i = int(np.argmax(distances))
+    return first + 1 + i, float(distances[i])
+
+
+def simplify_track(latitudes, longitudes, tolerance_km):
+    """Indexes of the points a Douglas-Peucker simplification keeps
+
+    Every dropped point lies within tolerance_km of the simplified track.
+    Distances are to segments rather than infinite lines, so tracks that
+    return to their starting point keep their shape.
+    """
+    count = len(latitudes)
+    if count < 3 or tolerance_km <= 0:
+        return list(range(count))
+    x, y = _project(latitudes, longitudes)
+    if np is not None and count >= VECTORIZE_MIN_PAIRS:
+        x, y = np.asarray(x), np.asarray(y)
+
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    # Explicit stack: long tracks would exceed the recursion limit
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        index, distance = _farthest(x, y, first, last)
+        if distance > tolerance_km:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [i for i, kept in enumerate(keep) if kept]
+
+
+def path_distances(latitudes, longitudes):
+    """Distances in km between consecutive points of a track"""
+    if np is None or len(latitudes) < VECTORIZE_MIN_PAIRS:
+        return [haversine_distance(latitudes[i], longitudes[i], latitudes[i + 1], longitudes[i + 1])
+                for i in range(len(latitudes) - 1)]
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    dlat = lat[1:] - lat[:-1]
+    dlon = lon[1:] - lon[:-1]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    return (2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))).tolist()
@@ -0,0 +1,191 @@
+import queue
+import threading
+import time
+
+from maintenance import epoch_ms
+
+# Queue marker telling the writer thread to drain and exit
+_STOP = object()
+
+
+class LocationWriter:
+    """Write-behind queue that group-commits location points
+
+    API handlers submit points and return as soon as they are queued. A
+    background thread drains the queue and inserts each group through
+    DatabaseManager.update_device_locations in a single transaction, so
+    one commit (and one fsync) covers up to max_batch points.
+
+    With wait_for_commit=True, submit() blocks until the group holding the
+    point is committed: callers still share commits with concurrent
+    requests but never acknowledge a point that is not on disk. A group
+    that is not committed within commit_timeout seconds raises
+    TimeoutError; its points stay queued and may still be written.
+    """
+
+    def __init__(self, db, max_batch=500, max_delay=0.005, max_queue=10000,
+                 wait_for_commit=False, commit_timeout=10):
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.wait_for_commit = wait_for_commit
+        self.commit_timeout = commit_timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        # Set by stop() so nothing is queued behind the stop marker
+        self.stopped = False
+        self.submit_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.committed = 0
+        self.batches = 0
+        self.rejected = 0
+        self.errors = 0
+        self.last_batch_size = 0
+
+    def start(self):
+        """Start the background writer thread"""
+        if self.thread is None:
+            self.stopped = False
+            self.thread = threading.Thread(target=self._run, name='location-writer', daemon=True)
+            self.thread.start()
+        return self
+
+    def submit(self, point):
+        """Queue one (device_id, latitude, longitude, ip_address, city, region, country) point
+
+        Returns False if the queue is full or the writer has been stopped
+        or, when waiting for commits, if the group containing the point
+        failed to commit.
+        """
+        return self.submit_many([point])
+
+    def submit_many(self, points):
+        """Queue several points; either all of them are queued or none are"""
+        if not points:
+            return True
+        # Stamp points at receipt time, not at commit time
+        timestamp = epoch_ms()
+        done = threading.Event() if self.wait_for_commit else None
+        pending = {'remaining': len(points), 'ok': True}
+        items = [(point + (timestamp,) if len(point) == 7 else point, done, pending)
+                 for point in points]
+
+        # Producers reserve capacity under a lock so a batch is queued whole
+        # or not at all; the writer only ever frees space
+        with self.submit_lock:
+            if self.stopped or self.queue.maxsize - self.queue.qsize() < len(items):
+                with self.stats_lock:
+                    self.rejected += len(items)
+                return False
+            for item in items:
+                self.queue.put_nowait(item)
+        with self.stats_lock:
+            self.enqueued += len(items)
+
+        if done is not None and not done.wait(self.commit_timeout):
+            raise TimeoutError(f"Points not committed within {self.commit_timeout} s")
+        return pending['ok']
+
+    def depth(self):
+        """Current number of queued points (a gauge)"""
+        return self.queue.qsize()
+
+    def stats(self):
+        """Counters and the queue depth gauge"""
+        with self.stats_lock:
+            return {
+                "queue_depth": self.depth(),
+                "queue_capacity": self.queue.maxsize,
+                "enqueued": self.enqueued,
+                "committed": self.committed,
+                "batches": self.batches,
+                "rejected": self.rejected,
+                "errors": self.errors,
+                "last_batch_size": self.last_batch_size,
+            }
+
+    def flush(self):
+        """Block until every queued point has been written"""
+        self.queue.join()
+
+    def stop(self, timeout=10):
+        """Flush remaining points and stop the writer thread"""
+        if self.thread is None:
+            return
+        with self.submit_lock:
+            self.stopped = True
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+        self.thread = None
+
+    def _collect(self):
+        """Wait for a first item, then gather a group by count or delay"""
+        batch = []
+        item = self.queue.get()
+        if item is _STOP:
+            return batch, True
+        batch.append(item)
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _write(self, batch):
+        ok = True
+        try:
+            self.db.update_device_locations([point for point, _, _ in batch])
+        except Exception as e:
+            ok = False
+            print(f"Error writing location batch: {str(e)}")
+
+        with self.stats_lock:
+            self.batches += 1
+            self.last_batch_size = len(batch)
+            if ok:
+                self.committed += len(batch)
+            else:
+                self.errors += len(batch)
+            for _, done, pending in batch:
+                if not ok:
+                    pending['ok'] = False
+                pending['remaining'] -= 1
+                if done is not None and pending['remaining'] == 0:
+                    done.set()
+        for _ in batch:
+            self.queue.task_done()
+
+    def _run(self):
+        while True:
+            batch, stopping = self._collect()
+            if batch:
+                self._write(batch)
+            if stopping:
+                self.queue.task_done()
+                self._drain()
+                return
+
+    def _drain(self):
+        """Write out whatever is still queued after the stop marker"""
+        batch = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self.queue.task_done()
+                continue
+            batch.append(item)
+            if len(batch) >= self.max_batch:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
@@ -0,0 +1,161 @@
+import threading
+import time
+
+from geomath import path_distances
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+
+
+def epoch_ms():
+    """Current time in epoch milliseconds, the stored location timestamp format"""
+    return int(time.time() * 1000)
+
+
+def summarize_buckets(rows, bucket_ms, previous=None):
+    """Aggregate time-ordered (latitude, longitude, timestamp) rows into buckets
+
+    Returns {bucket_start: [point_count, latitude_sum, longitude_sum,
+    min_lat, max_lat, min_lon, max_lon, distance, first_timestamp,
+    last_timestamp, last_latitude, last_longitude]}. previous is the
+    (latitude, longitude) point just before rows, if any; each step of
+    distance travelled is credited to the bucket it ends in.
+    """
+    latitudes = [row[0] for row in rows]
+    longitudes = [row[1] for row in rows]
+    if previous is not None:
+        steps = path_distances([previous[0]] + latitudes, [previous[1]] + longitudes)
+    else:
+        steps = [0.0] + path_distances(latitudes, longitudes)
+
+    buckets = {}
+    for (latitude, longitude, timestamp), step in zip(rows, steps):
+        bucket = timestamp - timestamp % bucket_ms
+        summary = buckets.get(bucket)
+        if summary is None:
+            buckets[bucket] = [1, latitude, longitude, latitude, latitude, longitude, longitude,
+                               step, timestamp, timestamp, latitude, longitude]
+            continue
+        summary[0] += 1
+        summary[1] += latitude
+        summary[2] += longitude
+        summary[3] = min(summary[3], latitude)
+        summary[4] = max(summary[4], latitude)
+        summary[5] = min(summary[5], longitude)
+        summary[6] = max(summary[6], longitude)
+        summary[7] += step
+        summary[9] = timestamp
+        summary[10] = latitude
+        summary[11] = longitude
+    return buckets
+
+
+def merge_rollup(device_id, bucket, summary, existing=None):
+    """Rollup table row for a bucket summary, merged into an existing row if given
+
+    existing rows come from the rollup tables in column order after
+    device_id and timestamp.
+    """
+    count, lat_sum, lon_sum, min_lat, max_lat, min_lon, max_lon, distance, first, last, last_lat, last_lon = summary
+    if existing is not None:
+        (old_count, old_lat, old_lon, old_min_lat, old_max_lat, old_min_lon, old_max_lon,
+         old_distance, old_first, old_last, old_last_lat, old_last_lon) = existing
+        lat_sum += old_lat * old_count
+        lon_sum += old_lon * old_count
+        count += old_count
+        min_lat, max_lat = min(min_lat, old_min_lat), max(max_lat, old_max_lat)
+        min_lon, max_lon = min(min_lon, old_min_lon), max(max_lon, old_max_lon)
+        distance += old_distance
+        first = min(first, old_first)
+        # Late points older than the bucket's last point leave it in place
+        if old_last > last:
+            last, last_lat, last_lon = old_last, old_last_lat, old_last_lon
+    return (device_id, bucket, count, lat_sum / count, lon_sum / count, min_lat, max_lat,
+            min_lon, max_lon, distance, first, last, last_lat, last_lon)
+
+
+def policy_for(policies, user_id, device_type, default):
+    """Pick the most specific (raw_days, hourly_days) policy for a device
+
+    A user and device type match beats a user-wide policy, which beats a
+    device-type policy, which beats the default. A policy's device type
+    also matches client-registered types such as 'Laptop (Linux-6.1)'.
+    """
+    best, best_rank = default, -1
+    for policy_user, policy_type, raw_days, hourly_days in policies:
+        if policy_user is not None and policy_user != user_id:
+            continue
+        if policy_type is not None and not (device_type == policy_type or
+                                            device_type.startswith(policy_type + ' (')):
+            continue
+        rank = (policy_user is not None) * 2 + (policy_type is not None)
+        if rank > best_rank:
+            best, best_rank = (raw_days, hourly_days), rank
+    return best
+
+
+class MaintenanceJob:
+    """Background retention pass: compact old raw points, prune rollups, vacuum
+
+    Each pass compacts raw points older than a device's raw retention into
+    hourly and daily rollups, drops hourly rollups older than the hourly
+    retention (daily rollups are kept) and hands freed pages back to the
+    filesystem. Work is done in small transactions so ingest keeps flowing.
+    """
+
+    def __init__(self, db, interval=3600, batch_size=5000, default_policy=(90, 730),
+                 vacuum_pages=1000):
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self.default_policy = default_policy
+        self.vacuum_pages = vacuum_pages
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.last_run = None
+
+    def start(self):
+        """Run a pass every interval seconds on a daemon thread"""
+        if self.thread is None and self.interval > 0:
+            self.thread = threading.Thread(target=self._run, name='maintenance', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run_once(self, now=None):
+        """Run one maintenance pass and return what it did"""
+        now = now if now is not None else epoch_ms()
+        policies = self.db.get_retention_policies()
+        stats = {"compacted": 0, "pruned_rollups": 0, "vacuumed_pages": 0}
+        for device_id, user_id, device_type in self.db.get_retention_devices():
+            raw_days, hourly_days = policy_for(policies, user_id, device_type, self.default_policy)
+            if raw_days > 0:
+                # Whole hours only, so a bucket is never split across passes
+                cutoff = (now - raw_days * DAY_MS) // HOUR_MS * HOUR_MS
+                while not self.stop_event.is_set():
+                    compacted = self.db.compact_locations(device_id, cutoff, self.batch_size)
+                    stats["compacted"] += compacted
+                    if compacted < self.batch_size:
+                        break
+            if hourly_days > 0:
+                stats["pruned_rollups"] += self.db.prune_hourly_rollups(device_id, now - hourly_days * DAY_MS)
+        while not self.stop_event.is_set():
+            freed = self.db.incremental_vacuum(self.vacuum_pages)
+            stats["vacuumed_pages"] += freed
+            if freed < self.vacuum_pages:
+                break
+        self.last_run = dict(stats, finished=epoch_ms())
+        return stats
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                stats = self.run_once()
+                print(f"Maintenance pass: {stats}")
+            except Exception as e:
+                print(f"Error during maintenance: {str(e)}")
@@ -0,0 +1,320 @@
+import bisect
+import math
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from functools import wraps
+from inspect import isgeneratorfunction
+
+# Latency buckets in seconds, from sub-millisecond reads to slow commits
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Seconds over which recent writer lock waits decay by a factor of e
+LOCK_WAIT_DECAY = 10.0
+
+# Per-thread stack of the DatabaseManager methods being timed; each entry
+# is [method name, seconds spent waiting for the writer lock]
+_calls = threading.local()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Monotonic counter family keyed by a tuple of label values"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, labels=()):
+        with self.lock:
+            return self.values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram family keyed by a tuple of label values"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, labels=()):
+        with self.lock:
+            series = self.series.get(labels)
+            return sum(series[0]) if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            snapshot = sorted((labels, list(series[0]), series[1]) for labels, series in self.series.items())
+        for labels, counts, total in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, labels, le)} {cumulative}")
+            label_text = _label_text(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+def render_samples(name, help_text, kind, samples, labelnames=()):
+    """Prometheus lines for values read at scrape time; samples maps label tuples to values"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in sorted(samples.items()):
+        lines.append(f"{name}{_label_text(labelnames, labels)} {value}")
+    return lines
+
+
+class DatabaseMetrics:
+    """Timers and counters recorded by DatabaseManager"""
+
+    def __init__(self):
+        self.lock_wait = Histogram('tracker_db_lock_wait_seconds',
+                                   'Time DatabaseManager methods spent waiting for the writer lock',
+                                   ('method',))
+        self.execute = Histogram('tracker_db_execute_seconds',
+                                 'Time DatabaseManager methods spent running, excluding writer lock waits',
+                                 ('method',))
+        self.lock_held = Histogram('tracker_db_lock_held_seconds', 'Time the writer lock was held per acquisition')
+        self.commits = Counter('tracker_db_commits_total', 'Committed write transactions', ('method',))
+        # Exponentially decayed sum of writer lock waits, the contention
+        # signal behind backpressure; it falls back to zero once writes stop
+        self._recent_wait = 0.0
+        self._recent_at = time.monotonic()
+        self._recent_lock = threading.Lock()
+        self.rows_written = Counter('tracker_db_rows_written_total',
+                                    'Rows changed by commits as counted by SQLite, trigger and R*Tree writes included',
+                                    ('method',))
+
+    def families(self):
+        return (self.lock_wait, self.execute, self.lock_held, self.commits, self.rows_written)
+
+    def record_lock_wait(self, wait):
+        with self._recent_lock:
+            now = time.monotonic()
+            self._recent_wait = self._recent_wait * math.exp(-(now - self._recent_at) / LOCK_WAIT_DECAY) + wait
+            self._recent_at = now
+
+    def lock_queue_length(self):
+        """Recent seconds of writer lock wait per second, i.e. the average number of waiting threads"""
+        with self._recent_lock:
+            decay = math.exp(-(time.monotonic() - self._recent_at) / LOCK_WAIT_DECAY)
+            return self._recent_wait * decay / LOCK_WAIT_DECAY
+
+    def record_commit(self, rows):
+        stack = getattr(_calls, 'stack', None)
+        method = (stack[-1][0],) if stack else ('other',)
+        self.commits.inc(method)
+        self.rows_written.inc(method, rows)
+
+
+class TimedLock:
+    """Lock wrapper that charges acquisition waits to the timed methods on the stack
+
+    Waits are added to every enclosing timed call so a caller's execute
+    time never includes lock waits of the helpers it calls. Hold time is
+    measured from the outermost acquire to the matching release.
+    """
+
+    def __init__(self, lock, metrics):
+        self._lock = lock
+        self.metrics = metrics
+        self._local = threading.local()
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            depth = getattr(self._local, 'depth', 0)
+            if depth == 0:
+                now = time.perf_counter()
+                self._local.acquired_at = now
+                self.metrics.record_lock_wait(now - start)
+                for call in getattr(_calls, 'stack', ()):
+                    call[1] += now - start
+            self._local.depth = depth + 1
+        return acquired
+
+    def release(self):
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            self.metrics.lock_held.observe((), time.perf_counter() - self._local.acquired_at)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def _timed(name, func):
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        stack = getattr(_calls, 'stack', None)
+        if stack is None:
+            stack = _calls.stack = []
+        call = [name, 0.0]
+        stack.append(call)
+        start = time.perf_counter()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            self.metrics.lock_wait.observe((name,), call[1])
+            self.metrics.execute.observe((name,), elapsed - call[1])
+    return wrapper
+
+
+def timed_methods(cls):
+    """Class decorator timing every public method into self.metrics
+
+    Generator methods are left alone: their time is spent by whoever
+    consumes them, not in the call.
+    """
+    for name, func in list(vars(cls).items()):
+        if name.startswith('_') or not callable(func) or isgeneratorfunction(func):
+            continue
+        setattr(cls, name, _timed(name, func))
+    return cls
+
+
+class SamplingProfiler:
+    """Statistical profiler sampling the stacks of threads serving requests
+
+    A background thread wakes every interval seconds and records the
+    current stack of each tracked thread, so the cost is independent of
+    how many calls the sampled code makes. Stacks are kept in the folded
+    format used by flame graph tools.
+    """
+
+    def __init__(self, interval=0.005, max_stacks=5000, max_depth=64):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self.stacks = StackCounter()
+        self.samples = 0
+        self.dropped = 0
+        self.threads = set()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        if self.thread is None:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        thread, self.thread = self.thread, None
+        if thread is not None:
+            self.stop_event.set()
+            thread.join()
+
+    def reset(self):
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+            self.dropped = 0
+
+    def track(self, thread_id):
+        with self.lock:
+            self.threads.add(thread_id)
+
+    def untrack(self, thread_id):
+        with self.lock:
+            self.threads.discard(thread_id)
+
+    def _folded(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def sample(self):
+        """Record one stack per tracked thread"""
+        with self.lock:
+            threads = set(self.threads)
+        if not threads:
+            return
+        frames = sys._current_frames()
+        stacks = [self._folded(frames[thread_id]) for thread_id in threads if thread_id in frames]
+        with self.lock:
+            for stack in stacks:
+                if stack in self.stacks or len(self.stacks) < self.max_stacks:
+                    self.stacks[stack] += 1
+                else:
+                    self.dropped += 1
+            self.samples += len(stacks)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def report(self, top=20):
+        """Sample counts by leaf function plus the folded stacks"""
+        with self.lock:
+            stacks = dict(self.stacks)
+            samples, dropped = self.samples, self.dropped
+        leaves = StackCounter()
+        for stack, count in stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": samples,
+            "dropped": dropped,
+            "top": [{"function": name, "samples": count} for name, count in leaves.most_common(top)],
+            "folded": [f"{stack} {count}" for stack, count in sorted(stacks.items(), key=lambda item: -item[1])],
+        }
@@ -0,0 +1,395 @@
+"""Versioned schema migrations for the tracker database
+
+The schema version lives in PRAGMA user_version. Each migration brings
+the database from version N-1 to N and is applied exactly once, in
+order. Run this module directly to migrate a database file in place:
+
+    python migrations.py device_tracker.db
+
+Add --vacuum, with the server stopped, to also switch a database created
+before incremental auto-vacuum over to it; this rewrites the whole file.
+"""
+import argparse
+import sqlite3
+
+from geomath import bounding_box
+
+# Rows copied per transaction when rebuilding large tables
+MIGRATION_BATCH_SIZE = 50000
+
+
+def migrate_initial_schema(conn):
+    """Version 1: the original users/devices/locations/geofences tables"""
+    # Only takes effect on a new, empty file; existing databases are
+    # switched over offline by enable_incremental_vacuum
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # Users table - Add salt column for password security
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        salt TEXT NOT NULL
+    )
+    ''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS devices (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        device_name TEXT NOT NULL,
+        device_type TEXT NOT NULL,
+        registered_date TEXT NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS locations (
+        id INTEGER PRIMARY KEY,
+        device_id INTEGER,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        ip_address TEXT,
+        city TEXT,
+        region TEXT,
+        country TEXT,
+        timestamp TEXT NOT NULL,
+        FOREIGN KEY (device_id) REFERENCES devices (id)
+    )
+    ''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS geofences (
+        id INTEGER PRIMARY KEY,
+        device_id INTEGER,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        radius REAL NOT NULL,
+        name TEXT NOT NULL,
+        FOREIGN KEY (device_id) REFERENCES devices (id)
+    )
+    ''')
+    conn.commit()
+
+
+def migrate_epoch_timestamps(conn, batch_size=MIGRATION_BATCH_SIZE):
+    """Version 2: integer epoch-millisecond timestamps plus lookup indexes
+
+    locations is rebuilt into locations_v2 in id order, one batch per
+    transaction. An interrupted run resumes from the last copied id. The
+    table swap commits together with the version bump, and rows that
+    already hold epoch milliseconds are copied unchanged, so a re-run can
+    never convert a timestamp twice.
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS locations_v2 (
+        id INTEGER PRIMARY KEY,
+        device_id INTEGER,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        ip_address TEXT,
+        city TEXT,
+        region TEXT,
+        country TEXT,
+        timestamp INTEGER NOT NULL,
+        FOREIGN KEY (device_id) REFERENCES devices (id)
+    )
+    ''')
+    conn.commit()
+
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM locations_v2").fetchone()[0]
+    while True:
+        # Old timestamps were written with datetime.now(), i.e. local time
+        rows = conn.execute(
+            "SELECT id, device_id, latitude, longitude, ip_address, city, region, country, "
+            "CASE WHEN typeof(timestamp) = 'integer' THEN timestamp "
+            "ELSE COALESCE(CAST(strftime('%s', timestamp, 'utc') AS INTEGER), 0) * 1000 END "
+            "FROM locations WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            "INSERT INTO locations_v2 (id, device_id, latitude, longitude, ip_address, city, region, country, timestamp) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.commit()
+        last_id = rows[-1][0]
+
+    conn.execute("BEGIN")
+    conn.execute("DROP TABLE locations")
+    conn.execute("ALTER TABLE locations_v2 RENAME TO locations")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_locations_device_ts ON locations (device_id, timestamp DESC)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_devices_user ON devices (user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_geofences_device ON geofences (device_id)")
+    conn.execute("PRAGMA user_version = 2")
+    conn.commit()
+
+
+def create_latest_location_table(conn):
+    """Create device_latest_location and fill it from the location history"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS device_latest_location (
+        device_id INTEGER PRIMARY KEY,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        ip_address TEXT,
+        city TEXT,
+        region TEXT,
+        country TEXT,
+        timestamp INTEGER NOT NULL,
+        FOREIGN KEY (device_id) REFERENCES devices (id)
+    )
+    ''')
+    # One seek on idx_locations_device_ts per device
+    conn.execute('''
+    INSERT OR REPLACE INTO device_latest_location
+        (device_id, latitude, longitude, ip_address, city, region, country, timestamp)
+    SELECT l.device_id, l.latitude, l.longitude, l.ip_address, l.city, l.region, l.country, l.timestamp
+    FROM devices d
+    JOIN locations l ON l.id = (
+        SELECT id FROM locations WHERE device_id = d.id ORDER BY timestamp DESC LIMIT 1
+    )
+    ''')
+    conn.commit()
+
+
+def migrate_latest_locations(conn):
+    """Version 3: materialized latest location per device"""
+    create_latest_location_table(conn)
+
+
+def migrate_spatial_index(conn):
+    """Version 4: R*Tree indexes over geofence boxes and latest positions"""
+    conn.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS geofence_rtree USING rtree (
+        id, min_lat, max_lat, min_lon, max_lon, +device_id
+    )
+    ''')
+    conn.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS device_position_rtree USING rtree (
+        id, min_lat, max_lat, min_lon, max_lon, +user_id
+    )
+    ''')
+
+    # Positions follow device_latest_location on every ingest path
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS device_position_rtree_insert
+    AFTER INSERT ON device_latest_location
+    BEGIN
+        INSERT OR REPLACE INTO device_position_rtree (id, min_lat, max_lat, min_lon, max_lon, user_id)
+        VALUES (NEW.device_id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude,
+                (SELECT user_id FROM devices WHERE id = NEW.device_id));
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS device_position_rtree_update
+    AFTER UPDATE OF latitude, longitude ON device_latest_location
+    BEGIN
+        UPDATE device_position_rtree
+        SET min_lat = NEW.latitude, max_lat = NEW.latitude,
+            min_lon = NEW.longitude, max_lon = NEW.longitude
+        WHERE id = NEW.device_id;
+    END
+    ''')
+
+    conn.execute('''
+    INSERT OR REPLACE INTO device_position_rtree (id, min_lat, max_lat, min_lon, max_lon, user_id)
+    SELECT ll.device_id, ll.latitude, ll.latitude, ll.longitude, ll.longitude, d.user_id
+    FROM device_latest_location ll JOIN devices d ON d.id = ll.device_id
+    ''')
+    # Circle bounding boxes need spherical math, so they are computed here
+    geofences = conn.execute("SELECT id, device_id, latitude, longitude, radius FROM geofences").fetchall()
+    conn.executemany(
+        "INSERT OR REPLACE INTO geofence_rtree (id, min_lat, max_lat, min_lon, max_lon, device_id) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [(geo_id,) + bounding_box(lat, lon, radius) + (device_id,)
+         for geo_id, device_id, lat, lon, radius in geofences]
+    )
+    conn.commit()
+
+
+def migrate_geofence_events(conn):
+    """Version 5: per-fence inside/outside state and an enter/exit event log"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS geofence_state (
+        device_id INTEGER NOT NULL,
+        geofence_id INTEGER NOT NULL,
+        inside INTEGER NOT NULL,
+        updated INTEGER NOT NULL,
+        PRIMARY KEY (device_id, geofence_id)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS geofence_events (
+        id INTEGER PRIMARY KEY,
+        device_id INTEGER NOT NULL,
+        geofence_id INTEGER NOT NULL,
+        event TEXT NOT NULL,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        distance REAL NOT NULL,
+        timestamp INTEGER NOT NULL,
+        FOREIGN KEY (device_id) REFERENCES devices (id),
+        FOREIGN KEY (geofence_id) REFERENCES geofences (id)
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_geofence_events_device ON geofence_events (device_id, id)")
+    conn.commit()
+
+
+def migrate_device_tokens(conn):
+    """Version 6: per-device API tokens and unique device names per user
+
+    Only SHA-256 hashes of tokens are stored. Existing duplicate names get
+    their id appended so the unique index can be built.
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS device_tokens (
+        device_id INTEGER PRIMARY KEY,
+        token_hash TEXT UNIQUE NOT NULL,
+        created INTEGER NOT NULL,
+        FOREIGN KEY (device_id) REFERENCES devices (id)
+    )
+    ''')
+    conn.execute('''
+    UPDATE devices SET device_name = device_name || ' (' || id || ')'
+    WHERE id NOT IN (SELECT MIN(id) FROM devices GROUP BY user_id, device_name)
+    ''')
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_devices_user_name ON devices (user_id, device_name)")
+    conn.commit()
+
+
+def migrate_history_index(conn):
+    """Version 7: ascending (device_id, timestamp) history index
+
+    The index implicitly ends in the rowid, so scanning it either way
+    matches ORDER BY timestamp, id in both directions without a sort,
+    which keyset pagination on (timestamp, id) relies on.
+    """
+    conn.execute("BEGIN")
+    conn.execute("DROP INDEX IF EXISTS idx_locations_device_ts")
+    conn.execute("CREATE INDEX idx_locations_device_ts ON locations (device_id, timestamp)")
+    conn.commit()
+
+
+def migrate_location_rollups(conn):
+    """Version 8: hourly/daily location rollups and retention policies
+
+    Databases that predate incremental auto-vacuum are not converted here,
+    since that rewrites the whole file; see enable_incremental_vacuum.
+    """
+    for table in ('location_rollups_hourly', 'location_rollups_daily'):
+        # timestamp is the bucket start; latitude/longitude the centroid;
+        # the last point lets later batches extend distance travelled
+        conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            device_id INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            point_count INTEGER NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            min_lat REAL NOT NULL,
+            max_lat REAL NOT NULL,
+            min_lon REAL NOT NULL,
+            max_lon REAL NOT NULL,
+            distance REAL NOT NULL,
+            first_timestamp INTEGER NOT NULL,
+            last_timestamp INTEGER NOT NULL,
+            last_latitude REAL NOT NULL,
+            last_longitude REAL NOT NULL,
+            PRIMARY KEY (device_id, timestamp)
+        ) WITHOUT ROWID
+        ''')
+    # A NULL user_id or device_type matches every user or type
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS retention_policies (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        device_type TEXT,
+        raw_days INTEGER NOT NULL,
+        hourly_days INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''')
+    conn.commit()
+
+
+def incremental_vacuum_enabled(conn):
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def enable_incremental_vacuum(conn):
+    """Switch the database to incremental auto-vacuum so pruning can shrink it
+
+    Rewrites the whole file with VACUUM, which needs as much free disk
+    space again and blocks every writer; run it offline.
+    """
+    if incremental_vacuum_enabled(conn):
+        return False
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+
+def table_exists(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def ensure_latest_location_table(conn):
+    """Rebuild device_latest_location if it has gone missing"""
+    if table_exists(conn, 'device_latest_location'):
+        return
+    create_latest_location_table(conn)
+    # Dropping the table also dropped the position index triggers
+    if table_exists(conn, 'device_position_rtree'):
+        migrate_spatial_index(conn)
+
+
+# Append new migrations here; a migration's version is its position + 1
+MIGRATIONS = [
+    migrate_initial_schema,
+    migrate_epoch_timestamps,
+    migrate_latest_locations,
+    migrate_spatial_index,
+    migrate_geofence_events,
+    migrate_device_tokens,
+    migrate_history_index,
+    migrate_location_rollups,
+]
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn):
+    """Apply every pending migration and return the resulting version"""
+    version = get_schema_version(conn)
+    for target, migration in enumerate(MIGRATIONS, start=1):
+        if target <= version:
+            continue
+        migration(conn)
+        conn.execute(f"PRAGMA user_version = {target}")
+        conn.commit()
+        version = target
+    return version
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrate a tracker database in place')
+    parser.add_argument('db_path', nargs='?', default='device_tracker.db')
+    parser.add_argument('--vacuum', action='store_true',
+                        help='Also switch to incremental auto-vacuum (rewrites the file; stop the server first)')
+    args = parser.parse_args()
+    connection = sqlite3.connect(args.db_path)
+    before = get_schema_version(connection)
+    after = apply_migrations(connection)
+    print(f"{args.db_path}: schema version {before} -> {after}")
+    if args.vacuum and enable_incremental_vacuum(connection):
+        print(f"{args.db_path}: switched to incremental auto-vacuum")
+    connection.close()
@@ -0,0 +1,92 @@
+import queue
+import threading
+
+
+class Subscription:
+    """One subscriber's bounded queue of pending events"""
+
+    def __init__(self, topic, queue_size):
+        self.topic = topic
+        self.queue = queue.Queue(maxsize=queue_size)
+        # Set when the broker drops a subscriber that fell too far behind
+        self.evicted = False
+
+    def get(self, timeout):
+        """Next event, or None if none arrived within timeout seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class LocationBroker:
+    """In-process pub/sub fanning location updates out to live streams
+
+    Subscribers listen on a topic such as ('device', 7) or ('user', 'alice').
+    publish() never blocks: a subscriber whose queue is full is evicted
+    rather than slowing down ingest, and its stream tells the client to
+    reconnect. At most max_subscribers streams are open per process.
+    """
+
+    def __init__(self, max_subscribers=1000, queue_size=100):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.topics = {}
+        self.count = 0
+        self.published = 0
+        self.delivered = 0
+        self.evictions = 0
+
+    def subscribe(self, topic):
+        """Open a subscription, or return None when the process is at capacity"""
+        with self.lock:
+            if self.count >= self.max_subscribers:
+                return None
+            subscription = Subscription(topic, self.queue_size)
+            self.topics.setdefault(topic, set()).add(subscription)
+            self.count += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self._remove(subscription)
+
+    def _remove(self, subscription):
+        subscribers = self.topics.get(subscription.topic)
+        if subscribers is None or subscription not in subscribers:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self.topics[subscription.topic]
+        self.count -= 1
+
+    def has_subscribers(self, topic=None):
+        """Cheap check so publishers can skip building events nobody reads"""
+        if topic is None:
+            return self.count > 0
+        return topic in self.topics
+
+    def publish(self, topic, event):
+        """Deliver event to every subscriber of topic without blocking"""
+        with self.lock:
+            subscribers = list(self.topics.get(topic, ()))
+            self.published += 1
+            for subscription in subscribers:
+                try:
+                    subscription.queue.put_nowait(event)
+                    self.delivered += 1
+                except queue.Full:
+                    subscription.evicted = True
+                    self._remove(subscription)
+                    self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "subscribers": self.count,
+                "max_subscribers": self.max_subscribers,
+                "published": self.published,
+                "delivered": self.delivered,
+                "evictions": self.evictions,
+            }
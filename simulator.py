@@ -0,0 +1,218 @@
+import asyncio
+import csv
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from track_client import DeviceTracker, create_session, logger
+
+# Meters per degree of latitude (and of longitude at the equator)
+METERS_PER_DEGREE = 111195.0
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class RandomWalk:
+    """Synthetic trajectory: parked most of the time, then a hop of about step_meters"""
+
+    def __init__(self, rng, step_meters=1000.0, move_probability=0.3):
+        self.rng = rng
+        self.step_meters = step_meters
+        self.move_probability = move_probability
+        self.latitude = rng.uniform(35, 60)
+        self.longitude = rng.uniform(-10, 30)
+
+    def next_point(self):
+        if self.rng.random() < self.move_probability:
+            north = self.rng.gauss(0, self.step_meters)
+            east = self.rng.gauss(0, self.step_meters)
+            self.latitude = max(-89.0, min(89.0, self.latitude + north / METERS_PER_DEGREE))
+            degrees_east = east / (METERS_PER_DEGREE * math.cos(math.radians(self.latitude)))
+            self.longitude = (self.longitude + degrees_east + 180) % 360 - 180
+        return self.latitude, self.longitude
+
+
+class ReplayTrack:
+    """Trajectory looping over recorded points, starting offset points in"""
+
+    def __init__(self, points, offset=0):
+        self.points = points
+        self.position = offset % len(points)
+
+    def next_point(self):
+        point = self.points[self.position]
+        self.position = (self.position + 1) % len(self.points)
+        return point
+
+
+def load_track(path):
+    """(latitude, longitude) points from a history export in NDJSON or CSV format"""
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    points = [(float(row['latitude']), float(row['longitude'])) for row in rows]
+    if not points:
+        raise ValueError(f"No points in {path}")
+    return points
+
+
+class VirtualDevice(DeviceTracker):
+    """DeviceTracker following a trajectory, with no files under ~/.laptop_tracker
+
+    Registration, the offline queue, batch uploads, heartbeats and
+    backoff are the real client's; only the location source, the identity
+    and the HTTP session (shared by the whole fleet) differ.
+    """
+
+    def __init__(self, server_url, username, password, index, trajectory, session, prefix='sim', **options):
+        self.index = index
+        self.trajectory = trajectory
+        self.shared_session = session
+        super().__init__(server_url, username, password, queue_path=':memory:', **options)
+        self.hostname = f"{prefix}-{index}"
+        self.os_info = "Simulated"
+
+    def _create_session(self):
+        return self.shared_session
+
+    def _get_client_id(self):
+        return str(uuid.UUID(int=self.index))
+
+    def _load_device_token(self):
+        pass
+
+    def _save_device_token(self):
+        pass
+
+    def get_location(self):
+        latitude, longitude = self.trajectory.next_point()
+        return {"latitude": latitude, "longitude": longitude, "ip_address": None,
+                "city": None, "region": None, "country": None}
+
+    def close(self):
+        # The session belongs to the fleet
+        self.executor.shutdown(wait=False)
+        self.queue.close()
+
+
+class FleetStats:
+    """Latency and status of every HTTP request the fleet sends, per endpoint"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def hook(self, response, *args, **kwargs):
+        """requests response hook; elapsed runs from sending until the headers arrived"""
+        endpoint = urlsplit(response.request.url).path
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append(
+                (response.elapsed.total_seconds(), response.status_code < 400))
+
+    def summary(self, elapsed):
+        results = {}
+        with self.lock:
+            samples = dict(self.samples)
+        for endpoint, endpoint_samples in samples.items():
+            latencies = [sample[0] * 1000 for sample in endpoint_samples]
+            errors = sum(1 for sample in endpoint_samples if not sample[1])
+            results[endpoint] = {
+                "requests": len(endpoint_samples),
+                "errors": errors,
+                "error_rate": errors / len(endpoint_samples),
+                "rate": len(endpoint_samples) / elapsed,
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "p99_ms": percentile(latencies, 99),
+                "max_ms": max(latencies),
+            }
+        return results
+
+
+async def drive_fleet(devices, duration, concurrency, ramp, rng):
+    """Run every device's reporting loop for duration seconds on the running event loop
+
+    The event loop only keeps the schedule; each blocking protocol call
+    runs on a pool of concurrency threads, which bounds the requests in
+    flight to the connections the shared session keeps open.
+    """
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="simulator")
+    deadline = loop.time() + duration
+
+    async def drive(device, start_delay):
+        # Spread registrations out instead of stampeding the server
+        await asyncio.sleep(start_delay)
+        if not await loop.run_in_executor(pool, device.register_device):
+            logger.error(f"{device.hostname}: registration failed, will retry on first update")
+        while loop.time() < deadline:
+            delay = device.update_interval
+            try:
+                delay = await loop.run_in_executor(pool, device.report_location)
+            except Exception as e:
+                logger.error(f"{device.hostname}: unexpected error during location update: {e}")
+            await asyncio.sleep(min(delay, max(0.0, deadline - loop.time())))
+
+    try:
+        await asyncio.gather(*(drive(device, rng.uniform(0, ramp)) for device in devices))
+    finally:
+        pool.shutdown(wait=True)
+
+
+def run_simulation(server_url, username, password, count, duration, update_interval=300, concurrency=64,
+                   ramp=10.0, track=None, seed=0, prefix='sim', **options):
+    """Simulate count devices against the server and return per-endpoint request stats
+
+    Devices follow random walks, or replay track from staggered offsets
+    when one is given. Extra options go to each DeviceTracker.
+    """
+    rng = random.Random(seed)
+    stats = FleetStats()
+    session = create_session(pool_maxsize=concurrency)
+    session.hooks['response'].append(stats.hook)
+    devices = []
+    for index in range(count):
+        if track:
+            trajectory = ReplayTrack(track, rng.randrange(len(track)))
+        else:
+            trajectory = RandomWalk(random.Random(seed * 1000003 + index))
+        devices.append(VirtualDevice(server_url, username, password, index, trajectory, session, prefix,
+                                     update_interval=update_interval, **options))
+
+    start = time.perf_counter()
+    try:
+        asyncio.run(drive_fleet(devices, duration, concurrency, min(ramp, duration), rng))
+        elapsed = time.perf_counter() - start
+        return {
+            "devices": count,
+            "registered": sum(1 for device in devices if device.device_id),
+            # Points still waiting in the devices' offline queues
+            "queued_points": sum(len(device.queue) for device in devices),
+            "elapsed": elapsed,
+            "endpoints": stats.summary(elapsed),
+        }
+    finally:
+        for device in devices:
+            device.close()
+        session.close()
+
+
+def print_summary(summary):
+    print(f"{summary['registered']}/{summary['devices']} devices registered, "
+          f"{summary['elapsed']:.1f} s simulated")
+    print(f"{'endpoint':<23} {'requests':>8} {'err %':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8}")
+    for endpoint, stats in summary["endpoints"].items():
+        print(f"{endpoint:<23} {stats['requests']:>8} {stats['error_rate'] * 100:>6.2f} {stats['rate']:>8.1f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['max_ms']:>8.2f}")
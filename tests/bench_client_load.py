@@ -0,0 +1,234 @@
+"""Load generator driving many simulated track_client.DeviceTracker instances
+
+Registers N devices through /api/client/register, then sends location
+updates at a fixed total rate and reports latency percentiles and error
+rates per endpoint. Updates go through the offline queue's batch upload
+to /api/update_locations, or one point per request to
+/api/update_location as older clients and relays do; --endpoint both
+runs the two one after the other for comparison. By default a fresh
+server is spawned on a temporary database; pass --server to load an
+existing one instead.
+
+    python tests/bench_client_load.py --devices 1000 --rate 200 --duration 30
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, repo_root)
+
+import requests
+import simulator
+import track_client
+
+# Thousands of simulated clients would flood the real client log
+track_client.logger.setLevel(logging.WARNING)
+
+SERVE_SNIPPET = (
+    "import sys, track_server\n"
+    "from werkzeug.serving import run_simple\n"
+    "run_simple('127.0.0.1', int(sys.argv[1]), track_server.app, threaded=True)\n"
+)
+
+
+def send_single_point(device):
+    """Post one point to /api/update_location, bypassing the offline queue"""
+    try:
+        response = device._post_json("/api/update_location", device.get_location(),
+                                     {"Authorization": f"Bearer {device.device_token}"})
+    except requests.exceptions.RequestException:
+        return False
+    return response.status_code == 200
+
+
+def measure(session, endpoint, run):
+    """Run one phase and return its simulator.FleetStats summary for endpoint"""
+    stats = simulator.FleetStats()
+    session.hooks['response'] = [stats.hook]
+    elapsed = run()
+    return stats.summary(elapsed).get(endpoint)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{url}/api/health", timeout=1).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"Server at {url} did not come up")
+
+
+def spawn_server(db_path):
+    """Run the server in a child process on a temporary database"""
+    port = free_port()
+    env = dict(os.environ, TRACKER_DB=db_path, MAINTENANCE_INTERVAL='0')
+    process = subprocess.Popen([sys.executable, '-c', SERVE_SNIPPET, str(port)], cwd=repo_root, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_up(url)
+    except RuntimeError:
+        process.kill()
+        raise
+    return process, url
+
+
+def start_in_process_server(db_path):
+    """Serve the app from a thread in this process (shares the GIL with the load)"""
+    os.environ['TRACKER_DB'] = db_path
+    os.environ['MAINTENANCE_INTERVAL'] = '0'
+    import track_server
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, track_server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    wait_until_up(url)
+    return server, url
+
+
+def register_all(devices, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda device: device.register_device(), devices))
+    return time.perf_counter() - start
+
+
+# Endpoint -> how a device sends one update to it
+UPDATE_SENDERS = {
+    '/api/update_locations': lambda device: device.update_location(),
+    '/api/update_location': send_single_point,
+}
+ENDPOINT_CHOICES = {
+    'batch': ['/api/update_locations'],
+    'single': ['/api/update_location'],
+    'both': ['/api/update_location', '/api/update_locations'],
+}
+
+
+def drive_updates(devices, endpoint, rate, duration, threads, lags):
+    """Send rate updates per second in total to endpoint, round-robin over the devices
+
+    Each update has a fixed send time, so a slow server shows up as lag
+    (appended to lags, in seconds) instead of silently lowering the
+    offered load. Returns the seconds the phase took.
+    """
+    total = int(rate * duration)
+    counter = itertools.count()
+    counter_lock = threading.Lock()
+    send = UPDATE_SENDERS[endpoint]
+    begin = time.perf_counter() + 0.1
+
+    def worker():
+        while True:
+            with counter_lock:
+                k = next(counter)
+            if k >= total:
+                return
+            scheduled = begin + k / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            lags.append(time.perf_counter() - scheduled)
+            send(devices[k % len(devices)])
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - begin
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated DeviceTracker load against the tracking server')
+    parser.add_argument('--devices', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=100, help='Total location updates per second')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds of location updates per endpoint')
+    parser.add_argument('--endpoint', choices=sorted(ENDPOINT_CHOICES), default='both',
+                        help='Batch uploads, single-point updates, or both in turn')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--server', help='Existing server URL; by default one is spawned')
+    parser.add_argument('--in-process', action='store_true', help='Serve from a thread in this process')
+    parser.add_argument('--user', default='loadtest')
+    parser.add_argument('--password', default='loadtest-password')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the summary as JSON for comparing runs')
+    args = parser.parse_args()
+
+    server = None
+    if args.server:
+        url = args.server.rstrip('/')
+    else:
+        db_path = os.path.join(tempfile.mkdtemp(), 'load.db')
+        if args.in_process:
+            server, url = start_in_process_server(db_path)
+        else:
+            server, url = spawn_server(db_path)
+
+    session = track_client.create_session(pool_maxsize=args.threads)
+    devices = []
+    try:
+        # Creating the account fails harmlessly if it already exists
+        requests.post(f"{url}/register", json={"username": args.user, "password": args.password}, timeout=10)
+        devices = [simulator.VirtualDevice(url, args.user, args.password, i,
+                                           simulator.RandomWalk(random.Random(args.seed * 1000003 + i)),
+                                           session, prefix='loadtest')
+                   for i in range(args.devices)]
+        print(f"Registering {args.devices} devices against {url}...")
+        start = time.perf_counter()
+        results = {'/api/client/register': measure(session, '/api/client/register',
+                                                    lambda: register_all(devices, args.threads))}
+        lags = {}
+        for endpoint in ENDPOINT_CHOICES[args.endpoint]:
+            print(f"Sending {args.rate:g} updates/s to {endpoint} for {args.duration:g} s...")
+            lags[endpoint] = []
+            results[endpoint] = measure(session, endpoint, lambda: drive_updates(
+                devices, endpoint, args.rate, args.duration, args.threads, lags[endpoint]))
+            if results[endpoint]:
+                # How far behind schedule updates went out because the server fell behind
+                results[endpoint]["p99_lag_ms"] = simulator.percentile(lags[endpoint], 99) * 1000
+        elapsed = time.perf_counter() - start
+    finally:
+        for device in devices:
+            device.close()
+        session.close()
+        if isinstance(server, subprocess.Popen):
+            server.terminate()
+            server.wait()
+        elif server is not None:
+            server.shutdown()
+
+    results = {endpoint: stats for endpoint, stats in results.items() if stats}
+    simulator.print_summary({"devices": len(devices), "registered": sum(1 for device in devices if device.device_id),
+                             "elapsed": elapsed, "endpoints": results})
+    for endpoint, stats in results.items():
+        if "p99_lag_ms" in stats:
+            print(f"{endpoint}: p99 send lag {stats['p99_lag_ms']:.2f} ms")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import os
+import statistics
+import time
+
+import tracker_env  # must run before track_server is imported
+from simulator import percentile
+from track_server import DatabaseManager
+
+
+def bench_ingest(fence_count, updates):
+    """Time update_device_location for a device with fence_count geofences"""
+    db = DatabaseManager(os.path.join(tracker_env.scratch_dir, f"fences_{fence_count}.db"))
+    db.register_user('bench', 'password123')
+    user_id = db.verify_user('bench', 'password123')
+    device_id = db.register_device(user_id, 'bench-laptop', 'Laptop')
+    for i in range(fence_count):
+        # Spread the fences so some points fall inside and some outside
+        db.add_geofence(device_id, f"Fence {i}", 40.0 + (i % 100) * 0.01, -74.0, 2.0)
+
+    samples = []
+    for i in range(updates):
+        start = time.perf_counter()
+        db.update_device_location(device_id, 40.0 + (i % 50) * 0.02, -74.0)
+        samples.append((time.perf_counter() - start) * 1000)
+    db.close()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Location ingest latency by geofence count')
+    parser.add_argument('--updates', type=int, default=500, help='Updates per scenario')
+    parser.add_argument('--fences', type=int, nargs='+', default=[1, 10, 1000])
+    args = parser.parse_args()
+
+    print(f"{'fences':>8} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for fence_count in args.fences:
+        samples = bench_ingest(fence_count, args.updates)
+        print(f"{fence_count:>8} {statistics.mean(samples):>10.3f} {percentile(samples, 50):>10.3f} "
+              f"{percentile(samples, 95):>10.3f} {percentile(samples, 99):>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import geomath
+from geomath import haversine_distance, inside_fences
+
+
+def scalar_check(points, fences):
+    """The original per-fence loop"""
+    return [[haversine_distance(lat, lon, flat, flon) <= radius for flat, flon, radius in fences]
+            for lat, lon in points]
+
+
+def vector_check(points, fences):
+    return inside_fences([p[0] for p in points], [p[1] for p in points],
+                         [f[0] for f in fences], [f[1] for f in fences], [f[2] for f in fences])
+
+
+def throughput(check, points, fences, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        check(points, fences)
+    elapsed = time.perf_counter() - start
+    return len(points) * len(fences) * repeat / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Geofence evaluation throughput, scalar vs vectorized')
+    parser.add_argument('--fences', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--points', type=int, nargs='+', default=[1, 100])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"NumPy: {'available' if geomath.np is not None else 'not installed (scalar fallback)'}")
+    print(f"{'points':>7} {'fences':>7} {'scalar pairs/s':>16} {'vector pairs/s':>16} {'speed-up':>9}")
+    for point_count in args.points:
+        for fence_count in args.fences:
+            # City-sized fences around one region, points wandering nearby
+            fences = [(40 + rng.uniform(-1, 1), -74 + rng.uniform(-1, 1), rng.uniform(0.5, 20))
+                      for _ in range(fence_count)]
+            points = [(40 + rng.uniform(-1, 1), -74 + rng.uniform(-1, 1)) for _ in range(point_count)]
+            scalar = throughput(scalar_check, points, fences, args.repeat)
+            vector = throughput(vector_check, points, fences, args.repeat)
+            print(f"{point_count:>7} {fence_count:>7} {scalar:>16,.0f} {vector:>16,.0f} {vector / scalar:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
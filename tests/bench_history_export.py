@@ -0,0 +1,48 @@
+import argparse
+import os
+import time
+import tracemalloc
+
+import tracker_env  # must run before track_server is imported
+import track_server
+from track_server import DatabaseManager, EXPORT_FORMATS, export_chunks
+
+
+def populate(db, device_id, points):
+    """One point per second, inserted in large transactions"""
+    for start in range(0, points, 100000):
+        db.update_device_locations([
+            (device_id, 40 + (i % 1000) / 10000, -74.0, None, None, None, None, i * 1000)
+            for i in range(start, min(start + 100000, points))
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming history export throughput and memory')
+    parser.add_argument('--points', type=int, default=1000000)
+    args = parser.parse_args()
+
+    db = DatabaseManager(os.path.join(tracker_env.scratch_dir, 'export.db'))
+    db.register_user('bench', 'password123')
+    device_id = db.register_device(db.verify_user('bench', 'password123'), 'laptop', 'Laptop')
+    print(f"Loading {args.points} points...")
+    populate(db, device_id, args.points)
+    # The exporters serialize through the module-level manager
+    track_server.db = db
+
+    for name, (generate, _, _) in EXPORT_FORMATS.items():
+        tracemalloc.start()
+        start = time.perf_counter()
+        size = 0
+        for chunk in export_chunks(generate(db.iter_location_history(device_id))):
+            size += len(chunk)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:<8} {elapsed:>7.2f} s {args.points / elapsed:>10.0f} rows/s "
+              f"{size / 1e6:>8.1f} MB out {peak / 1e6:>6.2f} MB peak")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
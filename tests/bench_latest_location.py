@@ -0,0 +1,83 @@
+import argparse
+import os
+import random
+import time
+
+import tracker_env  # must run before track_server is imported
+from migrations import create_latest_location_table
+from track_server import DatabaseManager, LOCAL_TIMESTAMP_SQL
+
+
+def populate(db, devices, points):
+    """Bulk-load a location history spread over the given number of devices"""
+    conn = db._writer()
+    conn.execute("INSERT INTO users (username, password, salt) VALUES ('bench', 'x', 'x')")
+    conn.executemany(
+        "INSERT INTO devices (id, user_id, device_name, device_type, registered_date) "
+        "VALUES (?, 1, ?, 'Laptop', '2025-01-01 00:00:00')",
+        [(i, f"laptop-{i}") for i in range(1, devices + 1)]
+    )
+    start_ms = 1_700_000_000_000
+    batch = []
+    for i in range(points):
+        batch.append((random.randint(1, devices), random.uniform(-60, 60),
+                      random.uniform(-180, 180), start_ms + i * 1000))
+        if len(batch) == 100000:
+            conn.executemany(
+                "INSERT INTO locations (device_id, latitude, longitude, timestamp) VALUES (?, ?, ?, ?)", batch
+            )
+            conn.commit()
+            batch = []
+    if batch:
+        conn.executemany(
+            "INSERT INTO locations (device_id, latitude, longitude, timestamp) VALUES (?, ?, ?, ?)", batch
+        )
+        conn.commit()
+    conn.execute("DELETE FROM device_latest_location")
+    create_latest_location_table(conn)
+
+
+def time_lookups(label, lookup, devices, lookups):
+    start = time.perf_counter()
+    for _ in range(lookups):
+        lookup(random.randint(1, devices))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed / lookups * 1e6:>10.1f} us/lookup")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latest-location lookup: history index vs materialized table')
+    parser.add_argument('--points', type=int, default=1_000_000, help='History size (e.g. 10000000)')
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args()
+
+    db = DatabaseManager(os.path.join(tracker_env.scratch_dir, 'latest.db'))
+    print(f"Loading {args.points} points for {args.devices} devices...")
+    populate(db, args.devices, args.points)
+
+    def from_history(device_id):
+        with db._reader() as reader:
+            return reader.execute(
+                f"SELECT latitude, longitude, ip_address, city, region, country, {LOCAL_TIMESTAMP_SQL} "
+                "FROM locations WHERE device_id = ? ORDER BY timestamp DESC LIMIT 1",
+                (device_id,)
+            ).fetchone()
+
+    def from_history_unindexed(device_id):
+        # The plan used before idx_locations_device_ts existed
+        with db._reader() as reader:
+            return reader.execute(
+                f"SELECT latitude, longitude, ip_address, city, region, country, {LOCAL_TIMESTAMP_SQL} "
+                "FROM locations NOT INDEXED WHERE device_id = ? ORDER BY timestamp DESC LIMIT 1",
+                (device_id,)
+            ).fetchone()
+
+    time_lookups("history (full scan)", from_history_unindexed, args.devices, max(1, args.lookups // 1000))
+    time_lookups("history (idx_locations_device_ts)", from_history, args.devices, args.lookups)
+    time_lookups("device_latest_location", db.get_latest_device_location, args.devices, args.lookups)
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
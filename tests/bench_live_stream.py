@@ -0,0 +1,31 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pubsub import LocationBroker
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Live stream fan-out cost per published point')
+    parser.add_argument('--points', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'watchers':>8} {'us/point':>10} {'us/delivery':>12}")
+    for watchers in (1, 10, 100, 1000):
+        broker = LocationBroker(max_subscribers=watchers, queue_size=args.points)
+        for _ in range(watchers):
+            broker.subscribe(('user', 'alice'))
+        event = {"device_id": 1, "latitude": 40.0, "longitude": -74.0}
+        start = time.perf_counter()
+        for _ in range(args.points):
+            broker.publish(('user', 'alice'), event)
+        elapsed = time.perf_counter() - start
+        print(f"{watchers:>8} {elapsed / args.points * 1e6:>10.1f} "
+              f"{elapsed / (args.points * watchers) * 1e6:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import os
+import random
+import time
+
+import tracker_env  # must run before track_server is imported
+from track_server import DatabaseManager
+
+
+def populate(db, devices, users):
+    """Bulk-register devices spread over users and give each a latest position"""
+    rng = random.Random(0)
+    with db.lock:
+        conn = db._writer()
+        conn.executemany("INSERT INTO users (id, username, password, salt) VALUES (?, ?, 'x', 'x')",
+                         [(i, f"user-{i}") for i in range(1, users + 1)])
+        conn.executemany(
+            "INSERT INTO devices (id, user_id, device_name, device_type, registered_date) "
+            "VALUES (?, ?, ?, 'Laptop', '2025-01-01 00:00:00')",
+            [(i, 1 + i % users, f"laptop-{i}") for i in range(1, devices + 1)]
+        )
+        conn.commit()
+    points = [(i, rng.uniform(35, 60), rng.uniform(-10, 30), None, None, None, None)
+              for i in range(1, devices + 1)]
+    for i in range(0, len(points), 10000):
+        db.update_device_locations(points[i:i + 10000])
+
+
+def time_queries(label, query, count):
+    rng = random.Random(1)
+    start = time.perf_counter()
+    found = 0
+    for _ in range(count):
+        found += len(query(rng.uniform(35, 60), rng.uniform(-10, 30)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {elapsed / count * 1000:>8.3f} ms/query {found / count:>8.1f} devices/query")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Devices-near-point query latency')
+    parser.add_argument('--devices', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    db = DatabaseManager(os.path.join(tracker_env.scratch_dir, 'spatial.db'))
+    print(f"Loading {args.devices} devices for {args.users} users...")
+    populate(db, args.devices, args.users)
+
+    time_queries("near, radius 5 km", lambda lat, lon: db.find_devices_near(1, lat, lon, 5), args.queries)
+    time_queries("near, radius 25 km", lambda lat, lon: db.find_devices_near(1, lat, lon, 25), args.queries)
+    time_queries("nearest, k=1", lambda lat, lon: db.find_nearest_devices(1, lat, lon, 1), args.queries)
+    time_queries("nearest, k=10", lambda lat, lon: db.find_nearest_devices(1, lat, lon, 10), args.queries)
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
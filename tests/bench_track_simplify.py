@@ -0,0 +1,51 @@
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from geomath import KM_PER_DEGREE, simplify_track, zoom_tolerance_km
+
+
+def drive(points, seed=0):
+    """One GPS fix per second from a vehicle at ~50 km/h with 5 m noise"""
+    rng = random.Random(seed)
+    lat, lon, heading = 48.0, 11.0, 0.0
+    latitudes, longitudes = [], []
+    for _ in range(points):
+        heading += rng.gauss(0, 0.05)
+        lat += 0.014 * math.cos(heading) / KM_PER_DEGREE
+        lon += 0.014 * math.sin(heading) / (KM_PER_DEGREE * math.cos(math.radians(lat)))
+        latitudes.append(lat + rng.gauss(0, 0.005) / KM_PER_DEGREE)
+        longitudes.append(lon + rng.gauss(0, 0.005) / KM_PER_DEGREE)
+    return latitudes, longitudes
+
+
+def payload(latitudes, longitudes, indexes):
+    return len(json.dumps([{"latitude": latitudes[i], "longitude": longitudes[i]} for i in indexes]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Track simplification ratio and speed')
+    parser.add_argument('--points', type=int, default=86400)
+    args = parser.parse_args()
+
+    latitudes, longitudes = drive(args.points)
+    raw = payload(latitudes, longitudes, range(args.points))
+    print(f"{args.points} raw points, {raw / 1e6:.1f} MB as JSON")
+    print(f"{'zoom':>4} {'tolerance m':>12} {'kept':>8} {'ratio':>8} {'ms':>8}")
+    for zoom in (8, 11, 13, 15, 17):
+        tolerance = zoom_tolerance_km(zoom, 48.0)
+        start = time.perf_counter()
+        kept = simplify_track(latitudes, longitudes, tolerance)
+        elapsed = time.perf_counter() - start
+        ratio = raw / payload(latitudes, longitudes, kept)
+        print(f"{zoom:>4} {tolerance * 1000:>12.1f} {len(kept):>8} {ratio:>7.1f}x {elapsed * 1000:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
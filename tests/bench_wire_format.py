@@ -0,0 +1,73 @@
+import argparse
+import gzip
+import json
+import os
+import random
+import time
+
+os.environ.setdefault('MAINTENANCE_INTERVAL', '0')
+import tracker_env  # noqa: F401  (must run before track_server is imported)
+import track_server
+import wire
+
+
+def make_batch(count, interval_ms, rng):
+    """A tracker walking through one city, one point every interval_ms"""
+    latitude, longitude, timestamp = 47.3769, 8.5417, 1700000000000
+    points = []
+    for _ in range(count):
+        latitude += rng.gauss(0, 0.0002)
+        longitude += rng.gauss(0, 0.0002)
+        timestamp += interval_ms
+        points.append({"device_id": 1, "latitude": latitude, "longitude": longitude,
+                       "ip_address": "203.0.113.7", "city": "Zurich", "region": "Zurich",
+                       "country": "Switzerland", "timestamp": timestamp})
+    return points, timestamp
+
+
+def parse_json(body, now):
+    data = json.loads(body)
+    return track_server.parse_json_points(data["points"], 1, now - data["sent_at"], now)
+
+
+def parse_packed(body, now):
+    device_id, sent_at, rows = wire.decode_points(body)
+    return track_server.parse_packed_points(rows, device_id, 1, now - sent_at, now)
+
+
+def microseconds_per_point(parse, body, count, repeat):
+    now = track_server.epoch_ms()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parse(body, now)
+    return (time.perf_counter() - start) / repeat / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bytes and parse CPU per point, JSON vs the binary point format')
+    parser.add_argument('--points', type=int, nargs='+', default=[1, 10, 100, 500])
+    parser.add_argument('--interval-ms', type=int, default=1000, help='Time between a tracker\'s points')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'points':>7} {'json B/pt':>10} {'gzip B/pt':>10} {'binary B/pt':>12} "
+          f"{'json us/pt':>11} {'binary us/pt':>13} {'speed-up':>9}")
+    for count in args.points:
+        points, sent_at = make_batch(count, args.interval_ms, rng)
+        json_body = json.dumps({"points": points, "sent_at": sent_at}).encode()
+        packed_body = wire.encode_points(points, 1, sent_at)
+        # Parsed rows must match before the timings mean anything
+        packed_rows, json_rows = parse_packed(packed_body, sent_at)[1], parse_json(json_body, sent_at)[1]
+        for (_, packed), (_, parsed) in zip(packed_rows, json_rows):
+            assert abs(packed[1] - parsed[1]) < 1e-6 and abs(packed[2] - parsed[2]) < 1e-6
+            assert packed[3:] == parsed[3:]
+        json_cpu = microseconds_per_point(parse_json, json_body, count, args.repeat)
+        packed_cpu = microseconds_per_point(parse_packed, packed_body, count, args.repeat)
+        print(f"{count:>7} {len(json_body) / count:>10.1f} {len(gzip.compress(json_body)) / count:>10.1f} "
+              f"{len(packed_body) / count:>12.1f} {json_cpu:>11.2f} {packed_cpu:>13.2f} "
+              f"{json_cpu / packed_cpu:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
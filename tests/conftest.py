@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+import tracker_env  # noqa: F401  (must run before track_server is imported)
+from werkzeug.serving import make_server
+import track_client
+import track_server
+
+
+@pytest.fixture
+def make_db(tmp_path):
+    """Factory for DatabaseManagers on fresh files under tmp_path
+
+    make_db(name, username) returns (db, user_id) for a database holding
+    that one user; every database is closed after the test.
+    """
+    databases = []
+
+    def make(name='tracker.db', username='testuser'):
+        db = track_server.DatabaseManager(str(tmp_path / name))
+        databases.append(db)
+        db.register_user(username, 'password123')
+        return db, db.verify_user(username, 'password123')
+
+    yield make
+    for db in databases:
+        db.close()
+
+
+@pytest.fixture(scope='session')
+def server_url():
+    """The app served over real HTTP on the import database, for client tests"""
+    server = make_server('127.0.0.1', 0, track_server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.fixture
+def client_dir(tmp_path, monkeypatch):
+    """Keep the client's id, token and queue files out of ~/.laptop_tracker"""
+    monkeypatch.setattr(track_client, 'log_dir', str(tmp_path))
+    return tmp_path
@@ -0,0 +1,90 @@
+import pytest
+
+import track_client
+import track_server
+
+track_server.db.register_user('moveuser', 'password123')
+
+
+@pytest.fixture
+def make_tracker(server_url, client_dir):
+    trackers = []
+
+    def make(name, **options):
+        tracker = track_client.DeviceTracker(server_url, 'moveuser', 'password123', update_interval=300,
+                                             queue_path=str(client_dir / f'{name}.db'), **options)
+        trackers.append(tracker)
+        tracker.hostname = name
+        tracker.position = (40.0, -74.0)
+        tracker.get_location = lambda: {"latitude": tracker.position[0], "longitude": tracker.position[1],
+                                        "ip_address": None, "city": None, "region": None, "country": None}
+        return tracker
+
+    yield make
+    for tracker in trackers:
+        tracker.close()
+
+
+def stored_points(device_id):
+    with track_server.db._reader() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM locations WHERE device_id = ?", (device_id,)).fetchone()[0]
+
+
+def test_distance_meters():
+    assert track_client.distance_meters(40.0, -74.0, 40.0, -74.0) == 0
+    # One degree of latitude is about 111 km
+    assert abs(track_client.distance_meters(40.0, -74.0, 41.0, -74.0) - 111195) < 10
+
+
+def test_stationary_device_only_heartbeats(make_tracker):
+    tracker = make_tracker('desk-laptop', heartbeat_interval=0)
+    tracker.report_location()
+    device_id = tracker.device_id
+    assert stored_points(device_id) == 1
+    with track_server.db._reader() as conn:
+        first_seen = conn.execute(
+            "SELECT timestamp FROM device_latest_location WHERE device_id = ?", (device_id,)).fetchone()[0]
+
+    # Jitter under the threshold is not a move
+    tracker.position = (40.001, -74.001)
+    for _ in range(3):
+        tracker.report_location()
+    assert stored_points(device_id) == 1
+    with track_server.db._reader() as conn:
+        last_seen = conn.execute(
+            "SELECT timestamp FROM device_latest_location WHERE device_id = ?", (device_id,)).fetchone()[0]
+    assert last_seen >= first_seen
+    assert track_server.request_duration.count(('POST', '/api/heartbeat', '200')) >= 3
+
+
+def test_movement_shortens_the_interval(make_tracker):
+    tracker = make_tracker('commuter-laptop', min_interval=60)
+    assert tracker.report_location() == 300
+    tracker.position = (40.1, -74.0)
+    assert tracker.report_location() == 150
+    tracker.position = (40.2, -74.0)
+    assert tracker.report_location() == 75
+    tracker.position = (40.3, -74.0)
+    assert tracker.report_location() == 60
+    assert stored_points(tracker.device_id) == 4
+
+    # Settling down stretches the interval back out, capped at update_interval
+    assert tracker.report_location() == 120
+    assert tracker.report_location() == 240
+    assert tracker.report_location() == 300
+    assert stored_points(tracker.device_id) == 4
+
+
+def test_heartbeat_needs_a_token_and_a_location():
+    client = track_server.app.test_client()
+    assert client.post('/api/heartbeat').status_code == 401
+    data = client.post('/api/client/register', json={
+        'username': 'moveuser', 'password': 'password123', 'hostname': 'new-laptop', 'os_info': 'Linux'
+    }).get_json()
+    headers = {'Authorization': f"Bearer {data['device_token']}"}
+    assert client.post('/api/heartbeat', headers=headers).status_code == 404
+    track_server.db.update_device_location(data['device_id'], 1.0, 2.0)
+    response = client.post('/api/heartbeat', headers=headers)
+    assert response.status_code == 200 and response.get_json()['client_ip']
+    assert stored_points(data['device_id']) == 1
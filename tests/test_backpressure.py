@@ -0,0 +1,109 @@
+import metrics
+import track_client
+import track_server
+
+track_server.db.register_user('loaduser', 'password123')
+
+
+def register(client, hostname):
+    data = client.post('/api/client/register', json={
+        'username': 'loaduser', 'password': 'password123', 'hostname': hostname, 'os_info': 'Linux'
+    }).get_json()
+    return data['device_id'], {'Authorization': f"Bearer {data['device_token']}"}
+
+
+def set_load(load):
+    """Pretend the writer lock has had load * SHED_LOCK_QUEUE threads waiting on it"""
+    db_metrics = track_server.db.metrics
+    with db_metrics._recent_lock:
+        db_metrics._recent_wait = load * track_server.SHED_LOCK_QUEUE * metrics.LOCK_WAIT_DECAY
+        db_metrics._recent_at = metrics.time.monotonic()
+
+
+def test_lock_queue_length_decays():
+    db_metrics = metrics.DatabaseMetrics()
+    assert db_metrics.lock_queue_length() == 0
+    # One slow acquisition barely registers; sustained waiting does
+    db_metrics.record_lock_wait(0.1)
+    assert db_metrics.lock_queue_length() < 0.02
+    db_metrics._recent_at -= 5 * metrics.LOCK_WAIT_DECAY
+    assert db_metrics.lock_queue_length() < 0.0001
+
+
+def test_idle_server_leaves_cadence_to_clients():
+    client = track_server.app.test_client()
+    device_id, headers = register(client, 'idle-laptop')
+    for _ in range(2):
+        response = client.post('/api/update_location', json={"latitude": 1.0, "longitude": 2.0}, headers=headers)
+        assert response.status_code == 200 and response.get_json()["next_interval"] == 0
+    assert client.get('/api/health').get_json()["load"]["recommended_interval"] == 0
+
+
+def test_loaded_server_stretches_interval_and_throttles():
+    client = track_server.app.test_client()
+    device_id, headers = register(client, 'busy-laptop')
+    set_load(0.75)
+    try:
+        response = client.post('/api/update_location', json={"latitude": 1.0, "longitude": 2.0}, headers=headers)
+        interval = response.get_json()["next_interval"]
+        # Halfway between SHED_START_LOAD and full load, less a moment of decay
+        assert track_server.SHED_MAX_INTERVAL // 2 - 5 <= interval <= track_server.SHED_MAX_INTERVAL // 2
+
+        # Coming straight back ignores the recommendation
+        response = client.post('/api/update_locations', json={"points": [{"latitude": 1.0, "longitude": 2.0}]},
+                               headers=headers)
+        assert response.status_code == 429
+        assert interval <= int(response.headers['Retry-After']) <= interval * 1.5 + 1
+
+        # Heartbeats are cheap and only refused at full load
+        response = client.post('/api/heartbeat', headers=headers)
+        assert response.status_code == 200 and abs(response.get_json()["next_interval"] - interval) <= 5
+        assert b'tracker_write_load 0.7' in client.get('/metrics').data
+    finally:
+        set_load(0)
+
+
+def test_client_backs_off_when_server_sheds_load(server_url, client_dir):
+    tracker = track_client.DeviceTracker(server_url, 'loaduser', 'password123',
+                                         queue_path=str(client_dir / 'shed.db'))
+    tracker.hostname = 'shed-laptop'
+    tracker.get_location = lambda: {"latitude": 40.0, "longitude": -74.0, "ip_address": None,
+                                    "city": None, "region": None, "country": None}
+    assert tracker.register_device()
+
+    set_load(2.0)
+    try:
+        assert not tracker.update_location()
+        assert len(tracker.queue) == 1
+        assert tracker.retry_at - track_client.time.monotonic() >= track_server.SHED_RETRY_AFTER - 1
+    finally:
+        set_load(0)
+
+    set_load(0.6)
+    try:
+        tracker.retry_at = 0.0
+        assert tracker.flush_queue()
+        assert 0 < tracker.server_interval <= track_server.recommended_interval(0.6)
+        # The next report waits at least as long as the server asked
+        assert tracker.report_location() >= tracker.server_interval
+    finally:
+        set_load(0)
+    tracker.close()
+
+
+
+def test_idle_server_accepts_catch_up_batches(monkeypatch):
+    monkeypatch.setattr(track_server, 'MIN_CLIENT_INTERVAL', 60)
+    client = track_server.app.test_client()
+    device_id, headers = register(client, 'catch-up-laptop')
+    batch = {"points": [{"latitude": 1.0, "longitude": 2.0}] * 3}
+    for _ in range(3):
+        response = client.post('/api/update_locations', json=batch, headers=headers)
+        assert response.status_code == 200 and response.get_json()["next_interval"] == 60
+
+    set_load(0.75)
+    try:
+        client.post('/api/update_locations', json=batch, headers=headers)
+        assert client.post('/api/update_locations', json=batch, headers=headers).status_code == 429
+    finally:
+        set_load(0)
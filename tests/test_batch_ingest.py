@@ -0,0 +1,64 @@
+import track_server
+
+db = track_server.db
+db.register_user('batchuser', 'password123')
+user_id = db.verify_user('batchuser', 'password123')
+laptop = db.register_device(user_id, 'batch-laptop', 'Laptop')
+desktop = db.register_device(user_id, 'batch-desktop', 'Desktop')
+
+client = track_server.app.test_client()
+
+
+def stored_points(device_id):
+    with db._reader() as conn:
+        return conn.execute(
+            "SELECT latitude, longitude FROM locations WHERE device_id = ? ORDER BY id", (device_id,)).fetchall()
+
+
+def total_commits():
+    return sum(db.metrics.commits.values.values())
+
+
+def test_mixed_batch_reports_each_row():
+    response = client.post('/api/update_locations', json={"points": [
+        {"device_id": laptop, "latitude": 1.0, "longitude": 2.0},
+        {"device_id": str(desktop), "latitude": 3.0, "longitude": 4.0, "timestamp": 1000},
+        {"latitude": 5.0, "longitude": 6.0},
+        {"device_id": "laptop", "latitude": 5.0, "longitude": 6.0},
+        {"device_id": laptop, "latitude": 91.0, "longitude": 6.0},
+        {"device_id": laptop, "latitude": "north", "longitude": 6.0},
+        {"device_id": laptop, "latitude": 5.0, "longitude": 6.0, "timestamp": -1},
+        {"device_id": desktop + 1000, "latitude": 5.0, "longitude": 6.0},
+        "not a point",
+    ]})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert (data["accepted"], data["rejected"]) == (2, 7)
+    assert [result["index"] for result in data["results"]] == list(range(9))
+    assert [result.get("message", result["status"]) for result in data["results"]] == [
+        'success', 'success', 'Invalid device_id', 'Invalid device_id', 'Invalid coordinates',
+        'Invalid coordinates', 'Invalid timestamp', 'Device not found', 'Invalid point']
+    assert stored_points(laptop) == [(1.0, 2.0)]
+    assert stored_points(desktop) == [(3.0, 4.0)]
+
+
+def test_oversized_batch_is_rejected(monkeypatch):
+    monkeypatch.setattr(track_server, 'MAX_BATCH_SIZE', 3)
+    point = {"device_id": laptop, "latitude": 1.0, "longitude": 2.0}
+    before = stored_points(laptop)
+    response = client.post('/api/update_locations', json={"points": [point] * 4})
+    assert response.status_code == 413
+    assert stored_points(laptop) == before
+    assert client.post('/api/update_locations', json={"points": [point] * 3}).status_code == 200
+
+
+def test_batch_is_one_transaction():
+    points = [{"device_id": device_id, "latitude": 10.0 + i, "longitude": 20.0}
+              for i in range(50) for device_id in (laptop, desktop)]
+    before = total_commits()
+    rows_before = db.metrics.rows_written.get(('update_device_locations',))
+    data = client.post('/api/update_locations', json={"points": points}).get_json()
+    assert data["accepted"] == 100
+    assert total_commits() - before == 1
+    # 100 points plus both devices' latest location
+    assert db.metrics.rows_written.get(('update_device_locations',)) - rows_before >= 102
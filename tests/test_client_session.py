@@ -0,0 +1,84 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import track_client
+import track_server
+
+track_server.db.register_user('sessionuser', 'password123')
+
+
+@pytest.fixture
+def tracker(server_url, client_dir):
+    tracker = track_client.DeviceTracker(server_url, 'sessionuser', 'password123',
+                                         queue_path=str(client_dir / 'queue.db'))
+    tracker.get_location = lambda: {"latitude": 40.0, "longitude": -74.0, "ip_address": None,
+                                    "city": None, "region": None, "country": None}
+    yield tracker
+    tracker.close()
+
+
+def test_updates_reuse_one_connection(tracker, server_url):
+    for _ in range(3):
+        assert tracker.update_location()
+    pools = tracker.session.get_adapter(server_url).poolmanager.pools
+    [pool] = [pools[key] for key in pools.keys()]
+    assert pool.num_connections == 1
+    assert pool.num_requests == 4
+
+
+def test_large_bodies_are_gzipped(tracker):
+    assert tracker.register_device()
+    payload = {"device_id": tracker.device_id, "latitude": 1.0, "longitude": 2.0, "city": "x" * 4000}
+    response = tracker._post_json("/api/update_location", payload,
+                                  {"Authorization": f"Bearer {tracker.device_token}"})
+    assert response.status_code == 200
+    assert response.request.headers["Content-Encoding"] == "gzip"
+    assert len(response.request.body) < 1000
+    assert track_server.db.get_latest_device_location(tracker.device_id)[:2] == (1.0, 2.0)
+
+
+def test_server_rejects_bad_and_oversized_gzip():
+    client = track_server.app.test_client()
+    headers = {"Content-Encoding": "gzip", "Content-Type": "application/json"}
+    response = client.post('/api/update_location', data=b'not gzip', headers=headers)
+    assert response.status_code == 400
+
+    bomb = gzip.compress(b' ' * (track_server.MAX_INFLATED_BODY_BYTES + 1))
+    response = client.post('/api/update_location', data=bomb, headers=headers)
+    assert response.status_code == 413
+
+
+def test_bad_gateway_is_only_retried_for_gets(monkeypatch):
+    monkeypatch.setattr(track_client, 'HTTP_BACKOFF_FACTOR', 0)
+    hits = []
+
+    class BadGateway(BaseHTTPRequestHandler):
+        """A proxy whose upstream may already have committed the request"""
+
+        def answer(self):
+            hits.append(self.command)
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self.send_response(502)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        do_GET = do_POST = answer
+
+        def log_message(self, *args):
+            pass
+
+    proxy = ThreadingHTTPServer(('127.0.0.1', 0), BadGateway)
+    threading.Thread(target=proxy.serve_forever, daemon=True).start()
+    session = track_client.create_session()
+    try:
+        url = f"http://127.0.0.1:{proxy.server_port}/api/update_locations"
+        assert session.post(url, json={"points": []}).status_code == 502
+        assert hits == ['POST']
+        assert session.get(url).status_code == 502
+        assert hits.count('GET') == track_client.HTTP_RETRIES + 1
+    finally:
+        session.close()
+        proxy.shutdown()
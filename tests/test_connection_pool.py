@@ -0,0 +1,113 @@
+import threading
+
+import track_server
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_short_lived_threads_do_not_grow_the_pool(make_db):
+    db, user_id = make_db(username='pooluser')
+    device_id = db.register_device(user_id, 'pool-laptop', 'Laptop')
+    errors = []
+
+    def request():
+        try:
+            db.get_device_details(device_id)
+            db.get_latest_device_location(device_id)
+        except Exception as e:
+            errors.append(e)
+
+    for _ in range(10):
+        run_threads(30, request)
+    assert not errors
+    # 300 request threads share the bounded readers plus the one writer
+    assert len(db._connections) <= track_server.DB_READ_POOL_SIZE + 1
+    assert db._reader_count <= track_server.DB_READ_POOL_SIZE
+
+
+def test_long_lived_threads_hold_no_reader_between_calls(make_db, monkeypatch):
+    monkeypatch.setattr(track_server, 'DB_READ_POOL_SIZE', 2)
+    monkeypatch.setattr(track_server, 'DB_POOL_TIMEOUT', 0.5)
+    db, user_id = make_db(username='pooluser')
+    done = threading.Event()
+    read = threading.Barrier(3)
+
+    def worker():
+        # A pooled WSGI worker: one read per request, then it idles
+        db.get_user_devices(user_id)
+        read.wait()
+        done.wait()
+
+    workers = [threading.Thread(target=worker) for _ in range(2)]
+    for thread in workers:
+        thread.start()
+    read.wait()
+    try:
+        # Both idle workers are still alive, yet a third reader gets through
+        assert db.get_user_devices(user_id) == []
+        assert db._idle_readers.qsize() == db._reader_count
+    finally:
+        done.set()
+        for thread in workers:
+            thread.join()
+
+
+def test_reads_wait_for_a_checked_out_reader(make_db, monkeypatch):
+    monkeypatch.setattr(track_server, 'DB_READ_POOL_SIZE', 1)
+    db, user_id = make_db(username='pooluser')
+    seen = []
+
+    def waiter():
+        try:
+            with db._reader() as conn:
+                seen.append(conn)
+        except Exception as e:
+            seen.append(e)
+
+    with db._reader() as held:
+        waiting = threading.Thread(target=waiter)
+        waiting.start()
+        waiting.join(0.2)
+        assert waiting.is_alive()
+    # Leaving the with block hands the connection to the waiting thread
+    waiting.join(5)
+    assert not waiting.is_alive()
+    assert seen == [held]
+
+    monkeypatch.setattr(track_server, 'DB_POOL_TIMEOUT', 0.05)
+    with db._reader():
+        waiting = threading.Thread(target=waiter)
+        waiting.start()
+        waiting.join(5)
+    assert 'No database reader available' in str(seen[-1])
+
+
+def test_reads_run_while_a_write_is_in_progress(make_db):
+    db, user_id = make_db(username='pooluser')
+    device_id = db.register_device(user_id, 'pool-laptop', 'Laptop')
+    db.update_device_location(device_id, 1.0, 2.0)
+    reads = []
+
+    with db.lock:
+        # An open write transaction, as ingest holds while inserting
+        conn = db._writer()
+        conn.execute("UPDATE device_latest_location SET latitude = 3.0 WHERE device_id = ?", (device_id,))
+
+        def read():
+            reads.append(db.get_latest_device_location(device_id)[:2])
+
+        readers = [threading.Thread(target=read) for _ in range(8)]
+        for thread in readers:
+            thread.start()
+        for thread in readers:
+            thread.join(5)
+        # Readers neither block on the writer nor see its uncommitted rows
+        assert reads == [(1.0, 2.0)] * 8
+        db._commit(conn)
+    assert db.get_latest_device_location(device_id)[:2] == (3.0, 2.0)
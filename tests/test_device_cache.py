@@ -0,0 +1,101 @@
+import time
+
+import track_server
+from cache import TTLCache
+
+
+def test_lru_eviction_and_counters():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.put(1, 'a')
+    cache.put(2, 'b')
+    assert cache.get(1) == 'a'
+    cache.put(3, 'c')
+    # 2 was the least recently used entry
+    assert cache.get(2) is None
+    assert cache.get(1) == 'a'
+    assert cache.get(3) == 'c'
+    assert cache.stats() == {"size": 2, "max_size": 2, "hits": 3, "misses": 1, "evictions": 1}
+
+
+def test_entries_expire():
+    cache = TTLCache(max_size=10, ttl=0.01)
+    cache.put(1, 'a')
+    time.sleep(0.02)
+    assert cache.get(1) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_device_details_are_cached(make_db):
+    db, user_id = make_db(username='cacheuser')
+    device_id = db.register_device(user_id, 'laptop', 'Laptop')
+    first = db.get_device_details(device_id)
+    assert db.get_device_details(device_id) == first
+    assert first[4] == 'cacheuser'
+    stats = db.device_cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    # Unknown devices are looked up every time rather than cached
+    assert db.get_device_details(device_id + 1) is None
+    assert db.device_cache.stats()["size"] == 1
+
+
+def test_register_device_invalidates(make_db):
+    db, user_id = make_db(username='cacheuser')
+    device_id = db.register_device(user_id, 'laptop', 'Laptop')
+    db.device_cache.put(device_id + 1, 'stale')
+    new_id = db.register_device(user_id, 'desktop', 'Desktop')
+    assert new_id == device_id + 1
+    assert db.get_device_details(new_id)[1] == 'desktop'
+
+
+def test_steady_state_ingest_does_not_read_devices(make_db):
+    db, user_id = make_db(username='cacheuser')
+    device_ids = [db.register_device(user_id, f"laptop-{i}", 'Laptop') for i in range(3)]
+    points = [(device_id, 40.0, -74.0, None, None, None, None) for device_id in device_ids]
+    assert db.get_existing_device_ids(device_ids) == set(device_ids)
+    db.update_device_locations(points)
+
+    statements = []
+    with db.lock:
+        for conn in db._connections:
+            conn.set_trace_callback(statements.append)
+    assert db.get_existing_device_ids(device_ids) == set(device_ids)
+    assert db.get_device_details(device_ids[0]) is not None
+    db.update_device_locations(points)
+    db.update_device_location(device_ids[0], 40.0, -74.0)
+    assert statements
+    assert not [sql for sql in statements if 'devices' in sql]
+
+
+
+def test_string_device_ids_share_the_int_cache_entry(make_db):
+    db, user_id = make_db(username='cacheuser')
+    device_id = db.register_device(user_id, 'laptop', 'Laptop')
+    assert db.get_device_details(str(device_id)) == db.get_device_details(device_id)
+    assert db.device_cache.stats()["size"] == 1
+    assert db.get_existing_device_ids([str(device_id), device_id]) == {device_id}
+
+    db.update_device_location(device_id, 40.0, -74.0)
+    assert db.get_simplified_track(str(device_id))[1] == 1
+    db.update_device_location(str(device_id), 41.0, -74.0)
+    assert db.get_simplified_track(device_id)[1] == 2
+
+
+def test_single_update_normalises_the_device_id():
+    db = track_server.db
+    db.register_user('cacheuser', 'password123')
+    user_id = db.verify_user('cacheuser', 'password123')
+    device_id = db.register_device(user_id, 'string-id-laptop', 'Laptop')
+    client = track_server.app.test_client()
+    assert client.post('/api/update_location', json={
+        "device_id": device_id, "latitude": 1.0, "longitude": 2.0}).status_code == 200
+    assert db.get_simplified_track(device_id)[1] == 1
+    # A JSON string id must still invalidate the int-keyed track cache
+    assert client.post('/api/update_location', json={
+        "device_id": str(device_id), "latitude": 3.0, "longitude": 4.0}).status_code == 200
+    assert db.get_simplified_track(device_id)[1] == 2
+    assert db.get_latest_device_location(device_id)[:2] == (3.0, 4.0)
+
+    for bad in ("laptop", None):
+        response = client.post('/api/update_location', json={"device_id": bad, "latitude": 1.0, "longitude": 2.0})
+        assert response.status_code == 400
+        assert response.get_json()["message"] == 'Invalid device_id'
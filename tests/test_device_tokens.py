@@ -0,0 +1,122 @@
+import sqlite3
+from contextlib import contextmanager
+
+import track_server
+import wire
+from migrations import apply_migrations, migrate_initial_schema
+
+client = track_server.app.test_client()
+track_server.db.register_user('tokenuser', 'password123')
+
+
+def client_register(hostname='laptop-1'):
+    response = client.post('/api/client/register', json={
+        'username': 'tokenuser', 'password': 'password123',
+        'hostname': hostname, 'os_info': 'Linux'
+    })
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def update(token, **fields):
+    fields.setdefault('latitude', 40.0)
+    fields.setdefault('longitude', -74.0)
+    return client.post('/api/update_location', json=fields,
+                       headers={'Authorization': f"Bearer {token}"})
+
+
+def test_register_reuses_device_and_issues_token():
+    first = client_register()
+    second = client_register()
+    assert first['device_id'] == second['device_id']
+    assert first['device_token'] != second['device_token']
+    # Re-registering revokes the previous token
+    assert update(first['device_token']).status_code == 401
+    assert update(second['device_token']).status_code == 200
+
+
+def test_token_identifies_device():
+    data = client_register('laptop-2')
+    response = update(data['device_token'], latitude=51.5, longitude=-0.12)
+    assert response.status_code == 200
+    latest = track_server.db.get_latest_device_location(data['device_id'])
+    assert (latest[0], latest[1]) == (51.5, -0.12)
+
+    other = client_register('laptop-3')
+    assert update(data['device_token'], device_id=other['device_id']).status_code == 403
+    assert update('not-a-token').status_code == 401
+
+
+def test_required_tokens_cover_batch_uploads(monkeypatch):
+    monkeypatch.setattr(track_server, 'REQUIRE_DEVICE_TOKEN', True)
+    data = client_register('laptop-5')
+    point = {"device_id": data['device_id'], "latitude": 1.0, "longitude": 2.0, "timestamp": 1700000000000}
+    response = client.post('/api/update_locations', json={"points": [point]})
+    assert response.status_code == 401
+    response = client.post('/api/update_locations', data=wire.encode_points([point], data['device_id'], 1700000000000),
+                           headers={"Content-Type": wire.CONTENT_TYPE})
+    assert response.status_code == 401
+    assert track_server.db.get_latest_device_location(data['device_id']) is None
+
+    response = client.post('/api/update_locations', json={"points": [point]},
+                           headers={'Authorization': f"Bearer {data['device_token']}"})
+    assert response.status_code == 200 and response.get_json()["accepted"] == 1
+
+
+def test_verified_tokens_are_cached():
+    data = client_register('laptop-4')
+    db = track_server.db
+    before = db.token_cache.stats()
+    assert db.verify_device_token(data['device_token']) == data['device_id']
+    assert db.verify_device_token(data['device_token']) == data['device_id']
+    after = db.token_cache.stats()
+    assert after['misses'] - before['misses'] == 1
+    assert after['hits'] - before['hits'] == 1
+
+
+def test_migration_renames_duplicate_device_names(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'duplicates.db')
+    migrate_initial_schema(conn)
+    conn.executemany(
+        "INSERT INTO devices (id, user_id, device_name, device_type, registered_date) "
+        "VALUES (?, 1, 'laptop', 'Laptop', '2025-01-01 00:00:00')",
+        [(1,), (2,)]
+    )
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    apply_migrations(conn)
+    names = conn.execute("SELECT device_name FROM devices ORDER BY id").fetchall()
+    assert names == [('laptop',), ('laptop (2)',)]
+    conn.close()
+
+
+
+def test_rotation_during_lookup_is_not_cached(make_db, monkeypatch):
+    db, user_id = make_db(username='tokenuser')
+    device_id = db.register_device(user_id, 'laptop', 'Laptop')
+    old_token = db.issue_device_token(device_id)
+    reader = db._reader
+
+    class RotatingReader:
+        """Re-registers the device between the token lookup and caching it"""
+
+        def __init__(self, conn):
+            self.conn = conn
+
+        def execute(self, sql, params):
+            self.row = self.conn.execute(sql, params).fetchone()
+            db.issue_device_token(device_id)
+            return self
+
+        def fetchone(self):
+            return self.row
+
+    @contextmanager
+    def rotating_reader():
+        with reader() as conn:
+            yield RotatingReader(conn)
+
+    monkeypatch.setattr(db, '_reader', rotating_reader)
+    assert db.verify_device_token(old_token) == device_id
+    monkeypatch.undo()
+    assert db.verify_device_token(old_token) is None
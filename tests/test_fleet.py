@@ -0,0 +1,63 @@
+import track_server
+
+db = track_server.db
+db.register_user('fleetowner', 'password123')
+user_id = db.verify_user('fleetowner', 'password123')
+home = db.register_device(user_id, 'fleet-home', 'Laptop')
+roaming = db.register_device(user_id, 'fleet-roaming', 'Laptop')
+unseen = db.register_device(user_id, 'fleet-unseen', 'Laptop')
+db.add_geofence(roaming, 'Office', 40.0, -74.0, 1.0)
+db.update_device_location(home, 40.0, -74.0, city='New York')
+db.update_device_location(roaming, 41.0, -74.0)
+
+client = track_server.app.test_client()
+with client.session_transaction() as sess:
+    sess['user_id'] = user_id
+    sess['username'] = 'fleetowner'
+
+
+def test_fleet_lists_devices_with_latest_point_and_violations():
+    data = client.get('/api/fleet').get_json()
+    devices = {device['device_id']: device for device in data['devices']}
+    assert list(devices) == [home, roaming, unseen]
+    assert devices[home]['city'] == 'New York' and devices[home]['status'] == 'online'
+    assert devices[home]['violated_geofences'] == []
+    assert devices[roaming]['violated_geofences'][0]['name'] == 'Office'
+    assert devices[unseen]['status'] == 'never_seen' and devices[unseen]['last_seen_age'] is None
+    assert 0 <= devices[home]['last_seen_age'] < 60
+
+
+def test_fleet_is_one_query():
+    statements = []
+    with db.lock:
+        for conn in db._connections:
+            conn.set_trace_callback(statements.append)
+    try:
+        db.get_fleet(user_id)
+    finally:
+        with db.lock:
+            for conn in db._connections:
+                conn.set_trace_callback(None)
+    assert len(statements) == 1
+
+
+def test_etag_returns_304_until_something_changes():
+    first = client.get('/api/fleet')
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+    again = client.get('/api/fleet', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.headers['ETag'] == etag
+
+    # Moving back inside the fence clears the violation and the ETag
+    db.update_device_location(roaming, 40.0, -74.0)
+    changed = client.get('/api/fleet', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    roaming_row = [d for d in changed.get_json()['devices'] if d['device_id'] == roaming][0]
+    assert roaming_row['violated_geofences'] == []
+
+
+def test_dashboard_renders_fleet():
+    response = client.get('/dashboard')
+    assert response.status_code == 200
+    assert b'fleet-unseen' in response.data and b'Never' in response.data
+
@@ -0,0 +1,76 @@
+import threading
+
+
+def fenced_device(make_db, fence_count):
+    """Create a database with one user, one device and some geofences"""
+    db, user_id = make_db(username='fenceuser')
+    device_id = db.register_device(user_id, 'fence-laptop', 'Laptop')
+    for i in range(fence_count):
+        db.add_geofence(device_id, f"Fence {i}", 40.7128, -74.0060, 1.0)
+    return db, device_id
+
+
+def run_with_timeout(target, timeout=5):
+    """Run target in a thread and report whether it finished in time"""
+    result = {}
+
+    def runner():
+        result['value'] = target()
+
+    thread = threading.Thread(target=runner, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive(), result.get('value')
+
+
+def test_update_with_geofences_does_not_deadlock(make_db):
+    db, device_id = fenced_device(make_db, 3)
+    finished, value = run_with_timeout(
+        lambda: db.update_device_location(device_id, 51.5074, -0.1278)
+    )
+    assert finished, "update_device_location hung while checking geofences"
+    assert value is True
+    assert db.get_latest_device_location(device_id)[:2] == (51.5074, -0.1278)
+
+
+def test_update_under_lock_does_not_deadlock(make_db):
+    # A write path that already holds the lock must still be able to ingest
+    db, device_id = fenced_device(make_db, 1)
+
+    def nested():
+        with db.lock:
+            return db.update_device_location(device_id, 40.7128, -74.0060)
+
+    finished, value = run_with_timeout(nested)
+    assert finished, "update_device_location hung when called under db.lock"
+    assert value is True
+
+
+def test_concurrent_updates_record_each_transition_once(make_db, monkeypatch):
+    db, device_id = fenced_device(make_db, 2)
+    read_states = db.get_geofence_states
+    unlocked_reads = threading.Barrier(8, timeout=5)
+
+    def racing_read(device_id, conn=None):
+        states = read_states(device_id, conn)
+        if conn is None:
+            # Every thread has seen the old state before any of them writes
+            unlocked_reads.wait()
+        return states
+
+    # Start outside both fences; the first evaluation records no events
+    assert db.update_geofence_states(device_id, [(51.5074, -0.1278, 1000)]) == []
+    monkeypatch.setattr(db, 'get_geofence_states', racing_read)
+    for point in ((40.7128, -74.0060, 2000), (51.5074, -0.1278, 3000)):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(db.update_geofence_states(device_id, [point])))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        assert sorted(len(events) for events in results) == [0] * 7 + [2]
+
+    events = [row[2:4] for row in reversed(db.get_geofence_events(device_id))]
+    assert events == [('Fence 0', 'enter'), ('Fence 1', 'enter'), ('Fence 0', 'exit'), ('Fence 1', 'exit')]
+    assert [fence[5] for fence in read_states(device_id)] == [0, 0]
@@ -0,0 +1,116 @@
+import pytest
+
+from geomath import KM_PER_DEGREE
+import track_server
+
+HOME = (40.0, -74.0)
+
+
+def north_of_home(km):
+    """A point km north of HOME"""
+    return HOME[0] + km / KM_PER_DEGREE, HOME[1]
+
+
+@pytest.fixture
+def home_fence(make_db):
+    """(db, device_id) for a device with a 1 km 'Home' fence around HOME"""
+    db, user_id = make_db(username='eventuser')
+    device_id = db.register_device(user_id, 'event-laptop', 'Laptop')
+    db.add_geofence(device_id, 'Home', HOME[0], HOME[1], 1.0)
+    return db, device_id
+
+
+def event_names(db, device_id):
+    return [row[3] for row in reversed(db.get_geofence_events(device_id))]
+
+
+def test_transitions_are_recorded_with_hysteresis(home_fence):
+    db, device_id = home_fence
+    hysteresis = track_server.GEOFENCE_HYSTERESIS / 1000
+
+    # The first point only records the starting state
+    db.update_device_location(device_id, *north_of_home(0.2))
+    assert event_names(db, device_id) == []
+    assert db.get_geofence_states(device_id)[0][5] == 1
+
+    # Just past the boundary but within the hysteresis band: still inside
+    db.update_device_location(device_id, *north_of_home(1 + hysteresis / 2))
+    assert event_names(db, device_id) == []
+
+    db.update_device_location(device_id, *north_of_home(1 + hysteresis * 2))
+    assert event_names(db, device_id) == ['exit']
+
+    # Back just inside the boundary is not deep enough to re-enter
+    db.update_device_location(device_id, *north_of_home(1 - hysteresis / 2))
+    assert event_names(db, device_id) == ['exit']
+
+    db.update_device_location(device_id, *north_of_home(0.5))
+    assert event_names(db, device_id) == ['exit', 'enter']
+
+
+def test_first_point_outside_is_not_an_exit(home_fence):
+    db, device_id = home_fence
+    db.update_device_location(device_id, *north_of_home(5))
+    assert event_names(db, device_id) == []
+    db.update_device_location(device_id, *HOME)
+    assert event_names(db, device_id) == ['enter']
+
+
+def test_small_fences_can_be_entered(make_db):
+    db, user_id = make_db(username='eventuser')
+    device_id = db.register_device(user_id, 'event-phone', 'Phone')
+    # Smaller than the hysteresis band itself
+    db.add_geofence(device_id, 'Desk', HOME[0], HOME[1], 0.02)
+    db.update_device_location(device_id, *north_of_home(1))
+    db.update_device_location(device_id, *HOME)
+    assert event_names(db, device_id) == ['enter']
+
+
+def test_steady_state_points_write_nothing(home_fence):
+    db, device_id = home_fence
+    db.update_device_location(device_id, *north_of_home(5))
+    db.update_device_location(device_id, *HOME)
+    for _ in range(5):
+        assert db.update_geofence_states(device_id, [HOME + (track_server.epoch_ms(),)]) == []
+    assert len(db.get_geofence_events(device_id)) == 1
+
+
+def test_batch_ingest_tracks_transitions_in_time_order(home_fence):
+    db, device_id = home_fence
+    far = north_of_home(5)
+    # Deliberately out of order; timestamps decide the sequence
+    db.update_device_locations([
+        (device_id, far[0], far[1], None, None, None, None, 3000),
+        (device_id, HOME[0], HOME[1], None, None, None, None, 1000),
+        (device_id, far[0], far[1], None, None, None, None, 2000),
+        (device_id, HOME[0], HOME[1], None, None, None, None, 1500),
+        (device_id, far[0], far[1], None, None, None, None, 500),
+    ])
+    assert event_names(db, device_id) == ['enter', 'exit']
+
+
+def test_late_points_do_not_undo_newer_transitions(home_fence):
+    db, device_id = home_fence
+    far = north_of_home(5)
+    db.update_device_locations([(device_id, far[0], far[1], None, None, None, None, 500)])
+    db.update_device_locations([(device_id, HOME[0], HOME[1], None, None, None, None, 1000)])
+    db.update_device_locations([(device_id, far[0], far[1], None, None, None, None, 3000)])
+    # A catch-up batch delivers an older point after the newer exit
+    db.update_device_locations([(device_id, HOME[0], HOME[1], None, None, None, None, 2000)])
+    assert event_names(db, device_id) == ['enter', 'exit']
+    assert db.get_geofence_states(device_id)[0][5:] == (0, 3000)
+
+
+def test_events_are_paged_newest_first(home_fence):
+    db, device_id = home_fence
+    far = north_of_home(5)
+    for i in range(7):
+        db.update_device_location(device_id, *(far if i % 2 == 0 else HOME))
+
+    first_page = db.get_geofence_events(device_id, limit=4)
+    second_page = db.get_geofence_events(device_id, before_id=first_page[-1][0], limit=4)
+    ids = [row[0] for row in first_page + second_page]
+    assert len(ids) == 6
+    assert ids == sorted(ids, reverse=True)
+    assert first_page[0][2] == 'Home'
+
@@ -0,0 +1,112 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import track_client
+import track_server
+
+track_client.PROVIDER_HEDGE_DELAY = 0.05
+track_server.db.register_user('geouser', 'password123')
+
+calls = {}
+
+
+class StubProvider(BaseHTTPRequestHandler):
+    """Local stand-ins for the geolocation APIs, one behaviour per path"""
+
+    def do_GET(self):
+        calls[self.path] = calls.get(self.path, 0) + 1
+        if self.path == '/fail':
+            self.send_response(500)
+            self.end_headers()
+            return
+        if self.path == '/slow':
+            time.sleep(1)
+            body = {"latitude": 10.0, "longitude": 20.0, "ip": "203.0.113.1"}
+        else:
+            body = {"loc": "51.5,-0.12", "ip": "203.0.113.1", "city": "London"}
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+stub = ThreadingHTTPServer(('127.0.0.1', 0), StubProvider)
+threading.Thread(target=stub.serve_forever, daemon=True).start()
+stub_url = f"http://127.0.0.1:{stub.server_port}"
+
+
+def provider(path, parse):
+    return (path, stub_url + path, parse)
+
+
+def test_fastest_valid_provider_wins(server_url, client_dir):
+    tracker = track_client.DeviceTracker(server_url, 'geouser', 'password123', providers=[
+        provider('/slow', track_client.parse_ipapi),
+        provider('/fail', track_client.parse_ipinfo),
+        provider('/good', track_client.parse_ipinfo),
+    ])
+    start = time.monotonic()
+    location = tracker.get_location()
+    assert time.monotonic() - start < 0.5
+    assert (location["latitude"], location["city"]) == (51.5, 'London')
+    tracker.close()
+
+
+def test_failing_provider_is_demoted_then_benched(server_url, client_dir):
+    tracker = track_client.DeviceTracker(server_url, 'geouser', 'password123', providers=[
+        provider('/fail', track_client.parse_ipapi),
+        provider('/good', track_client.parse_ipinfo),
+    ])
+    before = calls.get('/fail', 0)
+    for _ in range(3):
+        assert tracker._race_providers()["city"] == 'London'
+    # After one failure the healthy provider is asked first and answers
+    assert calls['/fail'] - before == 1
+    tracker.close()
+
+    health = track_client.ProviderHealth()
+    for _ in range(track_client.PROVIDER_FAILURE_THRESHOLD):
+        health.record(False, 0.1, 100.0)
+    assert not health.available(100.0)
+    assert health.available(100.0 + track_client.PROVIDER_COOLDOWN)
+    health.record(False, 0.1, 200.0)
+    assert health.benched_until == 200.0 + 2 * track_client.PROVIDER_COOLDOWN
+    health.record(True, 0.1, 300.0)
+    assert health.available(300.0) and health.rank() == (0, 0.1)
+
+
+def test_location_is_cached_per_public_ip(server_url, client_dir):
+    tracker = track_client.DeviceTracker(server_url, 'geouser', 'password123', providers=[
+        provider('/cached', track_client.parse_ipinfo),
+    ])
+    assert tracker.update_location()
+    assert tracker.update_location()
+    assert calls['/cached'] == 1
+    assert tracker.public_ip == '127.0.0.1'
+
+    # The server reports an address other than the one the location was
+    # resolved for, so the update is resent with a fresh lookup
+    tracker.location_cache["ip"] = '198.51.100.7'
+    assert tracker.update_location()
+    assert calls['/cached'] == 2
+    assert tracker.location_cache["ip"] == '127.0.0.1'
+    tracker.close()
+
+
+
+def test_failed_lookup_is_not_reported(server_url, client_dir):
+    tracker = track_client.DeviceTracker(server_url, 'geouser', 'password123', providers=[
+        provider('/fail', track_client.parse_ipinfo),
+    ])
+    assert tracker.get_location() is None
+    assert not tracker.update_location()
+    tracker.report_location()
+    assert len(tracker.queue) == 0 and tracker.last_reported is None
+    tracker.close()
@@ -0,0 +1,150 @@
+import math
+import random
+
+import geomath
+from geomath import bounding_box, haversine_distance, haversine_many, inside_fences, simplify_track, zoom_tolerance_km
+
+
+def random_fences(rng, count):
+    fences = []
+    for _ in range(count):
+        fences.append((rng.uniform(-89, 89), rng.uniform(-180, 180), rng.choice([0.05, 1, 25, 500, 3000])))
+    return fences
+
+
+def points_near(rng, fences, count):
+    """Points scattered around fence centres, many of them close to the boundary"""
+    points = []
+    for _ in range(count):
+        lat, lon, radius = rng.choice(fences)
+        distance = radius * rng.uniform(0.9, 1.1) / geomath.KM_PER_DEGREE
+        bearing = rng.uniform(0, 2 * math.pi)
+        points.append((max(-90, min(90, lat + distance * math.cos(bearing))),
+                       (lon + distance * math.sin(bearing) + 180) % 360 - 180))
+    return points
+
+
+def scalar_inside(points, fences):
+    return [[haversine_distance(lat, lon, flat, flon) <= radius for flat, flon, radius in fences]
+            for lat, lon in points]
+
+
+def test_haversine_many_matches_scalar():
+    rng = random.Random(1)
+    targets = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(200)]
+    distances = haversine_many(51.5, -0.12, [t[0] for t in targets], [t[1] for t in targets])
+    for (lat, lon), distance in zip(targets, distances):
+        assert math.isclose(distance, haversine_distance(51.5, -0.12, lat, lon), rel_tol=1e-9, abs_tol=1e-9)
+
+
+def test_inside_fences_matches_scalar():
+    rng = random.Random(2)
+    fences = random_fences(rng, 60)
+    points = points_near(rng, fences, 300) + [(90, 0), (-90, 45), (0, 180), (0, -180)]
+    inside = inside_fences([p[0] for p in points], [p[1] for p in points],
+                           [f[0] for f in fences], [f[1] for f in fences], [f[2] for f in fences])
+    assert inside == scalar_inside(points, fences)
+
+
+def test_antimeridian_and_pole_fences():
+    # Repeat the fences so the vectorized path is exercised
+    fences = [(0.0, 179.99, 5.0), (89.9, 0.0, 50.0)] * geomath.VECTORIZE_MIN_PAIRS
+    points = [(0.0, -179.99), (89.95, 170.0), (0.0, 170.0)]
+    inside = inside_fences([p[0] for p in points], [p[1] for p in points],
+                           [f[0] for f in fences], [f[1] for f in fences], [f[2] for f in fences])
+    assert inside == [[True, False] * geomath.VECTORIZE_MIN_PAIRS,
+                      [False, True] * geomath.VECTORIZE_MIN_PAIRS,
+                      [False, False] * geomath.VECTORIZE_MIN_PAIRS]
+
+
+def test_bounding_box_contains_circle():
+    rng = random.Random(3)
+    for lat, lon, radius in random_fences(rng, 50):
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius)
+        for bearing in range(0, 360, 15):
+            # Walk to the circle's edge along the bearing
+            angular = radius / geomath.EARTH_RADIUS_KM
+            lat1, lon1, theta = math.radians(lat), math.radians(lon), math.radians(bearing)
+            lat2 = math.asin(math.sin(lat1) * math.cos(angular) +
+                             math.cos(lat1) * math.sin(angular) * math.cos(theta))
+            lon2 = lon1 + math.atan2(math.sin(theta) * math.sin(angular) * math.cos(lat1),
+                                     math.cos(angular) - math.sin(lat1) * math.sin(lat2))
+            edge_lat = math.degrees(lat2)
+            edge_lon = (math.degrees(lon2) + 180) % 360 - 180
+            assert min_lat - 1e-6 <= edge_lat <= max_lat + 1e-6
+            assert min_lon - 1e-6 <= edge_lon <= max_lon + 1e-6
+
+
+def test_scalar_fallback_without_numpy():
+    saved, geomath.np = geomath.np, None
+    try:
+        rng = random.Random(4)
+        fences = random_fences(rng, 10)
+        points = points_near(rng, fences, 50)
+        inside = inside_fences([p[0] for p in points], [p[1] for p in points],
+                               [f[0] for f in fences], [f[1] for f in fences], [f[2] for f in fences])
+        assert inside == scalar_inside(points, fences)
+        assert haversine_many(0, 0, [0], [1]) == [haversine_distance(0, 0, 0, 1)]
+    finally:
+        geomath.np = saved
+
+
+def random_walk(rng, count, lat=48.0, lon=11.0):
+    latitudes, longitudes = [], []
+    for _ in range(count):
+        lat += rng.gauss(0, 0.001)
+        lon += rng.gauss(0, 0.001)
+        latitudes.append(lat)
+        longitudes.append(lon)
+    return latitudes, longitudes
+
+
+def test_simplify_keeps_track_within_tolerance():
+    rng = random.Random(5)
+    latitudes, longitudes = random_walk(rng, 2000)
+    kept = simplify_track(latitudes, longitudes, 0.5)
+    assert kept[0] == 0 and kept[-1] == len(latitudes) - 1
+    assert kept == sorted(kept) and len(kept) < len(latitudes) / 4
+    # Every dropped point lies within tolerance of the segment replacing it
+    for a, b in zip(kept, kept[1:]):
+        samples = [(latitudes[a] + (latitudes[b] - latitudes[a]) * t / 200,
+                    longitudes[a] + (longitudes[b] - longitudes[a]) * t / 200) for t in range(201)]
+        for i in range(a + 1, b):
+            distance = min(haversine_distance(latitudes[i], longitudes[i], lat, lon) for lat, lon in samples)
+            assert distance <= 0.5 * 1.02
+
+
+def test_simplify_straight_line_and_spike():
+    latitudes = [0.0] * 11
+    longitudes = [i / 100 for i in range(11)]
+    assert simplify_track(latitudes, longitudes, 0.01) == [0, 10]
+    # A 222 m spike survives a 200 m tolerance; its neighbours (178 m) do not
+    latitudes[5] = 0.002
+    assert simplify_track(latitudes, longitudes, 0.2) == [0, 5, 10]
+    assert simplify_track(latitudes, longitudes, 0.3) == [0, 10]
+    assert simplify_track(latitudes, longitudes, 0) == list(range(11))
+
+
+def test_simplify_round_trip_and_antimeridian():
+    # Out and back: the far end must survive even though start == end
+    assert simplify_track([0, 0, 0], [0, 1, 0], 0.1) == [0, 1, 2]
+    # A straight track across the antimeridian collapses to its endpoints
+    assert simplify_track([10, 10, 10], [179.9, 180.0, -179.9], 0.1) == [0, 2]
+
+
+def test_simplify_scalar_matches_numpy():
+    rng = random.Random(6)
+    latitudes, longitudes = random_walk(rng, 1000)
+    vectorized = simplify_track(latitudes, longitudes, 0.02)
+    saved, geomath.np = geomath.np, None
+    try:
+        assert simplify_track(latitudes, longitudes, 0.02) == vectorized
+    finally:
+        geomath.np = saved
+
+
+def test_zoom_tolerance_halves_per_level():
+    assert abs(zoom_tolerance_km(0) - 2 * math.pi * geomath.EARTH_RADIUS_KM / 256) < 1e-9
+    assert abs(zoom_tolerance_km(10) * 2 - zoom_tolerance_km(9)) < 1e-12
+    assert zoom_tolerance_km(10, 60) < zoom_tolerance_km(10)
+
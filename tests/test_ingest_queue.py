@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from ingest import LocationWriter
+
+
+@pytest.fixture
+def queue_device(make_db):
+    db, user_id = make_db(username='queueuser')
+    return db, db.register_device(user_id, 'queue-laptop', 'Laptop')
+
+
+def count_locations(db, device_id):
+    with db._reader() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM locations WHERE device_id = ?", (device_id,)
+        ).fetchone()[0]
+
+
+def test_async_writer_groups_commits_and_flushes_on_stop(queue_device):
+    db, device_id = queue_device
+    writer = LocationWriter(db, max_batch=100, max_delay=0.05).start()
+
+    for i in range(250):
+        assert writer.submit((device_id, 10.0, 20.0 + i * 0.001, None, None, None, None))
+    writer.stop()
+
+    stats = writer.stats()
+    assert count_locations(db, device_id) == 250
+    assert stats['committed'] == 250
+    assert stats['queue_depth'] == 0
+    # 250 points must not have needed one commit each
+    assert stats['batches'] < 250
+
+
+def test_group_mode_waits_for_commit(queue_device):
+    db, device_id = queue_device
+    writer = LocationWriter(db, max_batch=50, max_delay=0.01, wait_for_commit=True).start()
+
+    def post(i):
+        assert writer.submit((device_id, 10.0, 20.0 + i * 0.001, None, None, None, None))
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    # Every acknowledged point is already committed
+    assert count_locations(db, device_id) == 20
+    writer.stop()
+
+
+def test_full_queue_rejects_whole_batch(queue_device):
+    db, device_id = queue_device
+    # Not started, so nothing drains the queue
+    writer = LocationWriter(db, max_queue=5)
+    point = (device_id, 10.0, 20.0, None, None, None, None)
+
+    assert writer.submit_many([point] * 4)
+    assert not writer.submit_many([point] * 2)
+    assert writer.depth() == 4
+    assert writer.stats()['rejected'] == 2
+
+    writer.start().stop()
+    assert count_locations(db, device_id) == 4
+
+
+
+def test_stopped_writer_rejects_points(queue_device):
+    db, device_id = queue_device
+    writer = LocationWriter(db).start()
+    writer.stop()
+    assert not writer.submit((device_id, 10.0, 20.0, None, None, None, None))
+    assert writer.depth() == 0 and writer.stats()['rejected'] == 1
+
+
+def test_group_mode_gives_up_waiting(queue_device):
+    db, device_id = queue_device
+    # Never started, so the group never commits
+    writer = LocationWriter(db, wait_for_commit=True, commit_timeout=0.05)
+    with pytest.raises(TimeoutError):
+        writer.submit((device_id, 10.0, 20.0, None, None, None, None))
+    # The point stays queued and is written once the writer runs
+    writer.start().stop()
+    assert count_locations(db, device_id) == 1
@@ -0,0 +1,84 @@
+import json
+
+from pubsub import LocationBroker
+import track_server
+
+
+def test_broker_fans_out_and_caps_subscribers():
+    broker = LocationBroker(max_subscribers=2, queue_size=10)
+    first = broker.subscribe(('device', 1))
+    second = broker.subscribe(('device', 1))
+    assert broker.subscribe(('device', 2)) is None
+    broker.publish(('device', 1), {"n": 1})
+    broker.publish(('device', 2), {"n": 2})
+    assert first.get(0) == {"n": 1} and second.get(0) == {"n": 1}
+    assert first.get(0) is None
+    broker.unsubscribe(first)
+    broker.unsubscribe(first)
+    assert broker.stats()["subscribers"] == 1
+    assert broker.subscribe(('device', 2)) is not None
+
+
+def test_slow_consumer_is_evicted():
+    broker = LocationBroker(queue_size=3)
+    slow = broker.subscribe(('user', 'alice'))
+    fast = broker.subscribe(('user', 'alice'))
+    for i in range(5):
+        broker.publish(('user', 'alice'), {"n": i})
+        fast.get(0)
+    assert slow.evicted and not fast.evicted
+    assert broker.stats()["evictions"] == 1
+    assert not broker.has_subscribers(('user', 'bob'))
+    assert broker.stats()["subscribers"] == 1
+
+
+def test_ingest_publishes_to_device_and_owner(make_db):
+    db, user_id = make_db(username='streamer')
+    device_id = db.register_device(user_id, 'laptop', 'Laptop')
+    other_id = db.register_device(user_id, 'desktop', 'Desktop')
+
+    # Nothing is built or published while nobody listens
+    db.update_device_location(device_id, 1.0, 2.0)
+    assert db.broker.stats()["published"] == 0
+
+    device_stream = db.broker.subscribe(('device', device_id))
+    fleet_stream = db.broker.subscribe(('user', 'streamer'))
+    db.update_device_location(device_id, 40.0, -74.0, city='New York')
+    event = device_stream.get(0)
+    assert (event["latitude"], event["longitude"], event["city"]) == (40.0, -74.0, 'New York')
+    assert fleet_stream.get(0)["device_id"] == device_id
+
+    # A batch publishes only each device's newest point
+    db.update_device_locations([
+        (device_id, 1.0, 1.0, None, None, None, None, 1),
+        (device_id, 3.0, 3.0, None, None, None, None, 3),
+        (other_id, 2.0, 2.0, None, None, None, None, 2),
+    ])
+    assert device_stream.get(0)["latitude"] == 3.0 and device_stream.get(0) is None
+    assert {fleet_stream.get(0)["device_id"], fleet_stream.get(0)["device_id"]} == {device_id, other_id}
+
+
+def test_device_stream_endpoint():
+    db = track_server.db
+    db.register_user('sseuser', 'password123')
+    user_id = db.verify_user('sseuser', 'password123')
+    device_id = db.register_device(user_id, 'sse-laptop', 'Laptop')
+    client = track_server.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['username'] = 'sseuser'
+
+    subscribers = db.broker.stats()["subscribers"]
+    response = client.get(f'/api/device/{device_id}/stream', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    body = (chunk.decode() for chunk in response.response)
+    assert next(body).startswith('retry:')
+    db.update_device_location(device_id, 51.5, -0.12)
+    chunk = next(body)
+    assert chunk.startswith('event: location\n')
+    assert json.loads(chunk.split('data: ', 1)[1])["latitude"] == 51.5
+    response.close()
+    assert db.broker.stats()["subscribers"] == subscribers
+
+    assert client.get(f'/api/device/{device_id + 1000}/stream').status_code == 404
+
@@ -0,0 +1,130 @@
+import csv
+import io
+import json
+
+import track_server
+
+db = track_server.db
+db.register_user('historyuser', 'password123')
+user_id = db.verify_user('historyuser', 'password123')
+device_id = db.register_device(user_id, 'history-laptop', 'Laptop')
+# 50 points, two per timestamp so pages have to break ties on id
+db.update_device_locations([
+    (device_id, 40 + i / 100, -74.0, None, 'City', None, None, 1000 * (i // 2))
+    for i in range(50)
+])
+
+client = track_server.app.test_client()
+with client.session_transaction() as sess:
+    sess['user_id'] = user_id
+    sess['username'] = 'historyuser'
+
+
+def fetch_all_pages(**params):
+    ids = []
+    cursor = None
+    while True:
+        query = dict(params, limit=7)
+        if cursor:
+            query['cursor'] = cursor
+        data = client.get(f'/api/device/{device_id}/history', query_string=query).get_json()
+        assert data['status'] == 'success'
+        ids.extend(location['id'] for location in data['locations'])
+        cursor = data['next_cursor']
+        if cursor is None:
+            return ids
+
+
+def test_pages_cover_history_once_in_order():
+    ids = fetch_all_pages()
+    assert len(ids) == 50 and len(set(ids)) == 50
+    assert ids == sorted(ids, reverse=True)
+    assert fetch_all_pages(order='asc') == sorted(ids)
+
+
+def test_time_range_filters():
+    ids = fetch_all_pages(start=5000, end=10000)
+    # Timestamps 5..9 seconds, two points each
+    assert len(ids) == 10
+    rows = db.get_location_page(device_id, 5000, 10000, limit=100)
+    assert {row[7] for row in rows} == {5000, 6000, 7000, 8000, 9000}
+
+
+def test_iter_history_batches_match_single_query():
+    streamed = [row[0] for row in db.iter_location_history(device_id, batch_size=4)]
+    single = [row[0] for row in db.get_location_page(device_id, limit=100, newest_first=False)]
+    assert streamed == single and len(streamed) == 50
+
+
+def test_export_formats():
+    response = client.get(f'/api/device/{device_id}/history/export?format=ndjson')
+    lines = response.get_data(as_text=True).splitlines()
+    assert response.mimetype == 'application/x-ndjson'
+    assert len(lines) == 50 and json.loads(lines[0])['city'] == 'City'
+
+    response = client.get(f'/api/device/{device_id}/history/export?format=csv&start=1000&end=2000')
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == list(track_server.HISTORY_COLUMNS)
+    assert len(rows) == 3
+
+    response = client.get(f'/api/device/{device_id}/history/export?format=csv&start=999999')
+    assert response.get_data(as_text=True).splitlines() == [','.join(track_server.HISTORY_COLUMNS)]
+
+    response = client.get(f'/api/device/{device_id}/history/export?format=geojson')
+    collection = json.loads(response.get_data(as_text=True))
+    assert len(collection['features']) == 50
+    assert collection['features'][0]['geometry']['coordinates'] == [-74.0, 40.0]
+
+    assert client.get(f'/api/device/{device_id}/history/export?format=xml').status_code == 400
+
+
+def test_history_requires_ownership():
+    other = db.register_device(None, 'orphan', 'Laptop')
+    assert client.get(f'/api/device/{other}/history').status_code == 404
+    assert client.get(f'/api/device/{device_id}/history?cursor=bogus').status_code == 400
+
+
+def test_simplified_history_is_cached_until_new_points():
+    track_id = db.register_device(user_id, 'track-laptop', 'Laptop')
+    # A straight northward track: every interior point is redundant
+    db.update_device_locations([
+        (track_id, 40 + i / 1000, -74.0, None, None, None, None, 1000 * i) for i in range(200)
+    ])
+    data = client.get(f'/api/device/{track_id}/history?tolerance=0.01&order=asc').get_json()
+    assert data['raw_points'] == 200
+    assert [location['timestamp'] for location in data['locations']] == [0, 199000]
+
+    hits = db.track_cache.stats()['hits']
+    client.get(f'/api/device/{track_id}/history?tolerance=0.01&order=asc')
+    assert db.track_cache.stats()['hits'] == hits + 1
+
+    # A detour invalidates the cached track
+    db.update_device_locations([(track_id, 40.1, -73.9, None, None, None, None, 300000)])
+    data = client.get(f'/api/device/{track_id}/history?tolerance=0.01&order=asc').get_json()
+    assert data['raw_points'] == 201 and len(data['locations']) == 3
+
+    data = client.get(f'/api/device/{track_id}/history?zoom=15').get_json()
+    assert data['status'] == 'success' and data['locations'][0]['timestamp'] == 300000
+    assert client.get(f'/api/device/{track_id}/history?zoom=40').status_code == 400
+
+
+
+def test_long_windows_are_simplified_in_chunks(monkeypatch):
+    track_id = db.register_device(user_id, 'busy-laptop', 'Laptop')
+    # Northward, with a detour east every 25 points
+    db.update_device_locations([
+        (track_id, 40 + i / 1000, -74.0 + (0.01 if i % 25 == 12 else 0), None, None, None, None, 1000 * i)
+        for i in range(100)
+    ])
+    whole = db.get_simplified_track(track_id, tolerance_km=0.01)
+    monkeypatch.setattr(track_server, 'SIMPLIFY_CHUNK_POINTS', 10)
+    rows, raw_count = db.get_simplified_track(track_id, start=0, tolerance_km=0.01)
+    assert raw_count == 100
+    timestamps = [row[7] for row in rows]
+    assert timestamps == sorted(set(timestamps))
+    # Every detour survives; chunk boundaries may add a few redundant points
+    assert {row[0] for row in whole[0]} <= {row[0] for row in rows}
+    assert len(rows) <= len(whole[0]) + 10
+
+    data = client.get(f'/api/device/{track_id}/history?tolerance=0.01&order=asc').get_json()
+    assert data['status'] == 'success' and data['raw_points'] == 100
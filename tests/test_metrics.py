@@ -0,0 +1,92 @@
+import threading
+import time
+
+from metrics import Counter, Histogram, SamplingProfiler
+import track_server
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram('demo_seconds', 'Demo', ('route',), buckets=(0.1, 1.0))
+    histogram.observe(('/a',), 0.05)
+    histogram.observe(('/a',), 0.5)
+    histogram.observe(('/a',), 3.0)
+    lines = histogram.render()
+    assert 'demo_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'demo_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'demo_seconds_count{route="/a"} 3' in lines
+
+    counter = Counter('demo_total', 'Demo', ('name',))
+    counter.inc(('say "hi"',), 2)
+    assert counter.render()[-1] == 'demo_total{name="say \\"hi\\""} 2'
+
+
+def test_lock_wait_is_split_from_execution(make_db):
+    db, user_id = make_db(username='timer')
+
+    # Hold the writer lock so register_device has to wait for it
+    held = threading.Event()
+
+    def hold_lock():
+        with db.lock:
+            held.set()
+            time.sleep(0.05)
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    held.wait()
+    db.register_device(user_id, 'laptop', 'Laptop')
+    holder.join()
+
+    series = db.metrics.lock_wait.series[('register_device',)]
+    assert series[1] >= 0.03
+    assert db.metrics.execute.series[('register_device',)][1] < series[1]
+    assert db.metrics.commits.get(('register_device',)) == 1
+    assert db.metrics.rows_written.get(('register_user',)) == 1
+
+
+def test_metrics_endpoint():
+    client = track_server.app.test_client()
+    client.get('/api/health')
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'tracker_http_request_duration_seconds_count{method="GET",route="/api/health",status="200"}' in body
+    assert '# TYPE tracker_db_execute_seconds histogram' in body
+    assert 'tracker_cache_hits_total{cache="device"}' in body
+
+
+def test_profiler_samples_tracked_threads():
+    profiler = SamplingProfiler(interval=0.001)
+
+    def spin_in_hot_path():
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            pass
+
+    thread = threading.Thread(target=lambda: (profiler.track(threading.get_ident()), spin_in_hot_path()))
+    profiler.start()
+    thread.start()
+    thread.join()
+    profiler.stop()
+    report = profiler.report()
+    assert report["samples"] > 0 and not report["running"]
+    assert any('spin_in_hot_path' in stack for stack in report["folded"])
+
+
+def test_profile_toggle_requires_login(monkeypatch):
+    client = track_server.app.test_client()
+    assert client.post('/api/debug/profile', json={"action": "start"}).status_code == 302
+
+    db = track_server.db
+    db.register_user('profiler', 'password123')
+    with client.session_transaction() as sess:
+        sess['user_id'] = db.verify_user('profiler', 'password123')
+        sess['username'] = 'profiler'
+    # Off unless the operator enables it
+    assert client.post('/api/debug/profile', json={"action": "start"}).status_code == 404
+    assert not track_server.profiler.running
+
+    monkeypatch.setattr(track_server, 'ENABLE_PROFILER', True)
+    assert client.post('/api/debug/profile', json={"action": "start"}).get_json()["profile"]["running"]
+    assert client.post('/api/debug/profile', json={"action": "bogus"}).status_code == 400
+    assert not client.post('/api/debug/profile', json={"action": "stop"}).get_json()["profile"]["running"]
+
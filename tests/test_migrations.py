@@ -0,0 +1,110 @@
+import sqlite3
+
+from migrations import (MIGRATIONS, apply_migrations, enable_incremental_vacuum, ensure_latest_location_table,
+                        get_schema_version, incremental_vacuum_enabled, migrate_epoch_timestamps)
+
+
+def make_legacy_db(path, points):
+    """Create a pre-migration database with TEXT timestamps"""
+    conn = sqlite3.connect(path)
+    MIGRATIONS[0](conn)
+    conn.executemany(
+        "INSERT INTO locations (device_id, latitude, longitude, timestamp) VALUES (?, ?, ?, ?)",
+        [(1, 10.0 + i, 20.0, f"2025-04-18 12:00:{i:02d}") for i in range(points)]
+    )
+    conn.commit()
+    return conn
+
+
+def test_migrates_text_timestamps_to_epoch_ms(tmp_path):
+    conn = make_legacy_db(tmp_path / 'legacy.db', 25)
+    assert apply_migrations(conn) == len(MIGRATIONS)
+
+    rows = conn.execute(
+        "SELECT strftime('%Y-%m-%d %H:%M:%S', timestamp / 1000, 'unixepoch', 'localtime'), typeof(timestamp) "
+        "FROM locations ORDER BY id"
+    ).fetchall()
+    assert rows[0] == ('2025-04-18 12:00:00', 'integer')
+    assert rows[-1][0] == '2025-04-18 12:00:24'
+
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'idx_locations_device_ts', 'idx_devices_user', 'idx_geofences_device'} <= indexes
+    conn.close()
+
+
+def test_interrupted_rebuild_resumes(tmp_path):
+    conn = make_legacy_db(tmp_path / 'resume.db', 10)
+    # Simulate a run that stopped after copying the first rows
+    conn.execute(
+        "CREATE TABLE locations_v2 (id INTEGER PRIMARY KEY, device_id INTEGER, latitude REAL NOT NULL, "
+        "longitude REAL NOT NULL, ip_address TEXT, city TEXT, region TEXT, country TEXT, timestamp INTEGER NOT NULL)"
+    )
+    conn.execute("INSERT INTO locations_v2 SELECT id, device_id, latitude, longitude, ip_address, city, "
+                 "region, country, 0 FROM locations WHERE id <= 4")
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+
+    migrate_epoch_timestamps(conn, batch_size=3)
+    assert conn.execute("SELECT COUNT(*) FROM locations").fetchone()[0] == 10
+    assert conn.execute("SELECT COUNT(*) FROM locations WHERE timestamp > 0").fetchone()[0] == 6
+    conn.close()
+
+
+def test_epoch_timestamps_survive_a_rerun(tmp_path):
+    conn = make_legacy_db(tmp_path / 'rerun.db', 5)
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    migrate_epoch_timestamps(conn)
+    # The swap and the version bump commit together
+    assert get_schema_version(conn) == 2
+    converted = conn.execute("SELECT timestamp FROM locations ORDER BY id").fetchall()
+    assert all(row[0] > 0 for row in converted)
+
+    # A run that lost its version bump must not convert integers again
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    migrate_epoch_timestamps(conn)
+    assert conn.execute("SELECT timestamp FROM locations ORDER BY id").fetchall() == converted
+    conn.close()
+
+
+def test_apply_migrations_is_idempotent(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'fresh.db')
+    assert apply_migrations(conn) == len(MIGRATIONS)
+    assert apply_migrations(conn) == len(MIGRATIONS)
+    assert get_schema_version(conn) == len(MIGRATIONS)
+    conn.close()
+
+
+def test_incremental_vacuum_is_an_explicit_step(tmp_path):
+    fresh = sqlite3.connect(tmp_path / 'fresh.db')
+    apply_migrations(fresh)
+    assert incremental_vacuum_enabled(fresh)
+    fresh.close()
+
+    # Tables created before migration 1 pinned auto_vacuum off; migrating
+    # leaves the file alone until the offline conversion
+    conn = sqlite3.connect(tmp_path / 'old.db')
+    conn.execute("CREATE TABLE legacy (id INTEGER)")
+    apply_migrations(conn)
+    assert not incremental_vacuum_enabled(conn)
+    assert enable_incremental_vacuum(conn)
+    assert incremental_vacuum_enabled(conn)
+    assert not enable_incremental_vacuum(conn)
+    conn.close()
+
+
+def test_latest_location_table_rebuilt_when_missing(tmp_path):
+    conn = make_legacy_db(tmp_path / 'latest.db', 5)
+    conn.execute("INSERT INTO devices (id, user_id, device_name, device_type, registered_date) "
+                 "VALUES (1, 1, 'laptop', 'Laptop', '2025-04-18 12:00:00')")
+    conn.commit()
+    apply_migrations(conn)
+    conn.execute("DROP TABLE device_latest_location")
+
+    ensure_latest_location_table(conn)
+    assert conn.execute(
+        "SELECT device_id, latitude FROM device_latest_location"
+    ).fetchall() == [(1, 14.0)]
+    conn.close()
+
@@ -0,0 +1,155 @@
+import pytest
+from werkzeug.serving import make_server
+
+import track_client
+import track_server
+
+track_server.db.register_user('queueuser', 'password123')
+
+
+def unused_url():
+    probe = make_server('127.0.0.1', 0, track_server.app)
+    url = f"http://127.0.0.1:{probe.server_port}"
+    probe.server_close()
+    return url
+
+
+@pytest.fixture
+def make_tracker(client_dir):
+    trackers = []
+
+    def make(url, name):
+        tracker = track_client.DeviceTracker(url, 'queueuser', 'password123',
+                                             queue_path=str(client_dir / f'{name}.db'))
+        trackers.append(tracker)
+        tracker.hostname = name
+        tracker.get_location = lambda: {"latitude": 40.0, "longitude": -74.0, "ip_address": None,
+                                        "city": None, "region": None, "country": None}
+        return tracker
+
+    yield make
+    for tracker in trackers:
+        tracker.close()
+
+
+def batch_requests():
+    return track_server.request_duration.count(('POST', '/api/update_locations', '200'))
+
+
+def test_outage_is_queued_and_caught_up_in_batches(make_tracker, server_url):
+    # Skip the session's own connect retries so each cycle fails at once
+    original_retries = track_client.HTTP_RETRIES
+    track_client.HTTP_RETRIES = 0
+    try:
+        tracker = make_tracker(unused_url(), 'offline-laptop')
+    finally:
+        track_client.HTTP_RETRIES = original_retries
+    for _ in range(5):
+        assert not tracker.update_location()
+        # Pretend the backoff has passed so every cycle tries the network
+        tracker.retry_at = 0.0
+    assert len(tracker.queue) == 5 and tracker.upload_failures == 5
+
+    queued = [point["timestamp"] for _, point in tracker.queue.peek(10)]
+    tracker.server_url = server_url
+    tracker.retry_at = 0.0
+    before = batch_requests()
+    original_batch_size = track_client.QUEUE_BATCH_SIZE
+    track_client.QUEUE_BATCH_SIZE = 2
+    try:
+        assert tracker.flush_queue()
+    finally:
+        track_client.QUEUE_BATCH_SIZE = original_batch_size
+    assert batch_requests() - before == 3
+    assert len(tracker.queue) == 0 and tracker.upload_failures == 0
+
+    with track_server.db._reader() as conn:
+        stored = [row[0] for row in conn.execute(
+            "SELECT timestamp FROM locations WHERE device_id = ? ORDER BY id", (tracker.device_id,))]
+    # Client timestamps survive, shifted by at most the measured clock skew
+    assert len(stored) == 5
+    assert all(abs(s - q - (stored[0] - queued[0])) <= 5 for s, q in zip(stored, queued))
+
+
+def test_queue_survives_restart(tmp_path):
+    path = str(tmp_path / 'restart.db')
+    queue = track_client.OfflineQueue(path)
+    queue.put({"latitude": 1.0, "longitude": 2.0, "timestamp": 1})
+    queue.put({"latitude": 3.0, "longitude": 4.0, "timestamp": 2})
+    queue.close()
+
+    queue = track_client.OfflineQueue(path, max_points=2)
+    assert [point["timestamp"] for _, point in queue.peek(10)] == [1, 2]
+    queue.put({"latitude": 5.0, "longitude": 6.0, "timestamp": 3})
+    batch = queue.peek(10)
+    assert [point["timestamp"] for _, point in batch] == [2, 3]
+    queue.remove_through(batch[0][0])
+    assert len(queue) == 1
+    queue.close()
+
+
+def test_server_corrects_client_clock_skew():
+    client = track_server.app.test_client()
+    data = client.post('/api/client/register', json={
+        'username': 'queueuser', 'password': 'password123', 'hostname': 'skewed-laptop', 'os_info': 'Linux'
+    }).get_json()
+    # The client clock runs an hour behind; its point was taken a minute ago
+    client_now = track_server.epoch_ms() - 3600 * 1000
+    response = client.post('/api/update_locations', json={
+        "sent_at": client_now,
+        "points": [{"latitude": 1.0, "longitude": 2.0, "timestamp": client_now - 60 * 1000},
+                   {"latitude": 1.0, "longitude": 2.0, "timestamp": client_now + 3600 * 1000},
+                   {"latitude": 1.0, "longitude": 2.0, "timestamp": "soon"},
+                   {"device_id": data['device_id'] + 1000, "latitude": 1.0, "longitude": 2.0}]
+    }, headers={'Authorization': f"Bearer {data['device_token']}"})
+    body = response.get_json()
+    assert body["accepted"] == 2
+    assert [result["status"] for result in body["results"]] == ['success', 'success', 'error', 'error']
+    with track_server.db._reader() as conn:
+        stored = [row[0] for row in conn.execute(
+            "SELECT timestamp FROM locations WHERE device_id = ? ORDER BY id", (data['device_id'],))]
+    now = track_server.epoch_ms()
+    assert abs(now - 60 * 1000 - stored[0]) < 5000
+    # Future points are clamped to the server clock
+    assert now - 5000 < stored[1] <= now
+
+
+def test_backoff_is_jittered_and_honours_retry_after(make_tracker, server_url):
+    tracker = make_tracker(server_url, 'backoff-laptop')
+    delays = []
+    for _ in range(4):
+        tracker._back_off()
+        delays.append(tracker.retry_at - track_client.time.monotonic())
+    for attempt, delay in enumerate(delays):
+        assert delay <= track_client.UPLOAD_BACKOFF_BASE * 2 ** attempt
+    assert not tracker.flush_queue()
+
+    class Throttled:
+        headers = {"Retry-After": "7200"}
+
+    tracker._back_off(Throttled())
+    assert tracker.retry_at - track_client.time.monotonic() > 7000
+
+
+
+def test_points_for_an_unknown_device_stay_queued(make_tracker, server_url):
+    tracker = make_tracker(server_url, 'deleted-laptop')
+    assert tracker.register_device()
+    register_device = tracker.register_device
+
+    def register_deleted_device():
+        # The server answers, but the device is gone again before the upload
+        assert register_device()
+        tracker.device_id, tracker.device_token = tracker.device_id + 1000, None
+        return True
+
+    tracker.register_device = register_deleted_device
+    tracker.device_id, tracker.device_token = tracker.device_id + 1000, None
+    assert not tracker.update_location()
+    assert len(tracker.queue) == 1 and tracker.upload_failures == 1
+
+    tracker.register_device = register_device
+    tracker.retry_at = 0.0
+    assert tracker.flush_queue()
+    assert len(tracker.queue) == 0
+    assert track_server.db.get_latest_device_location(tracker.device_id)[:2] == (40.0, -74.0)
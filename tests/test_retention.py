@@ -0,0 +1,121 @@
+from geomath import path_distances
+from maintenance import DAY_MS, HOUR_MS, MaintenanceJob, policy_for, summarize_buckets
+import track_server
+
+NOW = 100 * DAY_MS
+
+
+def tracked_device(make_db, points):
+    """A database holding one device with the given (lat, lon, timestamp) points"""
+    db, user_id = make_db(username='retention')
+    device_id = db.register_device(user_id, 'laptop', 'Laptop (Linux)')
+    db.update_device_locations([
+        (device_id, lat, lon, None, None, None, None, timestamp) for lat, lon, timestamp in points
+    ])
+    return db, user_id, device_id
+
+
+def three_days():
+    return [(40 + i / 1000, -74 + (i % 7) / 1000, NOW - 3 * DAY_MS + i * 10 * 60 * 1000)
+            for i in range(3 * 24 * 6)]
+
+
+def test_summarize_buckets():
+    rows = [(0.0, 0.0, 0), (0.0, 1.0, 1000), (0.0, 2.0, HOUR_MS)]
+    buckets = summarize_buckets(rows, HOUR_MS)
+    steps = path_distances([0, 0, 0], [0, 1, 2])
+    assert sorted(buckets) == [0, HOUR_MS]
+    assert buckets[0][:3] == [2, 0.0, 1.0]
+    assert abs(buckets[0][7] - steps[0]) < 1e-9
+    # The step into the second hour is credited to that hour
+    assert abs(buckets[HOUR_MS][7] - steps[1]) < 1e-9
+
+
+def test_policy_precedence():
+    policies = [(None, 'Laptop', 30, 60), (7, None, 10, 20), (7, 'Phone', 1, 2)]
+    assert policy_for(policies, 7, 'Phone', (90, 730)) == (1, 2)
+    assert policy_for(policies, 7, 'Laptop (Linux)', (90, 730)) == (10, 20)
+    assert policy_for(policies, 8, 'Laptop (Linux)', (90, 730)) == (30, 60)
+    assert policy_for(policies, 8, 'Laptopish', (90, 730)) == (90, 730)
+
+
+def test_compaction_preserves_totals_across_batches(make_db):
+    points = three_days()
+    db, _, device_id = tracked_device(make_db, points)
+    job = MaintenanceJob(db, interval=0, batch_size=7, default_policy=(1, 0))
+    stats = job.run_once(now=NOW)
+
+    cutoff = NOW - DAY_MS
+    old = [point for point in points if point[2] < cutoff]
+    assert stats["compacted"] == len(old)
+    remaining = db.get_location_page(device_id, limit=1000)
+    assert len(remaining) == len(points) - len(old)
+
+    hourly = db.get_location_rollups(device_id, 'hour')
+    daily = db.get_location_rollups(device_id, 'day')
+    assert len(hourly) == 48 and len(daily) == 2
+    expected_distance = sum(path_distances([p[0] for p in old], [p[1] for p in old]))
+    for rollups in (hourly, daily):
+        assert sum(row[2] for row in rollups) == len(old)
+        assert abs(sum(row[9] for row in rollups) - expected_distance) < 1e-6
+    first_hour = old[:6]
+    assert abs(hourly[0][3] - sum(p[0] for p in first_hour) / 6) < 1e-9
+    assert hourly[0][5] == min(p[0] for p in first_hour)
+
+    # A second pass has nothing left to do
+    assert job.run_once(now=NOW)["compacted"] == 0
+
+
+def test_user_policy_and_hourly_pruning(make_db):
+    db, user_id, device_id = tracked_device(make_db, three_days())
+    db.set_retention_policy(2, 1, user_id=user_id)
+    db.set_retention_policy(2, 1, user_id=user_id)
+    assert len(db.get_retention_policies()) == 1
+    job = MaintenanceJob(db, interval=0, default_policy=(0, 0))
+    stats = job.run_once(now=NOW)
+    assert stats["compacted"] == 24 * 6
+    # Hourly rollups older than a day are pruned, the daily one stays
+    assert stats["pruned_rollups"] == 24
+    assert db.get_location_rollups(device_id, 'hour') == []
+    assert len(db.get_location_rollups(device_id, 'day')) == 1
+
+
+def test_incremental_vacuum_frees_pages(make_db):
+    points = [(40.0, -74.0, NOW - 10 * DAY_MS + i * 1000) for i in range(20000)]
+    db, _, device_id = tracked_device(make_db, points)
+    conn = db._writer()
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    stats = MaintenanceJob(db, interval=0, batch_size=5000, vacuum_pages=50,
+                           default_policy=(1, 0)).run_once(now=NOW)
+    assert stats["compacted"] == 20000
+    assert stats["vacuumed_pages"] > 0
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+
+
+def test_rollups_endpoint():
+    db = track_server.db
+    db.register_user('rollupuser', 'password123')
+    user_id = db.verify_user('rollupuser', 'password123')
+    device_id = db.register_device(user_id, 'rollup-laptop', 'Laptop')
+    db.update_device_locations([
+        (device_id, lat, lon, None, None, None, None, timestamp) for lat, lon, timestamp in three_days()
+    ])
+    db.compact_locations(device_id, NOW, 10000)
+
+    client = track_server.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['username'] = 'rollupuser'
+    data = client.get(f'/api/device/{device_id}/history/rollups?resolution=hour&limit=10').get_json()
+    assert data['status'] == 'success' and len(data['rollups']) == 10
+    assert data['rollups'][0]['point_count'] == 6
+    next_page = client.get(f"/api/device/{device_id}/history/rollups?resolution=hour&start={data['next_start']}")
+    assert len(next_page.get_json()['rollups']) == 62
+    data = client.get(f'/api/device/{device_id}/history/rollups?start=0&end={NOW}').get_json()
+    assert data['resolution'] == 'day' and len(data['rollups']) == 3
+
+    response = client.post('/api/retention', json={'raw_days': 30, 'hourly_days': 365})
+    assert response.get_json()['status'] == 'success'
+    assert (user_id, None, 30, 365) in db.get_retention_policies()
+    assert client.post('/api/retention', json={'raw_days': -1, 'hourly_days': 1}).status_code == 400
+
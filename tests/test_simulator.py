@@ -0,0 +1,52 @@
+import json
+import random
+
+import simulator
+import track_client
+import track_server
+
+track_server.db.register_user('simuser', 'password123')
+
+
+def simulated_devices(prefix):
+    with track_server.db._reader() as conn:
+        return conn.execute(
+            "SELECT id FROM devices WHERE device_name LIKE ?", (f"{prefix}-%",)).fetchall()
+
+
+def test_random_walk_parks_and_hops():
+    walk = simulator.RandomWalk(random.Random(1), step_meters=1000, move_probability=0.5)
+    points = [walk.next_point() for _ in range(200)]
+    hops = [track_client.distance_meters(*a, *b) for a, b in zip(points, points[1:])]
+    assert 50 < sum(1 for hop in hops if hop == 0) < 150
+    assert max(hops) < 10000
+
+
+def test_replayed_track_loops_from_offset(tmp_path):
+    path = str(tmp_path / 'track.ndjson')
+    with open(path, 'w') as f:
+        for i in range(3):
+            f.write(json.dumps({"latitude": float(i), "longitude": 0.5, "timestamp": i}) + "\n")
+    track = simulator.load_track(path)
+    replay = simulator.ReplayTrack(track, offset=2)
+    assert [replay.next_point()[0] for _ in range(4)] == [2.0, 0.0, 1.0, 2.0]
+
+
+def test_fleet_registers_and_reports(server_url, client_dir):
+    summary = simulator.run_simulation(server_url, 'simuser', 'password123', 20, duration=2.5,
+                                       update_interval=1, concurrency=8, ramp=0.2, prefix='simfleet')
+    assert summary["registered"] == 20 and summary["queued_points"] == 0
+    assert len(simulated_devices('simfleet')) == 20
+
+    endpoints = summary["endpoints"]
+    assert endpoints['/api/client/register']["requests"] == 20
+    updates = endpoints['/api/update_locations']
+    # Every device reports at least its first point, most move again later
+    assert updates["requests"] >= 20 and updates["errors"] == 0
+    assert 0 < updates["p50_ms"] <= updates["p99_ms"] <= updates["max_ms"]
+
+    # Rerunning reuses the devices registered under the same hostnames
+    simulator.run_simulation(server_url, 'simuser', 'password123', 20, duration=0.5,
+                             update_interval=1, concurrency=8, ramp=0.1, prefix='simfleet')
+    assert len(simulated_devices('simfleet')) == 20
+
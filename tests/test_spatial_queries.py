@@ -0,0 +1,60 @@
+import random
+
+from geomath import haversine_distance
+
+
+def make_fleet(make_db, device_count, seed):
+    """Two users; the first owns device_count devices scattered around Europe"""
+    rng = random.Random(seed)
+    db, owner = make_db(username='fleet')
+    db.register_user('other', 'password123')
+    other = db.verify_user('other', 'password123')
+    positions = {}
+    points = []
+    for i in range(device_count):
+        device_id = db.register_device(owner, f"laptop-{i}", 'Laptop')
+        positions[device_id] = (rng.uniform(35, 60), rng.uniform(-10, 30))
+        points.append((device_id,) + positions[device_id] + (None, None, None, None))
+    # A device belonging to someone else, right on the query point
+    stranger = db.register_device(other, 'stranger', 'Laptop')
+    points.append((stranger, 48.8566, 2.3522, None, None, None, None))
+    db.update_device_locations(points)
+    return db, owner, positions
+
+
+def test_devices_near_matches_brute_force(make_db):
+    db, owner, positions = make_fleet(make_db, 300, 1)
+    for radius in (50, 400, 2000):
+        found = db.find_devices_near(owner, 48.8566, 2.3522, radius)
+        expected = {device_id for device_id, (lat, lon) in positions.items()
+                    if haversine_distance(48.8566, 2.3522, lat, lon) <= radius}
+        assert {row[0] for row in found} == expected
+        distances = [row[-1] for row in found]
+        assert distances == sorted(distances)
+
+
+def test_nearest_devices_matches_brute_force(make_db):
+    db, owner, positions = make_fleet(make_db, 300, 2)
+    ranked = sorted(positions, key=lambda device_id: haversine_distance(52.52, 13.405, *positions[device_id]))
+    for k in (1, 5, 50):
+        found = db.find_nearest_devices(owner, 52.52, 13.405, k)
+        assert [row[0] for row in found] == ranked[:k]
+
+
+def test_position_index_follows_latest_location(make_db):
+    db, owner, positions = make_fleet(make_db, 3, 3)
+    device_id = next(iter(positions))
+    db.update_device_location(device_id, -33.8688, 151.2093)
+    found = db.find_devices_near(owner, -33.8688, 151.2093, 1)
+    assert [row[0] for row in found] == [device_id]
+
+
+def test_geofences_containing_point(make_db):
+    db, owner, positions = make_fleet(make_db, 2, 4)
+    first, second = list(positions)
+    db.add_geofence(first, 'Paris', 48.8566, 2.3522, 10)
+    db.add_geofence(second, 'Lyon', 45.7640, 4.8357, 10)
+    found = db.get_geofences_containing(owner, 48.86, 2.35)
+    assert [row[2] for row in found] == ['Paris']
+    assert db.get_geofences_containing(owner, 0, 0) == []
+
@@ -0,0 +1,97 @@
+import track_client
+import track_server
+import wire
+
+track_server.db.register_user('wireuser', 'password123')
+
+PLACE = {"ip_address": "203.0.113.7", "city": "Zürich", "region": None, "country": "Switzerland"}
+
+
+def register(client, hostname):
+    data = client.post('/api/client/register', json={
+        'username': 'wireuser', 'password': 'password123', 'hostname': hostname, 'os_info': 'Linux'
+    }).get_json()
+    return data['device_id'], {'Authorization': f"Bearer {data['device_token']}"}
+
+
+def test_round_trip_with_deltas_and_place_changes():
+    points = [
+        dict(PLACE, latitude=47.376887, longitude=8.541694, timestamp=1700000000000),
+        dict(PLACE, latitude=47.377, longitude=8.5418, timestamp=1700000001000),
+        # A jump too far for a 16-bit delta, and a clock far from the last point
+        dict(PLACE, latitude=-33.8688, longitude=151.2093, timestamp=1800000000000),
+        {"latitude": -33.8689, "longitude": 151.2094, "city": "x" * 300},
+    ]
+    body = wire.encode_points(points, device_id=7, sent_at=1700000002000)
+    device_id, sent_at, rows = wire.decode_points(body)
+    assert (device_id, sent_at) == (7, 1700000002000)
+    for point, row in zip(points, rows):
+        assert abs(row[0] - point["latitude"]) < 1e-6 and abs(row[1] - point["longitude"]) < 1e-6
+        assert row[6] == point.get("timestamp")
+    assert rows[2][2:6] == ("203.0.113.7", "Zürich", None, "Switzerland")
+    assert rows[3][2:6] == (None, "x" * wire.MAX_STRING_BYTES, None, None)
+
+    # Unchanged places are sent once; nearby points cost a few bytes each
+    nearby = [dict(PLACE, latitude=47.0 + i * 1e-4, longitude=8.0, timestamp=1700000000000 + i * 1000)
+              for i in range(100)]
+    assert len(wire.encode_points(nearby, 7, 1700000000000)) < 100 * 10 + 50
+
+
+def test_malformed_bodies_are_rejected():
+    body = wire.encode_points([dict(PLACE, latitude=1.0, longitude=2.0)], 7)
+    for bad in (body[:-3], body + b'\x00', b'\x02' + body[1:], body[:10]):
+        try:
+            wire.decode_points(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"accepted {bad!r}")
+
+
+def test_server_accepts_binary_batches_and_single_points():
+    client = track_server.app.test_client()
+    device_id, headers = register(client, 'wire-laptop')
+    headers['Content-Type'] = wire.CONTENT_TYPE
+    now = track_server.epoch_ms()
+    body = wire.encode_points([dict(PLACE, latitude=47.0, longitude=8.0, timestamp=now - 2000),
+                               dict(PLACE, latitude=47.001, longitude=8.001, timestamp=now - 1000),
+                               {"latitude": 91.0, "longitude": 8.0}], sent_at=now)
+    response = client.post('/api/update_locations', data=body, headers=headers)
+    data = response.get_json()
+    assert wire.CONTENT_TYPE in response.headers['Accept-Post']
+    assert data["accepted"] == 2
+    assert data["results"][2]["message"] == "Invalid coordinates"
+    with track_server.db._reader() as conn:
+        rows = conn.execute(
+            "SELECT latitude, longitude, city, timestamp FROM locations WHERE device_id = ? ORDER BY id",
+            (device_id,)).fetchall()
+    assert rows[1][:3] == (47.001, 8.001, "Zürich")
+    assert now - 3000 < rows[0][3] < rows[1][3] <= now
+
+    # The header cannot claim another device than the token
+    response = client.post('/api/update_locations', data=wire.encode_points(
+        [{"latitude": 1.0, "longitude": 2.0}], device_id=device_id + 1000), headers=headers)
+    assert response.get_json()["results"][0]["message"] == "Token does not match device"
+
+    response = client.post('/api/update_location', data=wire.encode_points(
+        [dict(PLACE, latitude=46.0, longitude=7.0)]), headers=headers)
+    assert response.status_code == 200
+    assert track_server.db.get_latest_device_location(device_id)[:2] == (46.0, 7.0)
+    response = client.post('/api/update_location', data=b'\x01garbage', headers=headers)
+    assert response.status_code == 400
+
+
+def test_client_switches_to_binary_once_advertised(server_url, client_dir):
+    tracker = track_client.DeviceTracker(server_url, 'wireuser', 'password123',
+                                         queue_path=str(client_dir / 'wire.db'))
+    tracker.hostname = 'negotiating-laptop'
+    sent = []
+    tracker.session.hooks['response'].append(lambda response, *args, **kwargs: sent.append(
+        response.request.headers.get('Content-Type')))
+    tracker.get_location = lambda: dict(PLACE, latitude=47.0, longitude=8.0 + len(sent) * 0.01)
+    for _ in range(2):
+        assert tracker.update_location()
+    assert sent[1:] == ['application/json', wire.CONTENT_TYPE]
+    assert tracker.packed_points
+    assert track_server.db.get_latest_device_location(tracker.device_id)[:2] == (47.0, 8.02)
+    tracker.close()
+
@@ -0,0 +1,13 @@
+"""Scratch environment for tests and bench scripts
+
+Importing track_server opens TRACKER_DB, so this points it at a temporary
+file (unless already set) and puts the repository on sys.path. conftest.py
+imports it for the tests; bench scripts import it before the server.
+"""
+import os
+import sys
+import tempfile
+
+scratch_dir = tempfile.mkdtemp()
+os.environ.setdefault('TRACKER_DB', os.path.join(scratch_dir, 'import.db'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
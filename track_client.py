@@ -1,17 +1,31 @@
 #!/usr/bin/env python3
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import socket
 import platform
 import time
 import os
 import sys
 import json
+import math
+import gzip
 import logging
 from logging.handlers import RotatingFileHandler
 import uuid
+import random
+import sqlite3
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import configparser
 import argparse
 
+try:
+    import wire
+except ImportError:
+    # Without wire.py next to the client, batches are always sent as JSON
+    wire = None
+
 # Setup logging
 log_dir = os.path.join(os.path.expanduser("~"), ".laptop_tracker")
 os.makedirs(log_dir, exist_ok=True)
@@ -27,19 +41,265 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+# Request bodies at least this large are gzip-compressed; a single
+# location update is too small for compression to pay off
+GZIP_MIN_BYTES = 1024
+# Connection failures and 502 responses (the request never reached the
+# app) are retried with exponential backoff; 429/503 mean the server is
+# shedding load and go through the upload backoff, honouring Retry-After
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_TIMEOUT = 10
+# A resolved location is reused while the server sees the same public IP
+LOCATION_CACHE_TTL = 3600
+# Seconds to wait on the providers already queried before also asking the
+# next one; 0 races them all at once
+PROVIDER_HEDGE_DELAY = 1.0
+# Consecutive failures after which a provider sits out an exponentially
+# growing cooldown
+PROVIDER_FAILURE_THRESHOLD = 3
+PROVIDER_COOLDOWN = 60
+PROVIDER_MAX_COOLDOWN = 3600
+# Offline queue: points are kept on disk until the server accepts them and
+# uploaded QUEUE_BATCH_SIZE at a time; past MAX_QUEUED_POINTS (about a year
+# at the default interval) the oldest are dropped
+QUEUE_BATCH_SIZE = 500
+MAX_QUEUED_POINTS = 100000
+UPLOAD_BACKOFF_BASE = 30
+UPLOAD_BACKOFF_MAX = 3600
+# Movement-aware reporting: a location is only sent once the device has
+# moved this far from the last one sent. A stationary device sends a
+# heartbeat instead, often enough to stay inside the server's 15 minute
+# online window. While moving, the interval halves down to
+# MIN_UPDATE_INTERVAL, and it doubles back once the device settles.
+MOVEMENT_THRESHOLD_METERS = 500
+HEARTBEAT_INTERVAL = 600
+MIN_UPDATE_INTERVAL = 60
+EARTH_RADIUS_M = 6371000
+
+
+def distance_meters(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in meters"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _coordinates(latitude, longitude):
+    """Validated (latitude, longitude) floats, or None"""
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+def parse_ipapi(data):
+    coordinates = _coordinates(data.get("latitude"), data.get("longitude"))
+    if not coordinates:
+        return None
+    return {
+        "latitude": coordinates[0],
+        "longitude": coordinates[1],
+        "ip_address": data.get("ip"),
+        "city": data.get("city"),
+        "region": data.get("region"),
+        "country": data.get("country_name")
+    }
+
+def parse_ipinfo(data):
+    # ipinfo uses loc field with format "lat,lng"
+    loc = data.get("loc") or ""
+    coordinates = _coordinates(*loc.split(",", 1)) if "," in loc else None
+    if not coordinates:
+        return None
+    return {
+        "latitude": coordinates[0],
+        "longitude": coordinates[1],
+        "ip_address": data.get("ip"),
+        "city": data.get("city"),
+        "region": data.get("region"),
+        "country": data.get("country")
+    }
+
+def parse_ip_api(data):
+    coordinates = _coordinates(data.get("lat"), data.get("lon"))
+    if not coordinates:
+        return None
+    return {
+        "latitude": coordinates[0],
+        "longitude": coordinates[1],
+        "ip_address": data.get("query"),
+        "city": data.get("city"),
+        "region": data.get("regionName"),
+        "country": data.get("country")
+    }
+
+# (name, url, parser) in default preference order
+GEOLOCATION_PROVIDERS = [
+    ("ipapi.co", "https://ipapi.co/json/", parse_ipapi),
+    ("ipinfo.io", "https://ipinfo.io/json", parse_ipinfo),  # May require a token for production use
+    ("ip-api.com", "https://ip-api.com/json", parse_ip_api)
+]
+
+
+class ProviderHealth:
+    """Success/failure record of one geolocation provider"""
+
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency = None
+        self.benched_until = 0.0
+
+    def record(self, ok, latency, now):
+        if ok:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.benched_until = 0.0
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            return
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= PROVIDER_FAILURE_THRESHOLD:
+            excess = self.consecutive_failures - PROVIDER_FAILURE_THRESHOLD
+            self.benched_until = now + min(PROVIDER_MAX_COOLDOWN, PROVIDER_COOLDOWN * 2 ** excess)
+
+    def available(self, now):
+        return now >= self.benched_until
+
+    def rank(self):
+        """Sort key: fewest recent failures, then lowest smoothed latency"""
+        return (self.consecutive_failures, self.latency or 0.0)
+
+
+class OfflineQueue:
+    """Location points waiting for upload, in a local SQLite file so they
+    survive network outages and client restarts"""
+
+    def __init__(self, path, max_points=MAX_QUEUED_POINTS):
+        self.max_points = max_points
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS points (id INTEGER PRIMARY KEY AUTOINCREMENT, point TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+    def put(self, point):
+        with self.lock:
+            self.conn.execute("INSERT INTO points (point) VALUES (?)", (json.dumps(point),))
+            dropped = self.conn.execute(
+                "DELETE FROM points WHERE id <= (SELECT MAX(id) FROM points) - ?", (self.max_points,)
+            ).rowcount
+            self.conn.commit()
+        if dropped:
+            logger.warning(f"Offline queue full, dropped {dropped} oldest location points")
+
+    def peek(self, limit):
+        """Oldest (id, point) pairs, left in the queue until remove_through()"""
+        with self.lock:
+            rows = self.conn.execute("SELECT id, point FROM points ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def remove_through(self, last_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM points WHERE id <= ?", (last_id,))
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM points").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def create_session(pool_maxsize=2):
+    """requests session with retries and pool_maxsize keep-alive connections per host"""
+    session = requests.Session()
+    # read=0: a request that may have reached the server is not resent,
+    # so a retried update can never record the same point twice. Connect
+    # errors are retried for any method; a 502 only for idempotent ones,
+    # since a proxy may answer 502 after the server committed a POST. A
+    # Retry-After is left to _back_off rather than slept through here
+    retry = Retry(total=HTTP_RETRIES, connect=HTTP_RETRIES, read=0, status=HTTP_RETRIES,
+                  backoff_factor=HTTP_BACKOFF_FACTOR, status_forcelist=(502,),
+                  allowed_methods=Retry.DEFAULT_ALLOWED_METHODS, raise_on_status=False,
+                  respect_retry_after_header=False)
+    # One pool per host (the server and the geolocation APIs), each
+    # holding the connections reused on every update cycle
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 
 class DeviceTracker:
-    def __init__(self, server_url, username, password, update_interval=300):
+    def __init__(self, server_url, username, password, update_interval=300, providers=None,
+                 queue_path=None, movement_threshold=MOVEMENT_THRESHOLD_METERS,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, min_interval=MIN_UPDATE_INTERVAL):
         """Initialize the device tracker client"""
         self.server_url = server_url
         self.username = username
         self.password = password
         self.update_interval = update_interval
         self.device_id = None
+        self.device_token = None
         self.hostname = socket.gethostname()
         self.os_info = platform.platform()
         self.client_id = self._get_client_id()
+        self.device_file = os.path.join(log_dir, "device.json")
+        self._load_device_token()
+        self.session = self._create_session()
+        self.providers = providers or GEOLOCATION_PROVIDERS
+        self.provider_health = {provider[0]: ProviderHealth() for provider in self.providers}
+        self.health_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=len(self.providers), thread_name_prefix="geolocation")
+        # Public IP the server last reported seeing, and the location
+        # resolved for it
+        self.public_ip = None
+        self.location_cache = None
+        self.queue = OfflineQueue(queue_path or os.path.join(log_dir, "queue.db"))
+        self.upload_failures = 0
+        self.retry_at = 0.0
+        self.movement_threshold = movement_threshold
+        self.heartbeat_interval = heartbeat_interval
+        self.min_interval = min(min_interval, update_interval)
+        self.current_interval = update_interval
+        # (latitude, longitude) of the last point queued for upload, and the
+        # last time the server acknowledged a point or heartbeat
+        self.last_reported = None
+        self.last_contact = None
+        # Minimum seconds between reports asked for by a loaded server
+        self.server_interval = 0
+        # Set once the server advertises the binary point format
+        self.packed_points = False
+
+    def _create_session(self):
+        """Keep-alive session shared by registration, geolocation and updates"""
+        return create_session()
+
+    def close(self):
+        """Close the pooled connections, the provider threads and the queue"""
+        self.executor.shutdown(wait=False)
+        self.session.close()
+        self.queue.close()
+
+    def _post_json(self, path, payload, headers=None):
+        """POST JSON to the server, gzip-compressing large bodies"""
+        body = json.dumps(payload).encode()
+        headers = dict(headers or {})
+        headers["Content-Type"] = "application/json"
+        if len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        return self.session.post(f"{self.server_url}{path}", data=body, headers=headers, timeout=HTTP_TIMEOUT)
     
     def _get_client_id(self):
         """Get or create a unique client ID"""
@@ -64,27 +324,54 @@ class DeviceTracker:
         
         return client_id
     
+    def _load_device_token(self):
+        """Load the device id and API token saved by a previous registration"""
+        if not os.path.exists(self.device_file):
+            return
+        try:
+            with open(self.device_file, 'r') as f:
+                saved = json.load(f)
+            # A token is only valid for the server that issued it
+            if saved.get("server_url") == self.server_url:
+                self.device_id = saved.get("device_id")
+                self.device_token = saved.get("device_token")
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading device token: {e}")
+
+    def _save_device_token(self):
+        """Save the device id and API token so restarts skip password auth"""
+        try:
+            with open(self.device_file, 'w') as f:
+                json.dump({
+                    "server_url": self.server_url,
+                    "device_id": self.device_id,
+                    "device_token": self.device_token
+                }, f)
+            # Set file permissions to be readable only by the user
+            os.chmod(self.device_file, 0o600)
+        except OSError as e:
+            logger.error(f"Error saving device token: {e}")
+
     def register_device(self):
         """Register the device with the server"""
         logger.info("Registering device with the server...")
         
         try:
-            response = requests.post(
-                f"{self.server_url}/api/client/register",
-                json={
-                    "username": self.username,
-                    "password": self.password,
-                    "hostname": self.hostname,
-                    "os_info": self.os_info,
-                    "client_id": self.client_id
-                },
-                timeout=10
-            )
+            response = self._post_json("/api/client/register", {
+                "username": self.username,
+                "password": self.password,
+                "hostname": self.hostname,
+                "os_info": self.os_info,
+                "client_id": self.client_id
+            })
             
             if response.status_code == 200:
                 data = response.json()
                 if data.get("status") == "success":
                     self.device_id = data.get("device_id")
+                    self.device_token = data.get("device_token")
+                    if self.device_token:
+                        self._save_device_token()
                     logger.info(f"Device registered successfully with ID: {self.device_id}")
                     return True
                 else:
@@ -98,130 +385,287 @@ class DeviceTracker:
         return False
     
     def get_location(self):
+        """Get the current location using IP-based geolocation services
+
+        While the server still sees the same public IP the cached location
+        is reused without any geolocation call; otherwise the providers are
+        raced and the first valid answer wins.
+        """
+        cached = self.location_cache
+        if (cached and cached["ip"] is not None and cached["ip"] == self.public_ip
+                and cached["expires"] > time.monotonic()):
+            logger.info("Public IP unchanged, using cached location")
+            return dict(cached["location"])
 
-        """Get the current location using IP-based geolocation services"""
         logger.info("Getting current location...")
-        
-        # Try multiple geolocation APIs in case one fails
-        apis = [
-            "https://ipapi.co/json/",
-            "https://ipinfo.io/json",  # May require a token for production use
-            "https://ip-api.com/json"
-        ]
-        
-        for api_url in apis:
-            try:
-                response = requests.get(api_url, timeout=10)
-                if response.status_code == 200:
-                    location_data = response.json()
-                    
-                    # Handle different API response formats
-                    if api_url.startswith("https://ipapi.co"):
-                        return {
-                            "latitude": location_data.get("latitude"),
-                            "longitude": location_data.get("longitude"),
-                            "ip_address": location_data.get("ip"),
-                            "city": location_data.get("city"),
-                            "region": location_data.get("region"),
-                            "country": location_data.get("country_name")
-                        }
-                    elif api_url.startswith("https://ipinfo.io"):
-                        # ipinfo uses loc field with format "lat,lng"
-                        if "loc" in location_data and "," in location_data["loc"]:
-                            lat, lng = location_data["loc"].split(",")
-                            return {
-                                "latitude": float(lat),
-                                "longitude": float(lng),
-                                "ip_address": location_data.get("ip"),
-                                "city": location_data.get("city"),
-                                "region": location_data.get("region"),
-                                "country": location_data.get("country")
-                            }
-                    elif api_url.startswith("https://ip-api.com"):
-                        return {
-                            "latitude": location_data.get("lat"),
-                            "longitude": location_data.get("lon"),
-                            "ip_address": location_data.get("query"),
-                            "city": location_data.get("city"),
-                            "region": location_data.get("regionName"),
-                            "country": location_data.get("country")
-                        }
-                    
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Error getting location from {api_url}: {e}")
-        
-        logger.error("All geolocation APIs failed, using fallback coordinates")
-        
-        # Fallback to minimal location data
-        return {
-            "latitude": 0,
-            "longitude": 0,
-            "ip_address": None,
-            "city": None,
-            "region": None,
-            "country": None
-        }
+        location = self._race_providers()
+        if location:
+            self.location_cache = {
+                "ip": self.public_ip,
+                "location": location,
+                "expires": time.monotonic() + LOCATION_CACHE_TTL
+            }
+            return dict(location)
+        self.location_cache = None
+
+        logger.error("All geolocation APIs failed")
+        return None
+
+    def _race_providers(self):
+        """Query providers healthiest first, starting the next one whenever the
+        current ones fail or take longer than PROVIDER_HEDGE_DELAY"""
+        now = time.monotonic()
+        with self.health_lock:
+            ranked = sorted(self.providers, key=lambda provider: self.provider_health[provider[0]].rank())
+            # Benched providers are only tried when every provider is benched
+            queue = [provider for provider in ranked if self.provider_health[provider[0]].available(now)] or ranked
+        deadline = now + HTTP_TIMEOUT
+        pending = set()
+        while True:
+            if queue:
+                pending.add(self.executor.submit(self._query_provider, queue.pop(0)))
+            remaining = deadline - time.monotonic()
+            if not pending or remaining <= 0:
+                return None
+            done, pending = wait(pending, timeout=min(PROVIDER_HEDGE_DELAY, remaining) if queue else remaining,
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                location = future.result()
+                if location:
+                    return location
+
+    def _query_provider(self, provider):
+        """Ask one provider for the location and record how it did"""
+        name, url, parse = provider
+        start = time.monotonic()
+        location = None
+        try:
+            response = self.session.get(url, timeout=HTTP_TIMEOUT)
+            if response.status_code == 200:
+                location = parse(response.json())
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"Error getting location from {url}: {e}")
+        now = time.monotonic()
+        with self.health_lock:
+            self.provider_health[name].record(location is not None, now - start, now)
+        return location
+
+    def _observe_public_ip(self, reported):
+        """Remember the address the server saw; True if it differs from the cached location's"""
+        if not reported:
+            return False
+        self.public_ip = reported
+        cached = self.location_cache
+        if cached is None:
+            return False
+        if cached["ip"] is None:
+            cached["ip"] = reported
+            return False
+        if cached["ip"] != reported:
+            self.location_cache = None
+            return True
+        return False
     
-    def update_location(self):
-        """Send location update to the server"""
-        if not self.device_id:
-            if not self.register_device():
-                logger.error("Cannot update location: device is not registered")
-                return False
-        
+    def update_location(self, retry=True):
+        """Queue the current location, then upload everything queued"""
         location = self.get_location()
         if not location:
             logger.error("Cannot update location: failed to get current location")
             return False
-        
-        logger.info("Sending location update to server...")
+
+        self._queue_location(location)
+        return self.flush_queue(retry)
+
+    def _queue_location(self, location):
+        # Client clock; the server corrects it using the batch's sent_at
+        location["timestamp"] = int(time.time() * 1000)
+        self.queue.put(location)
+        self.last_reported = (location["latitude"], location["longitude"])
+
+    def report_location(self):
+        """One reporting cycle; returns the seconds to sleep before the next
+
+        Sends the location only if the device moved past the threshold,
+        otherwise a heartbeat when one is due.
+        """
+        location = self.get_location()
+        if location is None:
+            # An unknown position is neither a move nor proof of standing still
+            logger.error("Skipping report: failed to get current location")
+            if len(self.queue):
+                self.flush_queue()
+        elif self.last_reported is None or distance_meters(
+            self.last_reported[0], self.last_reported[1], location["latitude"], location["longitude"]
+        ) >= self.movement_threshold:
+            if self.last_reported is not None:
+                self.current_interval = max(self.min_interval, self.current_interval / 2)
+            self._queue_location(location)
+            self.flush_queue()
+        else:
+            self.current_interval = min(self.update_interval, self.current_interval * 2)
+            if len(self.queue):
+                self.flush_queue()
+            heartbeat_interval = max(self.heartbeat_interval, self.server_interval)
+            if self.last_contact is None or time.monotonic() - self.last_contact >= heartbeat_interval:
+                self.send_heartbeat()
+
+        if self.last_contact is None:
+            return max(self.current_interval, self.server_interval)
+        # Wake up in time for the next heartbeat, but never sooner than the server asks
+        heartbeat_due = self.last_contact + max(self.heartbeat_interval, self.server_interval) - time.monotonic()
+        return max(1, self.server_interval, min(self.current_interval, heartbeat_due))
+
+    def send_heartbeat(self):
+        """Tell the server the device is still online without sending a point"""
+        if not self.device_token or time.monotonic() < self.retry_at:
+            return False
+        logger.info("Location unchanged, sending heartbeat...")
         try:
-            # Add the device_id to the location data
-            location["device_id"] = self.device_id
-            
-            response = requests.post(
-                f"{self.server_url}/api/update_location",
-                json=location,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("status") == "success":
-                    logger.info("Location updated successfully")
-                    return True
-                else:
-                    logger.error(f"Location update failed: {data.get('message')}")
-            else:
-                logger.error(f"Location update failed with status code: {response.status_code}")
-                
-                # If device not found, try re-registering
-                if response.status_code == 404:
-                    logger.info("Device not found on server, attempting to re-register...")
-                    if self.register_device():
-                        # Try updating again
-                        return self.update_location()
-        
+            response = self.session.post(f"{self.server_url}/api/heartbeat",
+                                         headers={"Authorization": f"Bearer {self.device_token}"},
+                                         timeout=HTTP_TIMEOUT)
+            data = response.json() if response.status_code == 200 else {}
         except requests.exceptions.RequestException as e:
-            logger.error(f"Error during location update: {e}")
-        
-        return False
+            logger.error(f"Error during heartbeat: {e}")
+            self._back_off()
+            return False
+
+        if response.status_code in (401, 404):
+            # Unknown token or no point on record: a full update fixes both
+            return self.update_location()
+        if response.status_code != 200:
+            logger.error(f"Heartbeat failed with status code: {response.status_code}")
+            self._back_off(response)
+            return False
+        self.last_contact = time.monotonic()
+        self.server_interval = data.get("next_interval") or 0
+        if self._observe_public_ip(data.get("client_ip")):
+            logger.info("Public IP changed, sending a fresh location")
+            return self.update_location()
+        return True
+
+    def flush_queue(self, retry=True):
+        """Upload queued points in bounded batches; False if any remain queued"""
+        if time.monotonic() < self.retry_at:
+            logger.info(f"Backing off, {len(self.queue)} location points queued")
+            return False
+        if not self.device_id and not self.register_device():
+            logger.error("Cannot update location: device is not registered")
+            self._back_off()
+            return False
+
+        ip_changed = False
+        while True:
+            batch = self.queue.peek(QUEUE_BATCH_SIZE)
+            if not batch:
+                break
+            logger.info(f"Sending {len(batch)} location points to server...")
+            headers = {}
+            if self.device_token:
+                headers["Authorization"] = f"Bearer {self.device_token}"
+            try:
+                response = self._post_points([point for _, point in batch], headers)
+                data = response.json() if response.status_code == 200 else {}
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Error during location update: {e}")
+                self._back_off()
+                return False
+
+            results = data.get("results", [])
+            unknown_device = any(result.get("message") == "Device not found" for result in results)
+            # If the device or its token is unknown, try re-registering once
+            if (response.status_code in (401, 403, 404) or unknown_device) and retry:
+                logger.info("Device not recognised by server, attempting to re-register...")
+                self.device_id = None
+                self.device_token = None
+                return self.flush_queue(retry=False)
+            if unknown_device:
+                # Still unknown after re-registering; keep the points for the next attempt
+                logger.error("Device not found after re-registering, keeping location points queued")
+                self._back_off(response)
+                return False
+            if response.status_code != 200:
+                logger.error(f"Location update failed with status code: {response.status_code}")
+                self._back_off(response)
+                return False
+
+            # Points rejected as invalid would fail on every retry, so they
+            # leave the queue with the rest of the batch
+            rejected = [result for result in results if result.get("status") != "success"]
+            if rejected:
+                logger.error(f"Server rejected {len(rejected)} location points: {rejected[0].get('message')}")
+            self.queue.remove_through(batch[-1][0])
+            self.upload_failures = 0
+            self.last_contact = time.monotonic()
+            self.server_interval = data.get("next_interval") or 0
+            ip_changed = self._observe_public_ip(data.get("client_ip")) or ip_changed
+
+        logger.info("Location updated successfully")
+        # The newest point was resolved for an older public IP
+        if ip_changed and retry:
+            logger.info("Public IP changed, resending update with a fresh location")
+            return self.update_location(retry=False)
+        return True
+
+    def _post_points(self, points, headers):
+        """Upload a batch, in the binary point format once the server accepts it"""
+        sent_at = int(time.time() * 1000)
+        if self.packed_points:
+            body = wire.encode_points(points, self.device_id, sent_at)
+            response = self.session.post(f"{self.server_url}/api/update_locations", data=body,
+                                         headers=dict(headers, **{"Content-Type": wire.CONTENT_TYPE}),
+                                         timeout=HTTP_TIMEOUT)
+        else:
+            response = self._post_json("/api/update_locations", {
+                "points": [dict(point, device_id=self.device_id) for point in points],
+                "sent_at": sent_at
+            }, headers)
+
+        # Follow what the server advertises, so a downgraded server gets JSON again
+        was_packed = self.packed_points
+        accepted = response.headers.get("Accept-Post")
+        if accepted is not None:
+            self.packed_points = wire is not None and wire.CONTENT_TYPE in accepted
+        elif response.status_code in (400, 415):
+            self.packed_points = False
+        if was_packed and not self.packed_points:
+            return self._post_points(points, headers)
+        return response
+
+    def _back_off(self, response=None):
+        """Delay the next upload with exponential backoff and full jitter
+
+        The random delay keeps a fleet that lost the server at the same time
+        from retrying in lockstep once it recovers.
+        """
+        self.upload_failures += 1
+        ceiling = min(UPLOAD_BACKOFF_MAX, UPLOAD_BACKOFF_BASE * 2 ** (self.upload_failures - 1))
+        delay = random.uniform(0, ceiling)
+        retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+        if retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        self.retry_at = time.monotonic() + delay
+        logger.info(f"{len(self.queue)} location points queued, next upload in {delay:.0f} seconds")
     
     def run(self):
         """Main loop to periodically update the location"""
         logger.info("Starting device tracker client...")
         
-        if not self.register_device():
+        # A saved device token replaces the password login on restart
+        if self.device_token:
+            logger.info(f"Using saved device token for device ID: {self.device_id}")
+        elif not self.register_device():
             logger.error("Failed to register device, will retry on first update")
         
         while True:
+            delay = self.update_interval
             try:
-                self.update_location()
+                delay = self.report_location()
             except Exception as e:
                 logger.error(f"Unexpected error during location update: {e}")
             
-            logger.info(f"Sleeping for {self.update_interval} seconds...")
-            time.sleep(self.update_interval)
+            logger.info(f"Sleeping for {delay:.0f} seconds...")
+            time.sleep(delay)
 
 def create_default_config():
     """Create a default configuration file if it doesn't exist"""
@@ -262,13 +706,35 @@ def load_config():
             'server_url': config.get('SERVER', 'URL'),
             'username': config.get('USER', 'Username'),
             'password': config.get('USER', 'Password'),
-            'update_interval': config.getint('SERVER', 'UpdateInterval')
+            'update_interval': config.getint('SERVER', 'UpdateInterval'),
+            'movement_threshold': config.getfloat('SERVER', 'MovementThreshold',
+                                                  fallback=MOVEMENT_THRESHOLD_METERS),
+            'heartbeat_interval': config.getint('SERVER', 'HeartbeatInterval', fallback=HEARTBEAT_INTERVAL)
         }
     except (configparser.Error, ValueError) as e:
         logger.error(f"Error parsing configuration file: {e}")
         print(f"Error parsing configuration file: {e}")
         return None
 
+def simulate(args, server_url, username, password, update_interval, movement_threshold, heartbeat_interval):
+    """Run the --simulate fleet and print its request rates and latencies"""
+    # Imported here since the simulator builds on this module
+    import simulator
+
+    # Thousands of devices would flood the client log
+    logger.setLevel(logging.WARNING)
+    track = simulator.load_track(args.replay) if args.replay else None
+    print(f"Simulating {args.simulate} devices against {server_url} for {args.duration:g} s...")
+    try:
+        summary = simulator.run_simulation(server_url, username, password, args.simulate, args.duration,
+                                           update_interval, args.concurrency, track=track,
+                                           movement_threshold=movement_threshold,
+                                           heartbeat_interval=heartbeat_interval)
+    except KeyboardInterrupt:
+        print("Simulation stopped")
+        return
+    simulator.print_summary(summary)
+
 def main():
     """Main entry point"""
     global config_file
@@ -278,7 +744,15 @@ def main():
     parser.add_argument('--user', help='Username', default=None)
     parser.add_argument('--password', help='Password', default=None)
     parser.add_argument('--interval', help='Update interval in seconds', type=int, default=None)
+    parser.add_argument('--movement-threshold', help='Meters moved before a location is sent', type=float,
+                        default=None)
     parser.add_argument('--config', help='Path to configuration file', default=config_file)
+    parser.add_argument('--simulate', help='Run N virtual devices on synthetic trajectories instead of this one',
+                        type=int, metavar='N', default=None)
+    parser.add_argument('--duration', help='Seconds to run the simulation', type=float, default=60)
+    parser.add_argument('--concurrency', help='Simulated requests in flight at once', type=int, default=64)
+    parser.add_argument('--replay', help='Replay this history export (NDJSON or CSV) instead of random walks',
+                        default=None)
     
     args = parser.parse_args()
     # Load configuration
@@ -296,14 +770,23 @@ def main():
     username = args.user or config['username']
     password = args.password or config['password']
     update_interval = args.interval or config['update_interval']
+    movement_threshold = (args.movement_threshold if args.movement_threshold is not None
+                          else config['movement_threshold'])
     
     # Validate configuration
     if not server_url or not username or not password:
         print("Missing required configuration: server URL, username, and password must be provided.")
         return
     
+    if args.simulate:
+        simulate(args, server_url, username, password, update_interval, movement_threshold,
+                 config['heartbeat_interval'])
+        return
+
     # Create and run the tracker
-    tracker = DeviceTracker(server_url, username, password, update_interval)
+    tracker = DeviceTracker(server_url, username, password, update_interval,
+                            movement_threshold=movement_threshold,
+                            heartbeat_interval=config['heartbeat_interval'])
     
     # Handle graceful exit
     try:
@@ -314,6 +797,8 @@ def main():
     except Exception as e:
         logger.critical(f"Unhandled exception: {e}")
         print(f"Error: {e}")
+    finally:
+        tracker.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,249 +2,1087 @@ import sqlite3
 import datetime
 import os
 import math
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for
+from flask import Flask, Response, g, request, jsonify, render_template, session, redirect, url_for
 import json
+import csv
+import io
 import hashlib
+import random
+import zlib
 from functools import wraps
 import secrets
 import threading
+import atexit
+import time
+import queue
+from contextlib import contextmanager
+from cache import TTLCache
+from ingest import LocationWriter
+from maintenance import DAY_MS, HOUR_MS, MaintenanceJob, epoch_ms, merge_rollup, summarize_buckets
+from metrics import (DatabaseMetrics, Histogram, SamplingProfiler, TimedLock, render_samples,
+                     timed_methods)
+from pubsub import LocationBroker
+import wire
+from geomath import (bounding_box, haversine_distance, haversine_many, inside_fences, simplify_track,
+                     zoom_tolerance_km, EARTH_RADIUS_KM)
+from migrations import apply_migrations, ensure_latest_location_table, incremental_vacuum_enabled
 
 app = Flask(__name__)
 # Use a fixed secret key from an environment variable or generate once and save
 app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(16)
 
+# SQLite tuning applied to every pooled connection. WAL lets readers run
+# alongside the single writer; NORMAL sync stays consistent after a crash
+# and can only lose the most recent commits on power failure.
+DB_PATH = os.environ.get('TRACKER_DB', 'device_tracker.db')
+DB_SYNCHRONOUS = os.environ.get('DB_SYNCHRONOUS', 'NORMAL').upper()
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', '5000'))
+DB_CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_SIZE_KB', '16384'))
+# Read-only connections shared by all threads; each query checks one out
+# only while it runs, and waits up to DB_POOL_TIMEOUT seconds for one when
+# all DB_READ_POOL_SIZE are in use
+DB_READ_POOL_SIZE = int(os.environ.get('DB_READ_POOL_SIZE', '16'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+# Device metadata/ownership cache consulted by the per-request device checks
+DEVICE_CACHE_SIZE = int(os.environ.get('DEVICE_CACHE_SIZE', '10000'))
+DEVICE_CACHE_TTL = float(os.environ.get('DEVICE_CACHE_TTL', '300'))
+# Reject /api/update_location calls that do not carry a device token
+REQUIRE_DEVICE_TOKEN = os.environ.get('REQUIRE_DEVICE_TOKEN', '0') == '1'
+# Location timestamps are stored as epoch milliseconds; reads render them
+# in server local time for the templates and JSON API
+LOCAL_TIMESTAMP_SQL = "strftime('%Y-%m-%d %H:%M:%S', timestamp / 1000, 'unixepoch', 'localtime')"
+# Keeps device_latest_location in step with locations; the WHERE clause
+# stops an older, late-arriving point from replacing a newer one
+UPSERT_LATEST_LOCATION_SQL = (
+    "INSERT INTO device_latest_location "
+    "(device_id, latitude, longitude, ip_address, city, region, country, timestamp) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (device_id) DO UPDATE SET "
+    "latitude = excluded.latitude, longitude = excluded.longitude, ip_address = excluded.ip_address, "
+    "city = excluded.city, region = excluded.region, country = excluded.country, timestamp = excluded.timestamp "
+    "WHERE excluded.timestamp >= device_latest_location.timestamp"
+)
+# Meters a device must move past a geofence boundary before an enter or
+# exit is recorded, capped at half the radius so small fences can be entered
+GEOFENCE_HYSTERESIS = float(os.environ.get('GEOFENCE_HYSTERESIS', '50'))
+# Largest page served by the geofence events endpoint
+MAX_EVENTS_PAGE = 200
+# Nearest-device search starts at this radius and widens until it has k
+NEAREST_START_RADIUS_KM = 1.0
+HALF_EARTH_CIRCUMFERENCE_KM = math.pi * EARTH_RADIUS_KM
+# Largest k accepted by /api/devices/nearest
+MAX_NEAREST_DEVICES = 100
+# Fleet status: devices seen within this many seconds are online
+FLEET_ONLINE_SECONDS = int(os.environ.get('FLEET_ONLINE_SECONDS', '900'))
+# Stay under SQLite's bound parameter limit for IN (...) queries
+SQLITE_MAX_PARAMS = 900
+# Location history paging and export
+MAX_HISTORY_PAGE = 1000
+EXPORT_BATCH_SIZE = 5000
+# Simplified tracks are cached per device, window and tolerance
+TRACK_CACHE_SIZE = int(os.environ.get('TRACK_CACHE_SIZE', '256'))
+TRACK_CACHE_TTL = float(os.environ.get('TRACK_CACHE_TTL', '300'))
+# Raw points simplified at a time; longer windows are simplified chunk by
+# chunk, so memory stays bounded however busy the device was
+SIMPLIFY_CHUNK_POINTS = int(os.environ.get('SIMPLIFY_CHUNK_POINTS', '50000'))
+MAX_MAP_ZOOM = 22
+# Retention: raw points older than RETENTION_RAW_DAYS are compacted into
+# hourly/daily rollups, hourly rollups are dropped after
+# RETENTION_HOURLY_DAYS and daily rollups are kept; 0 keeps forever, the
+# default, so operators opt in. Per-user and per-device-type policies
+# override these defaults.
+RETENTION_RAW_DAYS = int(os.environ.get('RETENTION_RAW_DAYS', '0'))
+RETENTION_HOURLY_DAYS = int(os.environ.get('RETENTION_HOURLY_DAYS', '0'))
+MAINTENANCE_INTERVAL = float(os.environ.get('MAINTENANCE_INTERVAL', '3600'))
+MAINTENANCE_BATCH_SIZE = int(os.environ.get('MAINTENANCE_BATCH_SIZE', '5000'))
+MAX_RETENTION_DAYS = 36500
+ROLLUP_TABLES = {'hour': ('location_rollups_hourly', HOUR_MS), 'day': ('location_rollups_daily', DAY_MS)}
+ROLLUP_COLUMNS = ('point_count', 'latitude', 'longitude', 'min_lat', 'max_lat', 'min_lon', 'max_lon',
+                  'distance', 'first_timestamp', 'last_timestamp', 'last_latitude', 'last_longitude')
+# resolution=auto serves windows longer than this from the daily rollups
+ROLLUP_AUTO_DAILY_DAYS = 60
+MAX_ROLLUP_PAGE = 10000
+# Live location streams (Server-Sent Events); each open stream holds a
+# worker thread, so they are capped per process
+SSE_MAX_SUBSCRIBERS = int(os.environ.get('SSE_MAX_SUBSCRIBERS', '200'))
+SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', '100'))
+SSE_KEEPALIVE_SECONDS = 15
+HISTORY_COLUMNS = ('id', 'latitude', 'longitude', 'ip_address', 'city', 'region', 'country',
+                   'timestamp', 'time')
+# Largest number of points accepted by /api/update_locations
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', '5000'))
+# Opt-in sampling profiler for request threads; 0 leaves it off until
+# started through /api/debug/profile, which answers 404 unless
+# ENABLE_PROFILER=1
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '0'))
+ENABLE_PROFILER = os.environ.get('ENABLE_PROFILER', '0') == '1'
+# Backpressure: as the ingest queue fills or writer lock queues grow, write
+# responses recommend a longer client update interval (up to
+# SHED_MAX_INTERVAL seconds); at full load writes are refused with 503.
+# MIN_CLIENT_INTERVAL is a fleet-wide floor recommended even when idle, but
+# only enforced with 429 once load passes SHED_START_LOAD.
+MIN_CLIENT_INTERVAL = int(os.environ.get('MIN_CLIENT_INTERVAL', '0'))
+SHED_MAX_INTERVAL = int(os.environ.get('SHED_MAX_INTERVAL', '1800'))
+SHED_LOCK_QUEUE = float(os.environ.get('SHED_LOCK_QUEUE', '4'))
+SHED_START_LOAD = 0.5
+SHED_RETRY_AFTER = 60
+# Largest gzip-encoded request body accepted, before and after inflating
+MAX_INFLATED_BODY_BYTES = int(os.environ.get('MAX_INFLATED_BODY_BYTES', str(16 * 1024 * 1024)))
+
+def geofence_transitions(device_id, fences, points):
+    """Enter/exit transitions of time-ordered points against get_geofence_states rows
+
+    A fence's first evaluation only records its starting state, and points
+    older than a fence's last recorded change are ignored, so a late point
+    cannot undo a newer transition. Returns (geofence_state rows to write,
+    events) for update_geofence_states.
+    """
+    lats = [point[0] for point in points]
+    lons = [point[1] for point in points]
+    fence_lats = [fence[2] for fence in fences]
+    fence_lons = [fence[3] for fence in fences]
+    radii = [fence[4] for fence in fences]
+    bands = [min(GEOFENCE_HYSTERESIS / 1000, radius / 2) for radius in radii]
+    # Entering tests against the shrunken radius, leaving against the grown one
+    inner = inside_fences(lats, lons, fence_lats, fence_lons,
+                          [radius - band for radius, band in zip(radii, bands)])
+    outer = inside_fences(lats, lons, fence_lats, fence_lons,
+                          [radius + band for radius, band in zip(radii, bands)])
+
+    states = [None if fence[5] is None else bool(fence[5]) for fence in fences]
+    updated = [fence[6] for fence in fences]
+    changed = {}
+    events = []
+    for p, (latitude, longitude, timestamp) in enumerate(points):
+        for i, fence in enumerate(fences):
+            previous = states[i]
+            if updated[i] is not None and timestamp < updated[i]:
+                continue
+            if previous is None:
+                inside = haversine_distance(latitude, longitude, fence[2], fence[3]) <= fence[4]
+            elif previous:
+                inside = outer[p][i]
+            else:
+                inside = inner[p][i]
+            if inside == previous:
+                continue
+            states[i] = inside
+            updated[i] = timestamp
+            changed[fence[0]] = (device_id, fence[0], int(inside), timestamp)
+            if previous is not None:
+                events.append((fence[0], 'enter' if inside else 'exit', latitude, longitude,
+                               haversine_distance(latitude, longitude, fence[2], fence[3]), timestamp))
+    return list(changed.values()), events
+
+@timed_methods
 class DatabaseManager:
     def __init__(self, db_name='device_tracker.db'):
-        """Initialize database connection and setup tables"""
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        # Add mutex for thread safety
-        self.lock = threading.Lock()
+        """Initialize the connection pool and setup tables"""
+        self.db_name = db_name
+        # Per-method lock wait/execution timers and commit counters
+        self.metrics = DatabaseMetrics()
+        # One read-write connection, used under self.lock, and a bounded
+        # pool of read-only connections checked out for one query at a time
+        self._connections = []
+        # Reentrant: the writer connection is opened while holding it
+        self._pool_lock = threading.RLock()
+        self._write_conn = None
+        self._changes = 0
+        self._idle_readers = queue.Queue()
+        self._reader_count = 0
+        # SQLite allows a single writer, so writes are serialized here while
+        # reads run concurrently on the pooled read-only connections.
+        # Reentrant so a write path may call another locked helper.
+        self.lock = TimedLock(threading.RLock(), self.metrics)
+        # Device rows keyed by id; write paths that change a device
+        # invalidate it here
+        self.device_cache = TTLCache(DEVICE_CACHE_SIZE, DEVICE_CACHE_TTL)
+        # Token hash -> device id for tokens already checked against the table.
+        # Every revocation bumps the generation, and a lookup only caches
+        # what it read if no revocation committed in between
+        self.token_cache = TTLCache(DEVICE_CACHE_SIZE, DEVICE_CACHE_TTL)
+        self.token_generation = 0
+        self._token_lock = threading.Lock()
+        # Keys carry the device's track generation, which every ingest bumps,
+        # so new points make older simplified tracks unreachable
+        self.track_cache = TTLCache(TRACK_CACHE_SIZE, TRACK_CACHE_TTL)
+        self.track_generations = {}
+        # Live streams; every committed point is published here
+        self.broker = LocationBroker(SSE_MAX_SUBSCRIBERS, SSE_QUEUE_SIZE)
         self.setup_database()
 
+    def _connect(self, readonly=False):
+        """Open a new connection with the pool's pragmas applied"""
+        if readonly:
+            uri = f"file:{os.path.abspath(self.db_name)}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn = sqlite3.connect(self.db_name, check_same_thread=False)
+            # Must precede WAL, which initializes a new file; a no-op on
+            # existing databases (see migrations.enable_incremental_vacuum)
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        with self._pool_lock:
+            self._connections.append(conn)
+        return conn
+
+    def _writer(self):
+        """Get the read-write connection (hold self.lock)"""
+        with self._pool_lock:
+            if self._write_conn is None:
+                self._write_conn = self._connect()
+            return self._write_conn
+
+    @contextmanager
+    def _reader(self):
+        """Check a read-only connection out of the pool for the with block
+
+        Fetch the results inside the block; the connection goes back to the
+        pool as soon as it ends, so idle threads never hold one.
+        """
+        idle = self._idle_readers
+        conn = self._checkout_reader(idle)
+        try:
+            yield conn
+        finally:
+            idle.put(conn)
+
+    def _checkout_reader(self, idle):
+        try:
+            return idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            grow = self._reader_count < DB_READ_POOL_SIZE
+            if grow:
+                self._reader_count += 1
+        if grow:
+            return self._connect(readonly=True)
+        try:
+            return idle.get(timeout=DB_POOL_TIMEOUT)
+        except queue.Empty:
+            raise sqlite3.OperationalError("No database reader available")
+
+    def close(self):
+        """Close every pooled connection"""
+        with self._pool_lock:
+            connections, self._connections = self._connections, []
+            self._write_conn = None
+            self._idle_readers = queue.Queue()
+            self._reader_count = 0
+        for conn in connections:
+            conn.close()
+
     def setup_database(self):
-        """Create necessary tables if they don't exist"""
+        """Bring the schema up to date by applying pending migrations"""
         with self.lock:
-            # Users table - Add salt column for password security
-            self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                salt TEXT NOT NULL
-            )
-            ''')
-
-            # Rest of the tables remain the same
-            self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS devices (
-                id INTEGER PRIMARY KEY,
-                user_id INTEGER,
-                device_name TEXT NOT NULL,
-                device_type TEXT NOT NULL,
-                registered_date TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-            ''')
-
-            self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS locations (
-                id INTEGER PRIMARY KEY,
-                device_id INTEGER,
-                latitude REAL NOT NULL,
-                longitude REAL NOT NULL,
-                ip_address TEXT,
-                city TEXT,
-                region TEXT,
-                country TEXT,
-                timestamp TEXT NOT NULL,
-                FOREIGN KEY (device_id) REFERENCES devices (id)
-            )
-            ''')
-
-            self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS geofences (
-                id INTEGER PRIMARY KEY,
-                device_id INTEGER,
-                latitude REAL NOT NULL,
-                longitude REAL NOT NULL,
-                radius REAL NOT NULL,
-                name TEXT NOT NULL,
-                FOREIGN KEY (device_id) REFERENCES devices (id)
-            )
-            ''')
-
-            self.conn.commit()
+            conn = self._writer()
+            apply_migrations(conn)
+            ensure_latest_location_table(conn)
+            if not incremental_vacuum_enabled(conn):
+                print(f"Warning: {self.db_name} does not use incremental auto-vacuum, so pruned "
+                      f"history will not shrink the file; run 'python migrations.py --vacuum "
+                      f"{self.db_name}' with the server stopped")
+            # Migration changes are not counted as rows written
+            self._changes = conn.total_changes
+
+    def _commit(self, conn):
+        """Commit the writer transaction, counting it and the rows it changed"""
+        conn.commit()
+        changes = conn.total_changes
+        self.metrics.record_commit(changes - self._changes)
+        self._changes = changes
+
+    def _rollback(self, conn):
+        conn.rollback()
+        self._changes = conn.total_changes
 
     def register_user(self, username, password):
         """Register a new user with salted password"""
-        with self.lock:
-            # Generate a random salt
-            salt = secrets.token_hex(16)
-            # Hash the password with the salt
-            hashed_password = hashlib.sha256((password + salt).encode()).hexdigest()
+        # Generate a random salt
+        salt = secrets.token_hex(16)
+        # Hash the password with the salt
+        hashed_password = hashlib.sha256((password + salt).encode()).hexdigest()
 
+        with self.lock:
+            conn = self._writer()
             try:
-                self.cursor.execute(
+                conn.execute(
                     "INSERT INTO users (username, password, salt) VALUES (?, ?, ?)",
                     (username, hashed_password, salt)
                 )
-                self.conn.commit()
+                self._commit(conn)
                 return True
             except sqlite3.IntegrityError:
+                self._rollback(conn)
                 return False
 
     def verify_user(self, username, password):
         """Verify user credentials using salted password"""
-        with self.lock:
-            # Get the user's salt
-            self.cursor.execute("SELECT id, password, salt FROM users WHERE username = ?", (username,))
-            result = self.cursor.fetchone()
+        # Get the user's salt
+        with self._reader() as conn:
+            result = conn.execute(
+                "SELECT id, password, salt FROM users WHERE username = ?", (username,)
+            ).fetchone()
 
-            if not result:
-                return None
+        if not result:
+            return None
 
-            user_id, stored_hash, salt = result
-            # Compute the hash with the provided password and stored salt
-            hashed_password = hashlib.sha256((password + salt).encode()).hexdigest()
+        user_id, stored_hash, salt = result
+        # Compute the hash with the provided password and stored salt
+        hashed_password = hashlib.sha256((password + salt).encode()).hexdigest()
 
-            # Compare the computed hash with the stored hash
-            if hashed_password == stored_hash:
-                return user_id
-            return None
+        # Compare the computed hash with the stored hash
+        if hashed_password == stored_hash:
+            return user_id
+        return None
 
-    # Other methods remain similar but use the lock for thread safety
+    # Writes are serialized on self.lock, reads use the read-only pool
     def register_device(self, user_id, device_name, device_type):
         """Register a new device for a user"""
         with self.lock:
+            conn = self._writer()
             try:
-                self.cursor.execute(
+                cursor = conn.execute(
                     "INSERT INTO devices (user_id, device_name, device_type, registered_date) VALUES (?, ?, ?, ?)",
                     (user_id, device_name, device_type, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
                 )
-                self.conn.commit()
-                return self.cursor.lastrowid
+                self._commit(conn)
+                self.device_cache.invalidate(cursor.lastrowid)
+                return cursor.lastrowid
             except Exception as e:
+                self._rollback(conn)
                 print(f"Error registering device: {str(e)}")
                 return None
 
     def get_user_devices(self, user_id):
         """Get all devices for a user"""
-        with self.lock:
-            self.cursor.execute(
+        with self._reader() as conn:
+            return conn.execute(
                 "SELECT id, device_name, device_type, registered_date FROM devices WHERE user_id = ?",
                 (user_id,)
-            )
-            return self.cursor.fetchall()
+            ).fetchall()
+
+    def find_user_device(self, user_id, device_name):
+        """Get the id of a user's device by name, or None"""
+        with self._reader() as conn:
+            row = conn.execute(
+                "SELECT id FROM devices WHERE user_id = ? AND device_name = ?",
+                (user_id, device_name)
+            ).fetchone()
+        return row[0] if row else None
+
+    def issue_device_token(self, device_id):
+        """Create a new API token for a device, revoking any previous one"""
+        token = secrets.token_urlsafe(32)
+        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        with self.lock:
+            conn = self._writer()
+            try:
+                old = conn.execute(
+                    "SELECT token_hash FROM device_tokens WHERE device_id = ?", (device_id,)
+                ).fetchone()
+                conn.execute(
+                    "INSERT INTO device_tokens (device_id, token_hash, created) VALUES (?, ?, ?) "
+                    "ON CONFLICT(device_id) DO UPDATE SET token_hash = excluded.token_hash, "
+                    "created = excluded.created",
+                    (device_id, token_hash, epoch_ms())
+                )
+                self._commit(conn)
+            except Exception as e:
+                self._rollback(conn)
+                print(f"Error issuing device token: {str(e)}")
+                return None
+        if old:
+            with self._token_lock:
+                self.token_generation += 1
+                self.token_cache.invalidate(old[0])
+        return token
+
+    def verify_device_token(self, token):
+        """Return the device id a token belongs to, or None"""
+        # Tokens are 256-bit random values, so an unsalted hash is enough
+        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        device_id = self.token_cache.get(token_hash)
+        if device_id is not None:
+            return device_id
+        generation = self.token_generation
+        with self._reader() as conn:
+            row = conn.execute(
+                "SELECT device_id FROM device_tokens WHERE token_hash = ?", (token_hash,)
+            ).fetchone()
+        if row is None:
+            return None
+        with self._token_lock:
+            # A token revoked after the read must not be cached
+            if self.token_generation == generation:
+                self.token_cache.put(token_hash, row[0])
+        return row[0]
 
     def get_device_details(self, device_id):
-        """Get device details"""
-        with self.lock:
-            self.cursor.execute(
+        """Get device details, served from the device cache when possible"""
+        device_id = int(device_id)
+        device = self.device_cache.get(device_id)
+        if device is not None:
+            return device
+        with self._reader() as conn:
+            device = conn.execute(
                 "SELECT d.id, d.device_name, d.device_type, d.registered_date, u.username "
                 "FROM devices d JOIN users u ON d.user_id = u.id WHERE d.id = ?",
                 (device_id,)
-            )
-            return self.cursor.fetchone()
+            ).fetchone()
+        # Unknown ids are not cached, so a newly registered device is
+        # visible immediately
+        if device is not None:
+            self.device_cache.put(device_id, device)
+        return device
 
     def update_device_location(self, device_id, latitude, longitude, ip_address=None,
                               city=None, region=None, country=None):
         """Update the location of a device"""
         with self.lock:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.cursor.execute(
-                "INSERT INTO locations (device_id, latitude, longitude, ip_address, city, region, country, timestamp) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                (device_id, latitude, longitude, ip_address, city, region, country, timestamp)
-            )
-            self.conn.commit()
+            conn = self._writer()
+            row = (device_id, latitude, longitude, ip_address, city, region, country, epoch_ms())
+            try:
+                conn.execute(
+                    "INSERT INTO locations (device_id, latitude, longitude, ip_address, city, region, country, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    row
+                )
+                conn.execute(UPSERT_LATEST_LOCATION_SQL, row)
+                self._commit(conn)
+            except Exception:
+                self._rollback(conn)
+                raise
+            self._bump_track_generations([device_id])
+
+        self._publish_locations([row])
+
+        # Geofences are evaluated outside the write critical section so other
+        # writers are not held up by the fence loop
+        self.update_geofence_states(device_id, [(latitude, longitude, row[7])])
+
+        return True
+
+    def _bump_track_generations(self, device_ids):
+        """Invalidate cached simplified tracks of devices that got new points (hold self.lock)"""
+        for device_id in map(int, device_ids):
+            self.track_generations[device_id] = self.track_generations.get(device_id, 0) + 1
+
+    def _publish_locations(self, rows):
+        """Fan committed points out to the device and owner live streams
+
+        rows are location rows with epoch-ms timestamps, at most one per device.
+        """
+        if not self.broker.has_subscribers():
+            return
+        for row in rows:
+            device_id = row[0]
+            device = self.get_device_details(device_id)
+            topics = [topic for topic in (('device', device_id), ('user', device[4] if device else None))
+                      if self.broker.has_subscribers(topic)]
+            if not topics:
+                continue
+            event = {
+                "device_id": device_id, "latitude": row[1], "longitude": row[2],
+                "ip_address": row[3], "city": row[4], "region": row[5], "country": row[6],
+                "timestamp": row[7],
+                "time": datetime.datetime.fromtimestamp(row[7] / 1000).strftime("%Y-%m-%d %H:%M:%S")
+            }
+            for topic in topics:
+                self.broker.publish(topic, event)
+
+    def get_existing_device_ids(self, device_ids):
+        """Return the subset of device_ids that exist, using one IN query per chunk
+
+        Cached devices skip the query; the rest are loaded into the cache.
+        """
+        existing = set()
+        missing = []
+        for device_id in set(map(int, device_ids)):
+            if self.device_cache.get(device_id) is not None:
+                existing.add(device_id)
+            else:
+                missing.append(device_id)
+        for i in range(0, len(missing), SQLITE_MAX_PARAMS):
+            chunk = missing[i:i + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            with self._reader() as conn:
+                rows = conn.execute(
+                    "SELECT d.id, d.device_name, d.device_type, d.registered_date, u.username "
+                    f"FROM devices d JOIN users u ON d.user_id = u.id WHERE d.id IN ({placeholders})",
+                    chunk
+                ).fetchall()
+            for row in rows:
+                self.device_cache.put(row[0], row)
+                existing.add(row[0])
+        return existing
+
+    def update_device_locations(self, points):
+        """Insert many location points in a single transaction
+
+        points is a list of (device_id, latitude, longitude, ip_address,
+        city, region, country[, timestamp]) tuples, timestamps in epoch
+        milliseconds; points without one are stamped with the current time.
+        Geofence states are updated afterwards, once per device.
+        """
+        if not points:
+            return 0
+        timestamp = epoch_ms()
+        rows = [point if len(point) == 8 else point + (timestamp,) for point in points]
+        # Only the newest point of each device needs to touch the latest table
+        latest = {}
+        for row in rows:
+            if row[0] not in latest or row[7] >= latest[row[0]][7]:
+                latest[row[0]] = row
+        with self.lock:
+            conn = self._writer()
+            try:
+                conn.executemany(
+                    "INSERT INTO locations (device_id, latitude, longitude, ip_address, city, region, country, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                conn.executemany(UPSERT_LATEST_LOCATION_SQL, latest.values())
+                self._commit(conn)
+            except Exception:
+                self._rollback(conn)
+                raise
+            self._bump_track_generations(latest)
 
-            # Check geofences
-            self.check_geofences(device_id, latitude, longitude)
+        self._publish_locations(latest.values())
 
-            return True
+        points_by_device = {}
+        for row in sorted(rows, key=lambda row: row[7]):
+            points_by_device.setdefault(row[0], []).append((row[1], row[2], row[7]))
+        for device_id, device_points in points_by_device.items():
+            self.update_geofence_states(device_id, device_points)
+
+        return len(points)
 
     def get_device_location_history(self, device_id, limit=20):
         """Get the location history for a device"""
-        with self.lock:
-            self.cursor.execute(
-                "SELECT latitude, longitude, ip_address, city, region, country, timestamp "
+        with self._reader() as conn:
+            return conn.execute(
+                f"SELECT latitude, longitude, ip_address, city, region, country, {LOCAL_TIMESTAMP_SQL} "
                 "FROM locations WHERE device_id = ? ORDER BY timestamp DESC LIMIT ?",
                 (device_id, limit)
-            )
-            return self.cursor.fetchall()
+            ).fetchall()
+
+    def get_location_page(self, device_id, start=None, end=None, cursor=None, limit=100,
+                          newest_first=True):
+        """One page of location history, keyset-paginated on (timestamp, id)
+
+        start and end bound the epoch-ms timestamp (inclusive, exclusive).
+        cursor is the (timestamp, id) of the last row of the previous page.
+        Rows are HISTORY_COLUMNS tuples.
+        """
+        clauses = ["device_id = ?"]
+        params = [device_id]
+        # The cursor replaces the range bound on the side pages advance
+        # from; leaving both makes SQLite seek to the range bound and scan
+        # every earlier page again
+        if cursor is not None:
+            if newest_first and (end is None or cursor[0] < end):
+                end = None
+            elif not newest_first and (start is None or cursor[0] >= start):
+                start = None
+            else:
+                cursor = None
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("timestamp < ?")
+            params.append(end)
+        if cursor is not None:
+            clauses.append(f"(timestamp, id) {'<' if newest_first else '>'} (?, ?)")
+            params.extend(cursor)
+        order = "DESC" if newest_first else "ASC"
+        params.append(limit)
+        with self._reader() as conn:
+            return conn.execute(
+                "SELECT id, latitude, longitude, ip_address, city, region, country, timestamp, "
+                f"{LOCAL_TIMESTAMP_SQL} FROM locations WHERE {' AND '.join(clauses)} "
+                f"ORDER BY timestamp {order}, id {order} LIMIT ?",
+                params
+            ).fetchall()
+
+    def iter_location_history(self, device_id, start=None, end=None, batch_size=EXPORT_BATCH_SIZE):
+        """Yield a device's location history oldest first, batch_size rows at a time
+
+        Each batch is its own keyset query, so memory stays constant and no
+        read transaction is held open while a slow client drains the export.
+        """
+        cursor = None
+        while True:
+            rows = self.get_location_page(device_id, start, end, cursor, batch_size, newest_first=False)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            cursor = (rows[-1][7], rows[-1][0])
+
+    def get_simplified_track(self, device_id, start=None, end=None, tolerance_km=0.0):
+        """Location history in a window, oldest first, simplified to tolerance_km
+
+        The window is simplified SIMPLIFY_CHUNK_POINTS raw points at a time.
+        Consecutive chunks share their boundary point, which simplification
+        always keeps, so no dropped point is further than tolerance_km from
+        the track. Returns (rows, raw_count).
+        """
+        device_id = int(device_id)
+        key = (device_id, start, end, tolerance_km, self.track_generations.get(device_id, 0))
+        cached = self.track_cache.get(key)
+        if cached is not None:
+            return cached
+        rows = []
+        chunk = []
+        raw_count = 0
+        for row in self.iter_location_history(device_id, start, end):
+            raw_count += 1
+            chunk.append(row)
+            if len(chunk) == SIMPLIFY_CHUNK_POINTS:
+                kept = simplify_track([point[1] for point in chunk], [point[2] for point in chunk], tolerance_km)
+                # After the first chunk, index 0 is the boundary point already in rows
+                rows.extend(chunk[i] for i in kept[1 if rows else 0:])
+                chunk = [chunk[-1]]
+        if len(chunk) > 1 or not rows:
+            kept = simplify_track([point[1] for point in chunk], [point[2] for point in chunk], tolerance_km)
+            rows.extend(chunk[i] for i in kept[1 if rows else 0:])
+        result = (rows, raw_count)
+        self.track_cache.put(key, result)
+        return result
+
+    def set_retention_policy(self, raw_days, hourly_days, user_id=None, device_type=None):
+        """Create or replace the retention policy for a user and/or device type"""
+        with self.lock:
+            conn = self._writer()
+            try:
+                conn.execute(
+                    "DELETE FROM retention_policies WHERE user_id IS ? AND device_type IS ?",
+                    (user_id, device_type)
+                )
+                conn.execute(
+                    "INSERT INTO retention_policies (user_id, device_type, raw_days, hourly_days) "
+                    "VALUES (?, ?, ?, ?)",
+                    (user_id, device_type, raw_days, hourly_days)
+                )
+                self._commit(conn)
+                return True
+            except Exception as e:
+                self._rollback(conn)
+                print(f"Error setting retention policy: {str(e)}")
+                return False
 
-    def get_latest_device_location(self, device_id):
-        """Get the latest location for a device"""
+    def get_retention_policies(self):
+        with self._reader() as conn:
+            return conn.execute(
+                "SELECT user_id, device_type, raw_days, hourly_days FROM retention_policies"
+            ).fetchall()
+
+    def get_retention_devices(self):
+        """Every device with the fields retention policies match on"""
+        with self._reader() as conn:
+            return conn.execute("SELECT id, user_id, device_type FROM devices").fetchall()
+
+    def compact_locations(self, device_id, cutoff, batch_size):
+        """Fold up to batch_size of a device's oldest raw points before cutoff into the rollups
+
+        The points are merged into the hourly and daily rollups and deleted
+        in one transaction. Returns how many points were compacted.
+        """
+        columns = ", ".join(ROLLUP_COLUMNS)
+        placeholders = ", ".join("?" * (len(ROLLUP_COLUMNS) + 2))
         with self.lock:
-            self.cursor.execute(
-                "SELECT latitude, longitude, ip_address, city, region, country, timestamp "
-                "FROM locations WHERE device_id = ? ORDER BY timestamp DESC LIMIT 1",
+            conn = self._writer()
+            rows = conn.execute(
+                "SELECT id, latitude, longitude, timestamp FROM locations "
+                "WHERE device_id = ? AND timestamp < ? ORDER BY timestamp, id LIMIT ?",
+                (device_id, cutoff, batch_size)
+            ).fetchall()
+            if not rows:
+                return 0
+            points = [row[1:] for row in rows]
+            # Continue distance travelled from the last point already compacted
+            previous = conn.execute(
+                "SELECT last_latitude, last_longitude, last_timestamp FROM location_rollups_daily "
+                "WHERE device_id = ? AND timestamp <= ? ORDER BY timestamp DESC LIMIT 1",
+                (device_id, points[0][2])
+            ).fetchone()
+            previous = previous[:2] if previous and previous[2] <= points[0][2] else None
+            try:
+                for table, bucket_ms in ROLLUP_TABLES.values():
+                    for bucket, summary in summarize_buckets(points, bucket_ms, previous).items():
+                        existing = conn.execute(
+                            f"SELECT {columns} FROM {table} WHERE device_id = ? AND timestamp = ?",
+                            (device_id, bucket)
+                        ).fetchone()
+                        conn.execute(
+                            f"INSERT OR REPLACE INTO {table} (device_id, timestamp, {columns}) "
+                            f"VALUES ({placeholders})",
+                            merge_rollup(device_id, bucket, summary, existing)
+                        )
+                # Every earlier point is already gone, so this deletes exactly the batch
+                conn.execute(
+                    "DELETE FROM locations WHERE device_id = ? AND (timestamp, id) <= (?, ?)",
+                    (device_id, rows[-1][3], rows[-1][0])
+                )
+                self._commit(conn)
+            except Exception:
+                self._rollback(conn)
+                raise
+            self._bump_track_generations([device_id])
+        return len(rows)
+
+    def prune_hourly_rollups(self, device_id, cutoff):
+        """Delete a device's hourly rollups older than cutoff; daily rollups are kept"""
+        with self.lock:
+            conn = self._writer()
+            try:
+                cursor = conn.execute(
+                    "DELETE FROM location_rollups_hourly WHERE device_id = ? AND timestamp < ?",
+                    (device_id, cutoff)
+                )
+                self._commit(conn)
+            except Exception:
+                self._rollback(conn)
+                raise
+            return cursor.rowcount
+
+    def incremental_vacuum(self, max_pages):
+        """Return up to max_pages free pages to the filesystem; returns pages freed"""
+        with self.lock:
+            conn = self._writer()
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # execute() would step the pragma once and free a single page
+            conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+            return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def get_location_rollups(self, device_id, resolution, start=None, end=None, limit=MAX_ROLLUP_PAGE):
+        """Hourly or daily rollups of a device's compacted history, oldest first
+
+        Rows are (timestamp, time, point_count, latitude, longitude, min_lat,
+        max_lat, min_lon, max_lon, distance), timestamp being the bucket start.
+        """
+        table = ROLLUP_TABLES[resolution][0]
+        clauses = ["device_id = ?"]
+        params = [device_id]
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("timestamp < ?")
+            params.append(end)
+        params.append(limit)
+        with self._reader() as conn:
+            return conn.execute(
+                f"SELECT timestamp, {LOCAL_TIMESTAMP_SQL}, point_count, latitude, longitude, "
+                f"min_lat, max_lat, min_lon, max_lon, distance FROM {table} "
+                f"WHERE {' AND '.join(clauses)} ORDER BY timestamp LIMIT ?",
+                params
+            ).fetchall()
+
+    def touch_device(self, device_id):
+        """Mark a stationary device as seen now without storing another point
+
+        Only the latest-location timestamp moves; history, the spatial index
+        and geofence state are untouched. Returns False if the device has
+        never reported a location.
+        """
+        with self.lock:
+            conn = self._writer()
+            try:
+                cursor = conn.execute(
+                    "UPDATE device_latest_location SET timestamp = MAX(timestamp, ?) WHERE device_id = ?",
+                    (epoch_ms(), device_id)
+                )
+                self._commit(conn)
+            except Exception:
+                self._rollback(conn)
+                raise
+        return cursor.rowcount > 0
+
+    def get_latest_device_location(self, device_id):
+        """Get the latest location for a device from the materialized table"""
+        with self._reader() as conn:
+            return conn.execute(
+                f"SELECT latitude, longitude, ip_address, city, region, country, {LOCAL_TIMESTAMP_SQL} "
+                "FROM device_latest_location WHERE device_id = ?",
                 (device_id,)
-            )
-            return self.cursor.fetchone()
+            ).fetchone()
+
+    def get_fleet(self, user_id):
+        """All of a user's devices with latest position and violated geofences, in one query
+
+        Rows are (id, name, type, registered, latitude, longitude, last seen,
+        last seen epoch ms, city, region, country, violated geofences as a
+        JSON array of {id, name}); location fields are None for devices
+        that never reported.
+        """
+        with self._reader() as conn:
+            return conn.execute(
+                "SELECT d.id, d.device_name, d.device_type, d.registered_date, "
+                f"ll.latitude, ll.longitude, {LOCAL_TIMESTAMP_SQL}, ll.timestamp, "
+                "ll.city, ll.region, ll.country, "
+                "(SELECT json_group_array(json_object('id', g.id, 'name', g.name)) "
+                " FROM geofence_state gs JOIN geofences g ON g.id = gs.geofence_id "
+                " WHERE gs.device_id = d.id AND gs.inside = 0) "
+                "FROM devices d LEFT JOIN device_latest_location ll ON ll.device_id = d.id "
+                "WHERE d.user_id = ? ORDER BY d.id",
+                (user_id,)
+            ).fetchall()
 
     def add_geofence(self, device_id, name, latitude, longitude, radius):
         """Add a geofence for a device"""
         with self.lock:
-            self.cursor.execute(
-                "INSERT INTO geofences (device_id, latitude, longitude, radius, name) VALUES (?, ?, ?, ?, ?)",
-                (device_id, latitude, longitude, radius, name)
-            )
-            self.conn.commit()
+            conn = self._writer()
+            try:
+                cursor = conn.execute(
+                    "INSERT INTO geofences (device_id, latitude, longitude, radius, name) VALUES (?, ?, ?, ?, ?)",
+                    (device_id, latitude, longitude, radius, name)
+                )
+                conn.execute(
+                    "INSERT INTO geofence_rtree (id, min_lat, max_lat, min_lon, max_lon, device_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (cursor.lastrowid,) + bounding_box(latitude, longitude, radius) + (device_id,)
+                )
+                self._commit(conn)
+            except Exception:
+                self._rollback(conn)
+                raise
             return True
 
     def get_device_geofences(self, device_id):
         """Get all geofences for a device"""
-        with self.lock:
-            self.cursor.execute(
+        with self._reader() as conn:
+            return conn.execute(
                 "SELECT id, name, latitude, longitude, radius FROM geofences WHERE device_id = ?",
                 (device_id,)
-            )
-            return self.cursor.fetchall()
+            ).fetchall()
+
+    def _devices_in_box(self, user_id, latitude, longitude, radius_km):
+        """A user's devices whose latest position is within radius_km, nearest first
+
+        The R*Tree narrows the search to the circle's bounding box; exact
+        haversine then drops the corners.
+        """
+        min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+        with self._reader() as conn:
+            rows = conn.execute(
+                "SELECT d.id, d.device_name, ll.latitude, ll.longitude, "
+                f"{LOCAL_TIMESTAMP_SQL} "
+                "FROM device_position_rtree r "
+                "JOIN devices d ON d.id = r.id "
+                "JOIN device_latest_location ll ON ll.device_id = r.id "
+                "WHERE r.min_lat <= ? AND r.max_lat >= ? AND r.min_lon <= ? AND r.max_lon >= ? "
+                "AND r.user_id = ?",
+                (max_lat, min_lat, max_lon, min_lon, user_id)
+            ).fetchall()
+        if not rows:
+            return []
+        distances = haversine_many(latitude, longitude, [row[2] for row in rows], [row[3] for row in rows])
+        nearby = [row + (distance,) for row, distance in zip(rows, distances) if distance <= radius_km]
+        nearby.sort(key=lambda row: row[-1])
+        return nearby
+
+    def find_devices_near(self, user_id, latitude, longitude, radius_km):
+        """Get (id, name, latitude, longitude, last_seen, distance) for devices within radius_km"""
+        return self._devices_in_box(user_id, latitude, longitude, radius_km)
+
+    def find_nearest_devices(self, user_id, latitude, longitude, k):
+        """Get the k devices whose latest position is closest to a point
+
+        Searches an expanding circle until it holds k devices; every device
+        nearer than the k-th must then lie inside the same circle.
+        """
+        radius_km = NEAREST_START_RADIUS_KM
+        while True:
+            nearby = self._devices_in_box(user_id, latitude, longitude, radius_km)
+            if len(nearby) >= k or radius_km >= HALF_EARTH_CIRCUMFERENCE_KM:
+                return nearby[:k]
+            # Grow by the density seen so far: k points need about
+            # sqrt(k / found) times the radius, with a floor on the step
+            growth = 4 if not nearby else max(1.5, 1.2 * math.sqrt(k / len(nearby)))
+            radius_km = min(radius_km * growth, HALF_EARTH_CIRCUMFERENCE_KM)
+
+    def get_geofences_containing(self, user_id, latitude, longitude):
+        """Get (id, device_id, name, latitude, longitude, radius) for a user's geofences around a point"""
+        with self._reader() as conn:
+            rows = conn.execute(
+                "SELECT g.id, g.device_id, g.name, g.latitude, g.longitude, g.radius "
+                "FROM geofence_rtree r "
+                "JOIN geofences g ON g.id = r.id "
+                "JOIN devices d ON d.id = g.device_id "
+                "WHERE r.min_lat <= ? AND r.max_lat >= ? AND r.min_lon <= ? AND r.max_lon >= ? "
+                "AND d.user_id = ?",
+                (latitude, latitude, longitude, longitude, user_id)
+            ).fetchall()
+        if not rows:
+            return []
+        distances = haversine_many(latitude, longitude, [row[3] for row in rows], [row[4] for row in rows])
+        return [row for row, distance in zip(rows, distances) if distance <= row[5]]
+
+    def get_geofence_states(self, device_id, conn=None):
+        """Get (id, name, latitude, longitude, radius, inside, updated) for a device's geofences
+
+        inside and updated, the epoch ms of the point that last changed the
+        state, are None for fences not evaluated yet. Pass the
+        writer connection, under self.lock, to read the state a write is
+        about to replace.
+        """
+        query = ("SELECT g.id, g.name, g.latitude, g.longitude, g.radius, s.inside, s.updated "
+                 "FROM geofences g LEFT JOIN geofence_state s "
+                 "ON s.device_id = g.device_id AND s.geofence_id = g.id "
+                 "WHERE g.device_id = ?")
+        if conn is not None:
+            return conn.execute(query, (device_id,)).fetchall()
+        with self._reader() as reader:
+            return reader.execute(query, (device_id,)).fetchall()
+
+    def update_geofence_states(self, device_id, points):
+        """Track enter/exit transitions for (latitude, longitude, timestamp) points in time order
+
+        A fence is only entered once the device is GEOFENCE_HYSTERESIS meters
+        inside it, and only left once it is that far outside, so jitter
+        around the boundary does not flap. Only state changes are written; a
+        steady-state point takes no lock and writes nothing.
+        Returns the (geofence_id, event, latitude, longitude, distance,
+        timestamp) events recorded.
+        """
+        fences = self.get_geofence_states(device_id)
+        if not fences or not points or not geofence_transitions(device_id, fences, points)[0]:
+            return []
+
+        with self.lock:
+            conn = self._writer()
+            # Another writer may have recorded the same transition, or a newer
+            # one, since the unlocked check; decide again from the state under the lock
+            changed, events = geofence_transitions(device_id, self.get_geofence_states(device_id, conn), points)
+            if not changed:
+                return []
+            try:
+                conn.executemany(
+                    "INSERT INTO geofence_state (device_id, geofence_id, inside, updated) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (device_id, geofence_id) DO UPDATE SET "
+                    "inside = excluded.inside, updated = excluded.updated",
+                    changed
+                )
+                conn.executemany(
+                    "INSERT INTO geofence_events (device_id, geofence_id, event, latitude, longitude, distance, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(device_id,) + event for event in events]
+                )
+                self._commit(conn)
+            except Exception:
+                self._rollback(conn)
+                raise
+        return events
+
+    def get_geofence_events(self, device_id, before_id=None, limit=50):
+        """Get a page of (id, geofence_id, name, event, latitude, longitude, distance, time), newest first"""
+        with self._reader() as conn:
+            return conn.execute(
+                "SELECT e.id, e.geofence_id, g.name, e.event, e.latitude, e.longitude, e.distance, "
+                f"{LOCAL_TIMESTAMP_SQL} "
+                "FROM geofence_events e LEFT JOIN geofences g ON g.id = e.geofence_id "
+                "WHERE e.device_id = ? AND e.id < ? ORDER BY e.id DESC LIMIT ?",
+                (device_id, before_id if before_id is not None else 2 ** 63 - 1, limit)
+            ).fetchall()
 
     def haversine_distance(self, lat1, lon1, lat2, lon2):
         """Calculate the great circle distance between two points on earth (specified in decimal degrees)"""
-        # Convert decimal degrees to radians
-        lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-
-        # Haversine formula
-        dlon = lon2 - lon1
-        dlat = lat2 - lat1
-        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-        c = 2 * math.asin(math.sqrt(a))
-        r = 6371  # Radius of earth in kilometers
-        return c * r
-
-    def check_geofences(self, device_id, latitude, longitude):
-        """Check if a device is outside any of its geofences using Haversine formula"""
-        with self.lock:
-            geofences = self.get_device_geofences(device_id)
-            alerts = []
-
-            for geofence in geofences:
-                geo_id, name, geo_lat, geo_lon, radius = geofence
-
-                # Calculate distance using Haversine formula
-                distance = self.haversine_distance(latitude, longitude, geo_lat, geo_lon)
-
-                if distance > radius:
-                    # Device is outside the geofence
-                    device = self.get_device_details(device_id)
-                    if device:
-                        device_name = device[1]
-                        alerts.append({
-                            "device_id": device_id,
-                            "device_name": device_name,
-                            "geofence_name": name,
-                            "distance": distance,
-                            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        })
-
-            return alerts
+        return haversine_distance(lat1, lon1, lat2, lon2)
 
 # Initialize database
-db = DatabaseManager()
+db = DatabaseManager(DB_PATH)
+
+# Optional write-behind ingest: 'direct' commits each request inline,
+# 'async' acknowledges once a point is queued and 'group' waits for the
+# shared group commit that contains it
+INGEST_MODE = os.environ.get('INGEST_MODE', 'direct').lower()
+ingest_writer = None
+if INGEST_MODE in ('async', 'group'):
+    ingest_writer = LocationWriter(
+        db,
+        max_batch=int(os.environ.get('INGEST_MAX_BATCH', '500')),
+        max_delay=float(os.environ.get('INGEST_MAX_DELAY_MS', '5')) / 1000,
+        max_queue=int(os.environ.get('INGEST_QUEUE_SIZE', '10000')),
+        wait_for_commit=INGEST_MODE == 'group',
+        commit_timeout=float(os.environ.get('INGEST_COMMIT_TIMEOUT', '10'))
+    ).start()
+    # Flush queued points before the process exits
+    atexit.register(ingest_writer.stop)
+
+# Background retention: compaction into rollups plus incremental vacuum
+maintenance_job = MaintenanceJob(
+    db,
+    interval=MAINTENANCE_INTERVAL,
+    batch_size=MAINTENANCE_BATCH_SIZE,
+    default_policy=(RETENTION_RAW_DAYS, RETENTION_HOURLY_DAYS)
+).start()
+atexit.register(maintenance_job.stop)
+
+# Request latency per route; streamed responses are timed to their headers
+request_duration = Histogram('tracker_http_request_duration_seconds', 'Time to produce a response',
+                             ('method', 'route', 'status'))
+profiler = SamplingProfiler((PROFILE_INTERVAL_MS or 5) / 1000)
+if PROFILE_INTERVAL_MS > 0:
+    profiler.start()
+atexit.register(profiler.stop)
+
+class GzipRequestMiddleware:
+    """Inflate request bodies sent with Content-Encoding: gzip before Flask parses them"""
+
+    def __init__(self, wsgi_app, max_size):
+        self.wsgi_app = wsgi_app
+        self.max_size = max_size
+
+    def __call__(self, environ, start_response):
+        if environ.get('HTTP_CONTENT_ENCODING', '').lower() != 'gzip':
+            return self.wsgi_app(environ, start_response)
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        if length > self.max_size:
+            return self.error(environ, start_response, "Request body too large", 413)
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            # Stop one byte past the limit so oversized bodies are never fully inflated
+            body = inflater.decompress(environ['wsgi.input'].read(length), self.max_size + 1)
+        except zlib.error:
+            return self.error(environ, start_response, "Invalid gzip body", 400)
+        if len(body) > self.max_size:
+            return self.error(environ, start_response, "Request body too large", 413)
+        environ['wsgi.input'] = io.BytesIO(body)
+        environ['CONTENT_LENGTH'] = str(len(body))
+        del environ['HTTP_CONTENT_ENCODING']
+        return self.wsgi_app(environ, start_response)
+
+    @staticmethod
+    def error(environ, start_response, message, code):
+        response = Response(json.dumps({"status": "error", "message": message}), code,
+                            mimetype='application/json')
+        return response(environ, start_response)
+
+app.wsgi_app = GzipRequestMiddleware(app.wsgi_app, MAX_INFLATED_BODY_BYTES)
+
+def parse_coordinates(latitude, longitude):
+    """Convert and range-check a coordinate pair, raising ValueError if invalid"""
+    latitude = float(latitude)
+    longitude = float(longitude)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("Invalid coordinates")
+    return latitude, longitude
+
+def device_token():
+    """The bearer token sent by a tracking client, if any"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() == 'bearer' and token.strip():
+        return token.strip()
+    return None
 
 # Flask routes with CSRF protection added
 def login_required(f):
@@ -344,7 +1182,7 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    devices = db.get_user_devices(session['user_id'])
+    devices = db.get_fleet(session['user_id'])
     return render_template('dashboard.html', devices=devices, username=session.get('username'))
 
 @app.route('/dashboard/debug')
@@ -363,12 +1201,14 @@ def device_details(device_id):
     latest_location = db.get_latest_device_location(device_id)
     history = db.get_device_location_history(device_id)
     geofences = db.get_device_geofences(device_id)
+    geofence_events = db.get_geofence_events(device_id, limit=10)
 
     return render_template('device.html',
                           device=device,
                           latest_location=latest_location,
                           history=history,
-                          geofences=geofences)
+                          geofences=geofences,
+                          geofence_events=geofence_events)
 
 @app.route('/api/register_device', methods=['POST'])
 @login_required
@@ -388,9 +1228,70 @@ def api_register_device():
         return jsonify({"status": "success", "device_id": device_id})
     return jsonify({"status": "error", "message": "Failed to register device"}), 400
 
+# Last accepted write per device, to spot clients ignoring the cadence
+device_cadence = TTLCache(DEVICE_CACHE_SIZE, SHED_MAX_INTERVAL)
+
+def server_load():
+    """Write pressure where 1.0 means full: the larger of the ingest queue
+    fill level and the threads recently queued on the writer lock relative
+    to SHED_LOCK_QUEUE"""
+    load = db.metrics.lock_queue_length() / SHED_LOCK_QUEUE
+    if ingest_writer:
+        load = max(load, ingest_writer.depth() / ingest_writer.queue.maxsize)
+    return load
+
+def recommended_interval(load):
+    """Seconds clients should wait before their next update; 0 leaves it to the client"""
+    if load <= SHED_START_LOAD:
+        return MIN_CLIENT_INTERVAL
+    scaled = SHED_MAX_INTERVAL * min(1.0, (load - SHED_START_LOAD) / (1 - SHED_START_LOAD))
+    return int(max(MIN_CLIENT_INTERVAL, scaled))
+
+def throttled(message, code, retry_after):
+    """429/503 response whose Retry-After is jittered so clients do not return in lockstep"""
+    response = jsonify({"status": "error", "message": message})
+    response.status_code = code
+    response.headers['Retry-After'] = str(math.ceil(retry_after * random.uniform(1.0, 1.5)))
+    return response
+
+def admit_write(device_id=None):
+    """Backpressure check before a write: (throttled response or None, recommended interval)
+
+    With a device_id and load past SHED_START_LOAD, a device writing again
+    within half the recommended interval is told to back off with 429. An
+    idle server lets a client send its catch-up batches back to back.
+    """
+    load = server_load()
+    if load >= 1:
+        return throttled("Server overloaded, retry later", 503, SHED_RETRY_AFTER), None
+    interval = recommended_interval(load)
+    if interval and device_id is not None and load > SHED_START_LOAD:
+        now = time.monotonic()
+        last = device_cadence.get(device_id)
+        if last is not None and now - last < interval / 2:
+            return throttled("Updating too often", 429, interval - (now - last)), None
+        device_cadence.put(device_id, now)
+    return None, interval
+
+def packed_point_json(body):
+    """The single point of a binary body as the JSON update would carry it"""
+    device_id, _, rows = wire.decode_points(body)
+    if len(rows) != 1:
+        raise ValueError("Expected exactly one point")
+    data = dict(zip(('latitude', 'longitude') + wire.PLACE_FIELDS, rows[0]))
+    if device_id is not None:
+        data['device_id'] = device_id
+    return data
+
 @app.route('/api/update_location', methods=['POST'])
 def api_update_location():
-    data = request.get_json()
+    if request.mimetype == wire.CONTENT_TYPE:
+        try:
+            data = packed_point_json(request.get_data())
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+    else:
+        data = request.get_json()
     device_id = data.get('device_id')
     latitude = data.get('latitude')
     longitude = data.get('longitude')
@@ -399,22 +1300,215 @@ def api_update_location():
     region = data.get('region')
     country = data.get('country')
 
-    # Verify the device exists
-    device = db.get_device_details(device_id)
-    if not device:
+    # Cache keys and stored rows use the integer id, whatever the JSON held
+    if device_id is not None:
+        try:
+            device_id = int(device_id)
+        except (ValueError, TypeError):
+            return jsonify({"status": "error", "message": "Invalid device_id"}), 400
+
+    # A device token identifies the device without a database round trip
+    token = device_token()
+    if token:
+        token_device_id = db.verify_device_token(token)
+        if token_device_id is None:
+            return jsonify({"status": "error", "message": "Invalid device token"}), 401
+        if device_id is not None and device_id != token_device_id:
+            return jsonify({"status": "error", "message": "Token does not match device"}), 403
+        device_id = token_device_id
+    elif REQUIRE_DEVICE_TOKEN:
+        return jsonify({"status": "error", "message": "Device token required"}), 401
+    elif device_id is None:
+        return jsonify({"status": "error", "message": "Invalid device_id"}), 400
+    elif not db.get_device_details(device_id):
         return jsonify({"status": "error", "message": "Device not found"}), 404
 
     # Input validation
     try:
-        latitude = float(latitude)
-        longitude = float(longitude)
-        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
-            raise ValueError("Invalid coordinates")
+        latitude, longitude = parse_coordinates(latitude, longitude)
     except (ValueError, TypeError):
         return jsonify({"status": "error", "message": "Invalid coordinates"}), 400
 
+    rejected, next_interval = admit_write(device_id)
+    if rejected:
+        return rejected
+
+    if ingest_writer:
+        try:
+            queued = ingest_writer.submit((device_id, latitude, longitude, ip_address, city, region, country))
+        except TimeoutError:
+            return throttled("Ingest commit timed out", 503, SHED_RETRY_AFTER)
+        if not queued:
+            return throttled("Ingest queue full", 503, SHED_RETRY_AFTER)
+        return jsonify({"status": "success", "client_ip": request.remote_addr, "next_interval": next_interval})
+
     db.update_device_location(device_id, latitude, longitude, ip_address, city, region, country)
-    return jsonify({"status": "success"})
+    # Clients reuse their cached geolocation while this address is unchanged
+    return jsonify({"status": "success", "client_ip": request.remote_addr, "next_interval": next_interval})
+
+@app.route('/api/heartbeat', methods=['POST'])
+def api_heartbeat():
+    """Keep a device that has not moved online without recording a duplicate point"""
+    token = device_token()
+    device_id = db.verify_device_token(token) if token else None
+    if device_id is None:
+        return jsonify({"status": "error", "message": "Valid device token required"}), 401
+    rejected, next_interval = admit_write()
+    if rejected:
+        return rejected
+    if not db.touch_device(device_id):
+        return jsonify({"status": "error", "message": "No location reported yet"}), 404
+    return jsonify({"status": "success", "client_ip": request.remote_addr, "next_interval": next_interval})
+
+def parse_json_points(items, token_device_id, skew, now):
+    """Validate JSON batch items in one pass: (per-item results, [(index, point row)])"""
+    results = [None] * len(items)
+    parsed = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = {"index": index, "status": "error", "message": "Invalid point"}
+            continue
+        try:
+            device_id = int(item.get('device_id', token_device_id))
+        except (ValueError, TypeError):
+            results[index] = {"index": index, "status": "error", "message": "Invalid device_id"}
+            continue
+        try:
+            latitude, longitude = parse_coordinates(item.get('latitude'), item.get('longitude'))
+        except (ValueError, TypeError):
+            results[index] = {"index": index, "status": "error", "message": "Invalid coordinates"}
+            continue
+        if token_device_id is not None and device_id != token_device_id:
+            results[index] = {"index": index, "status": "error", "message": "Token does not match device"}
+            continue
+        point = (device_id, latitude, longitude, item.get('ip_address'),
+                 item.get('city'), item.get('region'), item.get('country'))
+        if item.get('timestamp') is not None:
+            try:
+                timestamp = int(item['timestamp'])
+                if timestamp < 0:
+                    raise ValueError
+            except (ValueError, TypeError):
+                results[index] = {"index": index, "status": "error", "message": "Invalid timestamp"}
+                continue
+            # Never accept points from the future
+            point += (min(timestamp + skew, now),)
+        parsed.append((index, point))
+    return results, parsed
+
+def parse_packed_points(rows, device_id, token_device_id, skew, now):
+    """parse_json_points for binary rows, which need only range and device checks"""
+    device_id = device_id if device_id is not None else token_device_id
+    if device_id is None or (token_device_id is not None and device_id != token_device_id):
+        message = "Token does not match device" if device_id is not None else "Invalid device_id"
+        return [{"index": index, "status": "error", "message": message} for index in range(len(rows))], []
+    results = [None] * len(rows)
+    parsed = []
+    for index, (latitude, longitude, ip_address, city, region, country, timestamp) in enumerate(rows):
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            results[index] = {"index": index, "status": "error", "message": "Invalid coordinates"}
+            continue
+        if timestamp is None:
+            parsed.append((index, (device_id, latitude, longitude, ip_address, city, region, country)))
+        elif timestamp < 0:
+            results[index] = {"index": index, "status": "error", "message": "Invalid timestamp"}
+        else:
+            parsed.append((index, (device_id, latitude, longitude, ip_address, city, region, country,
+                                   min(timestamp + skew, now))))
+    return results, parsed
+
+@app.route('/api/update_locations', methods=['POST'])
+def api_update_locations():
+    """Accept a batch of location points, possibly for many devices
+
+    With a device token every point must belong to that device and may omit
+    device_id. Points may carry a client-side epoch-ms timestamp; when the
+    batch has a sent_at client time, timestamps are shifted by the
+    difference to server time so client clock skew cancels out. The body
+    may also be a wire.CONTENT_TYPE batch for a single device.
+    """
+    token_device_id = None
+    token = device_token()
+    if token:
+        token_device_id = db.verify_device_token(token)
+        if token_device_id is None:
+            return jsonify({"status": "error", "message": "Invalid device token"}), 401
+    elif REQUIRE_DEVICE_TOKEN:
+        return jsonify({"status": "error", "message": "Device token required"}), 401
+
+    packed = request.mimetype == wire.CONTENT_TYPE
+    if packed:
+        try:
+            packed_device_id, sent_at, items = wire.decode_points(request.get_data())
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        data = {"sent_at": sent_at}
+    else:
+        data = request.get_json(silent=True)
+        items = data.get('points') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"status": "error", "message": "Expected a non-empty list of points"}), 400
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({"status": "error",
+                        "message": f"Batch too large (max {MAX_BATCH_SIZE} points)"}), 413
+
+    # Relayed multi-device batches only get the global overload check
+    rejected, next_interval = admit_write(token_device_id)
+    if rejected:
+        return rejected
+
+    now = epoch_ms()
+    skew = 0
+    if isinstance(data, dict) and data.get('sent_at') is not None:
+        try:
+            skew = now - int(data['sent_at'])
+        except (ValueError, TypeError):
+            return jsonify({"status": "error", "message": "Invalid sent_at"}), 400
+
+    if packed:
+        results, parsed = parse_packed_points(items, packed_device_id, token_device_id, skew, now)
+    else:
+        results, parsed = parse_json_points(items, token_device_id, skew, now)
+
+    existing = db.get_existing_device_ids(point[0] for _, point in parsed)
+    points = []
+    for index, point in parsed:
+        if point[0] in existing:
+            points.append(point)
+            results[index] = {"index": index, "status": "success"}
+        else:
+            results[index] = {"index": index, "status": "error", "message": "Device not found"}
+
+    if ingest_writer:
+        try:
+            queued = ingest_writer.submit_many(points)
+        except TimeoutError:
+            return throttled("Ingest commit timed out", 503, SHED_RETRY_AFTER)
+        if not queued:
+            return throttled("Ingest queue full", 503, SHED_RETRY_AFTER)
+        return jsonify({
+            "status": "success",
+            "accepted": len(points),
+            "rejected": len(items) - len(points),
+            "results": results,
+            "client_ip": request.remote_addr,
+            "next_interval": next_interval
+        })
+
+    try:
+        db.update_device_locations(points)
+    except sqlite3.Error as e:
+        print(f"Error storing location batch: {str(e)}")
+        return jsonify({"status": "error", "message": "Failed to store locations"}), 500
+
+    return jsonify({
+        "status": "success",
+        "accepted": len(points),
+        "rejected": len(items) - len(points),
+        "results": results,
+        "client_ip": request.remote_addr,
+        "next_interval": next_interval
+    })
 
 @app.route('/api/add_geofence', methods=['POST'])
 @login_required
@@ -454,6 +1548,386 @@ def api_add_geofence():
         return jsonify({"status": "success"})
     return jsonify({"status": "error", "message": "Failed to add geofence"}), 400
 
+def parse_point_query():
+    """Read latitude/longitude query parameters, raising ValueError if invalid"""
+    return parse_coordinates(request.args.get('latitude'), request.args.get('longitude'))
+
+def device_distance_json(row):
+    device_id, name, latitude, longitude, last_seen, distance = row
+    return {"device_id": device_id, "device_name": name, "latitude": latitude,
+            "longitude": longitude, "last_seen": last_seen, "distance": distance}
+
+@app.route('/api/devices/near')
+@login_required
+def api_devices_near():
+    """The current user's devices within radius km of a point"""
+    try:
+        latitude, longitude = parse_point_query()
+        radius = float(request.args.get('radius'))
+        if not 0 < radius <= HALF_EARTH_CIRCUMFERENCE_KM:
+            raise ValueError("Invalid radius")
+    except (ValueError, TypeError):
+        return jsonify({"status": "error", "message": "Invalid input data"}), 400
+
+    devices = db.find_devices_near(session['user_id'], latitude, longitude, radius)
+    return jsonify({"status": "success", "devices": [device_distance_json(row) for row in devices]})
+
+@app.route('/api/devices/nearest')
+@login_required
+def api_devices_nearest():
+    """The current user's k devices nearest to a point"""
+    try:
+        latitude, longitude = parse_point_query()
+        k = int(request.args.get('k', 1))
+        if not 0 < k <= MAX_NEAREST_DEVICES:
+            raise ValueError("Invalid k")
+    except (ValueError, TypeError):
+        return jsonify({"status": "error", "message": "Invalid input data"}), 400
+
+    devices = db.find_nearest_devices(session['user_id'], latitude, longitude, k)
+    return jsonify({"status": "success", "devices": [device_distance_json(row) for row in devices]})
+
+@app.route('/api/geofences/containing')
+@login_required
+def api_geofences_containing():
+    """The current user's geofences that contain a point"""
+    try:
+        latitude, longitude = parse_point_query()
+    except (ValueError, TypeError):
+        return jsonify({"status": "error", "message": "Invalid coordinates"}), 400
+
+    geofences = db.get_geofences_containing(session['user_id'], latitude, longitude)
+    return jsonify({"status": "success", "geofences": [
+        {"id": geo_id, "device_id": device_id, "name": name,
+         "latitude": geo_lat, "longitude": geo_lon, "radius": radius}
+        for geo_id, device_id, name, geo_lat, geo_lon, radius in geofences
+    ]})
+
+def fleet_device_json(row, now):
+    (device_id, name, device_type, registered, latitude, longitude, last_seen_time, last_seen,
+     city, region, country, violated) = row
+    if last_seen is None:
+        status = "never_seen"
+    elif now - last_seen <= FLEET_ONLINE_SECONDS * 1000:
+        status = "online"
+    else:
+        status = "offline"
+    return {
+        "device_id": device_id, "device_name": name, "device_type": device_type,
+        "registered": registered, "latitude": latitude, "longitude": longitude,
+        "city": city, "region": region, "country": country,
+        "last_seen": last_seen, "last_seen_time": last_seen_time, "status": status,
+        "violated_geofences": json.loads(violated)
+    }
+
+@app.route('/api/fleet')
+@login_required
+def api_fleet():
+    """Every device of the current user with latest point, status and violated fences
+
+    The ETag covers everything but last_seen_age, which clients can derive
+    from last_seen and server_time, so polling gets 304s until a device
+    moves, changes status or crosses a fence.
+    """
+    now = epoch_ms()
+    devices = [fleet_device_json(row, now) for row in db.get_fleet(session['user_id'])]
+    etag = hashlib.sha1(json.dumps(devices, sort_keys=True).encode()).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        for device in devices:
+            last_seen = device["last_seen"]
+            device["last_seen_age"] = None if last_seen is None else max(0, (now - last_seen) // 1000)
+        response = jsonify({"status": "success", "server_time": now, "devices": devices})
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/health')
+def api_health():
+    """Liveness check that also reports ingest, cache, stream and maintenance gauges"""
+    health = {"status": "ok", "ingest_mode": INGEST_MODE, "device_cache": db.device_cache.stats()}
+    if ingest_writer:
+        health["ingest"] = ingest_writer.stats()
+    health["streams"] = db.broker.stats()
+    if maintenance_job.last_run:
+        health["maintenance"] = maintenance_job.last_run
+    load = server_load()
+    health["load"] = {"load": round(load, 3), "recommended_interval": recommended_interval(load)}
+    return jsonify(health)
+
+@app.route('/api/device/<int:device_id>/geofence_events')
+@login_required
+def api_geofence_events(device_id):
+    """Page through a device's geofence enter/exit events, newest first"""
+    device = db.get_device_details(device_id)
+    if not device or device[4] != session.get('username'):
+        return jsonify({"status": "error", "message": "Device not found"}), 404
+
+    try:
+        before = request.args.get('before')
+        before = int(before) if before is not None else None
+        limit = int(request.args.get('limit', 50))
+        if not 0 < limit <= MAX_EVENTS_PAGE:
+            raise ValueError("Invalid limit")
+    except (ValueError, TypeError):
+        return jsonify({"status": "error", "message": "Invalid input data"}), 400
+
+    rows = db.get_geofence_events(device_id, before, limit)
+    events = [
+        {"id": event_id, "geofence_id": geofence_id, "geofence_name": name, "event": event,
+         "latitude": latitude, "longitude": longitude, "distance": distance, "timestamp": timestamp}
+        for event_id, geofence_id, name, event, latitude, longitude, distance, timestamp in rows
+    ]
+    # Pass next_before back as ?before= to fetch the following page
+    next_before = rows[-1][0] if len(rows) == limit else None
+    return jsonify({"status": "success", "events": events, "next_before": next_before})
+
+def parse_time_param(name):
+    """Read an epoch-ms or ISO 8601 query parameter; naive times are server local time"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return int(datetime.datetime.fromisoformat(value).timestamp() * 1000)
+
+def parse_history_cursor(value):
+    """Decode a '<timestamp>_<id>' history cursor"""
+    timestamp, location_id = value.split('_')
+    return int(timestamp), int(location_id)
+
+def location_json(row):
+    return dict(zip(HISTORY_COLUMNS, row))
+
+@app.route('/api/device/<int:device_id>/history')
+@login_required
+def api_location_history(device_id):
+    """Page through a device's location history, newest first unless order=asc
+
+    With tolerance (km) or zoom (map zoom level), the whole start-end
+    window is returned at once, simplified so that no dropped point is
+    further than the tolerance (or one map pixel) from the track.
+    """
+    device = db.get_device_details(device_id)
+    if not device or device[4] != session.get('username'):
+        return jsonify({"status": "error", "message": "Device not found"}), 404
+
+    try:
+        start = parse_time_param('start')
+        end = parse_time_param('end')
+        cursor = request.args.get('cursor')
+        cursor = parse_history_cursor(cursor) if cursor else None
+        limit = int(request.args.get('limit', 100))
+        if not 0 < limit <= MAX_HISTORY_PAGE:
+            raise ValueError("Invalid limit")
+        order = request.args.get('order', 'desc')
+        if order not in ('asc', 'desc'):
+            raise ValueError("Invalid order")
+    except (ValueError, TypeError):
+        return jsonify({"status": "error", "message": "Invalid input data"}), 400
+
+    if 'tolerance' in request.args or 'zoom' in request.args:
+        return simplified_history_json(device_id, start, end, order)
+
+    rows = db.get_location_page(device_id, start, end, cursor, limit, newest_first=order == 'desc')
+    # Pass next_cursor back as ?cursor= with the same filters for the next page
+    next_cursor = f"{rows[-1][7]}_{rows[-1][0]}" if len(rows) == limit else None
+    return jsonify({"status": "success", "locations": [location_json(row) for row in rows],
+                    "next_cursor": next_cursor})
+
+def simplified_history_json(device_id, start, end, order):
+    try:
+        if 'zoom' in request.args:
+            zoom = int(request.args.get('zoom'))
+            if not 0 <= zoom <= MAX_MAP_ZOOM:
+                raise ValueError("Invalid zoom")
+            latest = db.get_latest_device_location(device_id)
+            tolerance = zoom_tolerance_km(zoom, latest[0] if latest else 0.0)
+        else:
+            tolerance = float(request.args.get('tolerance'))
+            if not 0 <= tolerance < HALF_EARTH_CIRCUMFERENCE_KM:
+                raise ValueError("Invalid tolerance")
+    except (ValueError, TypeError):
+        return jsonify({"status": "error", "message": "Invalid input data"}), 400
+
+    rows, raw_count = db.get_simplified_track(device_id, start, end, tolerance)
+    if order == 'desc':
+        rows = rows[::-1]
+    return jsonify({"status": "success", "locations": [location_json(row) for row in rows],
+                    "next_cursor": None, "tolerance": tolerance, "raw_points": raw_count})
+
+@app.route('/api/device/<int:device_id>/history/rollups')
+@login_required
+def api_location_rollups(device_id):
+    """Hourly or daily summaries of a device's history, for long time ranges"""
+    device = db.get_device_details(device_id)
+    if not device or device[4] != session.get('username'):
+        return jsonify({"status": "error", "message": "Device not found"}), 404
+
+    try:
+        start = parse_time_param('start')
+        end = parse_time_param('end')
+        limit = int(request.args.get('limit', MAX_ROLLUP_PAGE))
+        if not 0 < limit <= MAX_ROLLUP_PAGE:
+            raise ValueError("Invalid limit")
+        resolution = request.args.get('resolution', 'auto')
+        if resolution == 'auto':
+            span = (end or epoch_ms()) - (start or 0)
+            resolution = 'day' if span > ROLLUP_AUTO_DAILY_DAYS * DAY_MS else 'hour'
+        if resolution not in ROLLUP_TABLES:
+            raise ValueError("Invalid resolution")
+    except (ValueError, TypeError):
+        return jsonify({"status": "error", "message": "Invalid input data"}), 400
+
+    rows = db.get_location_rollups(device_id, resolution, start, end, limit)
+    rollups = [
+        {"timestamp": timestamp, "time": local_time, "point_count": count,
+         "latitude": latitude, "longitude": longitude,
+         "bounds": [min_lat, min_lon, max_lat, max_lon], "distance": distance}
+        for timestamp, local_time, count, latitude, longitude, min_lat, max_lat, min_lon, max_lon, distance in rows
+    ]
+    # Pass next_start back as ?start= to continue after a full page
+    next_start = rows[-1][0] + 1 if len(rows) == limit else None
+    return jsonify({"status": "success", "resolution": resolution, "rollups": rollups,
+                    "next_start": next_start})
+
+@app.route('/api/retention', methods=['POST'])
+@login_required
+def api_set_retention():
+    """Set the current user's retention policy, optionally for one device type"""
+    data = request.get_json()
+
+    # Check CSRF token for JSON requests from browser
+    token = data.get('csrf_token')
+    if token and token != session.get('csrf_token'):
+        return jsonify({"status": "error", "message": "Invalid token"}), 400
+
+    device_type = data.get('device_type') or None
+    try:
+        raw_days = int(data.get('raw_days'))
+        hourly_days = int(data.get('hourly_days'))
+        if not (0 <= raw_days <= MAX_RETENTION_DAYS and 0 <= hourly_days <= MAX_RETENTION_DAYS):
+            raise ValueError("Invalid retention")
+    except (ValueError, TypeError):
+        return jsonify({"status": "error", "message": "Invalid input data"}), 400
+
+    if db.set_retention_policy(raw_days, hourly_days, session['user_id'], device_type):
+        return jsonify({"status": "success"})
+    return jsonify({"status": "error", "message": "Failed to set retention policy"}), 400
+
+def export_chunks(lines, size=1000):
+    """Join generated lines into larger chunks to cut per-write overhead"""
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+def export_ndjson(rows):
+    for row in rows:
+        yield json.dumps(location_json(row)) + "\n"
+
+def export_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # The header goes out on its own, so an empty range still exports one
+    writer.writerow(HISTORY_COLUMNS)
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        yield buffer.getvalue()
+
+def export_geojson(rows):
+    yield '{"type": "FeatureCollection", "features": ['
+    separator = ''
+    for row in rows:
+        properties = location_json(row)
+        feature = {"type": "Feature",
+                   "geometry": {"type": "Point", "coordinates": [row[2], row[1]]},
+                   "properties": properties}
+        yield separator + json.dumps(feature)
+        separator = ','
+    yield ']}\n'
+
+# format -> (generator, mimetype, file extension)
+EXPORT_FORMATS = {
+    'ndjson': (export_ndjson, 'application/x-ndjson', 'ndjson'),
+    'csv': (export_csv, 'text/csv', 'csv'),
+    'geojson': (export_geojson, 'application/geo+json', 'geojson'),
+}
+
+@app.route('/api/device/<int:device_id>/history/export')
+@login_required
+def api_export_history(device_id):
+    """Stream a device's full location history, oldest first"""
+    device = db.get_device_details(device_id)
+    if not device or device[4] != session.get('username'):
+        return jsonify({"status": "error", "message": "Device not found"}), 404
+
+    try:
+        start = parse_time_param('start')
+        end = parse_time_param('end')
+        generate, mimetype, extension = EXPORT_FORMATS[request.args.get('format', 'ndjson')]
+    except (ValueError, TypeError, KeyError):
+        return jsonify({"status": "error", "message": "Invalid input data"}), 400
+
+    rows = db.iter_location_history(device_id, start, end)
+    return Response(export_chunks(generate(rows)), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=device-{device_id}-history.{extension}'
+    })
+
+def sse_stream(subscription):
+    """Server-Sent Events body for a broker subscription"""
+    try:
+        # Browsers reconnect after this many ms when the stream ends
+        yield "retry: 3000\n\n"
+        while True:
+            if subscription.evicted and subscription.queue.empty():
+                yield "event: evicted\ndata: {}\n\n"
+                return
+            event = subscription.get(SSE_KEEPALIVE_SECONDS)
+            if event is None:
+                # Comment line; also surfaces disconnected clients
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: location\ndata: {json.dumps(event)}\n\n"
+    finally:
+        db.broker.unsubscribe(subscription)
+
+def sse_response(topic):
+    subscription = db.broker.subscribe(topic)
+    if subscription is None:
+        return jsonify({"status": "error", "message": "Too many live streams"}), 503
+    response = Response(sse_stream(subscription), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Also covers responses closed before the stream body ever started
+    response.call_on_close(lambda: db.broker.unsubscribe(subscription))
+    return response
+
+@app.route('/api/device/<int:device_id>/stream')
+@login_required
+def api_device_stream(device_id):
+    """Live location updates for one device"""
+    device = db.get_device_details(device_id)
+    if not device or device[4] != session.get('username'):
+        return jsonify({"status": "error", "message": "Device not found"}), 404
+    return sse_response(('device', device_id))
+
+@app.route('/api/fleet/stream')
+@login_required
+def api_fleet_stream():
+    """Live location updates for all of the current user's devices"""
+    return sse_response(('user', session.get('username')))
+
 # API endpoint for device registration from client
 @app.route('/api/client/register', methods=['POST'])
 def api_client_register():
@@ -476,17 +1950,93 @@ def api_client_register():
     if not user_id:
         return jsonify({"status": "error", "message": "Invalid credentials"}), 401
 
-    # Check if device already exists for this user
-    devices = db.get_user_devices(user_id)
-    for device_id, name, device_type, _ in devices:
-        if name == hostname:
-            return jsonify({"status": "success", "device_id": device_id})
+    # Reuse the device registered under this hostname, if any
+    device_id = db.find_user_device(user_id, hostname)
+    if not device_id:
+        device_id = db.register_device(user_id, hostname, f"Laptop ({os_info})")
+        # A concurrent registration of the same hostname may have won
+        if not device_id:
+            device_id = db.find_user_device(user_id, hostname)
+    if not device_id:
+        return jsonify({"status": "error", "message": "Failed to register device"}), 400
+
+    token = db.issue_device_token(device_id)
+    if not token:
+        return jsonify({"status": "error", "message": "Failed to issue device token"}), 500
+    return jsonify({"status": "success", "device_id": device_id, "device_token": token})
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if profiler.running:
+        profiler.track(threading.get_ident())
 
-    # Register new device
-    device_id = db.register_device(user_id, hostname, f"Laptop ({os_info})")
-    if device_id:
-        return jsonify({"status": "success", "device_id": device_id})
-    return jsonify({"status": "error", "message": "Failed to register device"}), 400
+@app.after_request
+def record_request_duration(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_duration.observe((request.method, route, str(response.status_code)),
+                                 time.perf_counter() - start)
+    return response
+
+@app.after_request
+def advertise_point_formats(response):
+    # Clients switch to the binary point format once they see it accepted
+    if request.endpoint in ('api_update_location', 'api_update_locations'):
+        response.headers['Accept-Post'] = f'application/json, {wire.CONTENT_TYPE}'
+    return response
+
+@app.teardown_request
+def stop_profiling_request(exc):
+    profiler.untrack(threading.get_ident())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request, database, cache, stream and ingest metrics in Prometheus text format"""
+    lines = request_duration.render()
+    for family in db.metrics.families():
+        lines += family.render()
+    caches = {(name,): cache.stats() for name, cache in
+              (('device', db.device_cache), ('token', db.token_cache), ('track', db.track_cache))}
+    for stat, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'), ('size', 'gauge')):
+        suffix = '_total' if kind == 'counter' else ''
+        lines += render_samples(f'tracker_cache_{stat}{suffix}', f'Cache {stat}', kind,
+                                {labels: stats[stat] for labels, stats in caches.items()}, ('cache',))
+    lines += render_samples('tracker_write_load', 'Write pressure used for backpressure, 1 means shedding',
+                            'gauge', {(): server_load()})
+    streams = db.broker.stats()
+    lines += render_samples('tracker_stream_subscribers', 'Open live location streams', 'gauge',
+                            {(): streams['subscribers']})
+    lines += render_samples('tracker_stream_published_total', 'Points published to live streams', 'counter',
+                            {(): streams['published']})
+    if ingest_writer:
+        ingest = ingest_writer.stats()
+        lines += render_samples('tracker_ingest_queue_depth', 'Points waiting in the write-behind queue',
+                                'gauge', {(): ingest['queue_depth']})
+        for stat in ('committed', 'rejected', 'errors'):
+            lines += render_samples(f'tracker_ingest_{stat}_total', f'Write-behind points {stat}', 'counter',
+                                    {(): ingest[stat]})
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/debug/profile', methods=['GET', 'POST'])
+@login_required
+def api_profile():
+    """Report the sampling profiler's hot paths; POST {"action": "start"|"stop"|"reset"} toggles it"""
+    if not ENABLE_PROFILER:
+        return jsonify({"status": "error", "message": "Not found"}), 404
+    if request.method == 'POST':
+        action = (request.get_json(silent=True) or {}).get('action')
+        if action == 'start':
+            profiler.start()
+        elif action == 'stop':
+            profiler.stop()
+        elif action == 'reset':
+            profiler.reset()
+        else:
+            return jsonify({"status": "error", "message": "action must be start, stop or reset"}), 400
+    top = request.args.get('top', default=20, type=int)
+    return jsonify({"status": "success", "profile": profiler.report(max(1, min(top, 200)))})
 
 # Set stricter Content Security Policy headers
 @app.after_request
@@ -498,4 +2048,4 @@ def add_security_headers(response):
     return response
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""Compact binary encoding of location point batches
+
+An alternative to the JSON bodies of /api/update_location(s) for
+high-frequency trackers. All integers are little-endian:
+
+    header  version u8, device_id u32 (0: the token's device),
+            sent_at i64 epoch ms (0: unknown), point count u16
+    point   flags u8, then by flag:
+            ABSOLUTE       latitude, longitude i32 in millionths of a degree,
+                           otherwise i16 deltas from the previous point
+            TIME_DELTA     i32 ms since the previous timestamp (sent_at for
+                           the first point); TIME_ABSOLUTE: i64 epoch ms;
+                           neither: no timestamp
+            PLACE          ip_address, city, region, country as u8 length
+                           plus UTF-8 (length 255: null); otherwise the
+                           previous point's place
+
+Batches are self-contained: the first point is always absolute and starts
+with no place.
+"""
+import struct
+
+CONTENT_TYPE = 'application/x-tracker-points'
+VERSION = 1
+# Millionths of a degree, about 0.1 m; finer than any geolocation source
+COORD_SCALE = 1000000
+MAX_POINTS = 0xFFFF
+
+ABSOLUTE = 0x01
+TIME_DELTA = 0x02
+TIME_ABSOLUTE = 0x04
+PLACE = 0x08
+
+PLACE_FIELDS = ('ip_address', 'city', 'region', 'country')
+NULL_LENGTH = 0xFF
+MAX_STRING_BYTES = 254
+
+_header = struct.Struct('<BIqH')
+_absolute = struct.Struct('<ii')
+_delta = struct.Struct('<hh')
+_time_delta = struct.Struct('<i')
+_time_absolute = struct.Struct('<q')
+_EMPTY_PLACE = (None, None, None, None)
+
+
+def _encode_string(value):
+    if value is None:
+        return bytes((NULL_LENGTH,))
+    data = str(value).encode()
+    if len(data) > MAX_STRING_BYTES:
+        # Cut on a character boundary
+        data = data[:MAX_STRING_BYTES].decode(errors='ignore').encode()
+    return bytes((len(data),)) + data
+
+
+def encode_points(points, device_id=None, sent_at=None):
+    """Pack point dicts as sent in JSON batches; ValueError if they cannot be encoded"""
+    if len(points) > MAX_POINTS:
+        raise ValueError(f"At most {MAX_POINTS} points per batch")
+    out = bytearray(_header.pack(VERSION, device_id or 0, sent_at or 0, len(points)))
+    latitude = longitude = None
+    previous_time = sent_at or 0
+    place = _EMPTY_PLACE
+    for point in points:
+        new_latitude = round(float(point["latitude"]) * COORD_SCALE)
+        new_longitude = round(float(point["longitude"]) * COORD_SCALE)
+        flags = 0
+        if latitude is not None and -0x8000 <= new_latitude - latitude < 0x8000 \
+                and -0x8000 <= new_longitude - longitude < 0x8000:
+            coordinates = _delta.pack(new_latitude - latitude, new_longitude - longitude)
+        else:
+            flags |= ABSOLUTE
+            coordinates = _absolute.pack(new_latitude, new_longitude)
+        latitude, longitude = new_latitude, new_longitude
+
+        timestamp = point.get("timestamp")
+        times = b''
+        if timestamp is not None:
+            timestamp = int(timestamp)
+            if -0x80000000 <= timestamp - previous_time < 0x80000000:
+                flags |= TIME_DELTA
+                times = _time_delta.pack(timestamp - previous_time)
+            else:
+                flags |= TIME_ABSOLUTE
+                times = _time_absolute.pack(timestamp)
+            previous_time = timestamp
+
+        new_place = tuple(point.get(field) for field in PLACE_FIELDS)
+        strings = b''
+        if new_place != place:
+            flags |= PLACE
+            strings = b''.join(_encode_string(value) for value in new_place)
+            place = new_place
+
+        out.append(flags)
+        out += coordinates
+        out += times
+        out += strings
+    return bytes(out)
+
+
+def decode_points(body):
+    """Unpack a batch into (device_id or None, sent_at or None, rows); ValueError if malformed
+
+    Rows are (latitude, longitude, ip_address, city, region, country,
+    timestamp or None) tuples, the order the server stores them in, so
+    no per-point dicts are built.
+    """
+    try:
+        version, device_id, sent_at, count = _header.unpack_from(body, 0)
+        if version != VERSION:
+            raise ValueError(f"Unsupported point format version {version}")
+        offset = _header.size
+        latitude = longitude = None
+        previous_time = sent_at
+        place = _EMPTY_PLACE
+        rows = []
+        for _ in range(count):
+            flags = body[offset]
+            offset += 1
+            if flags & ABSOLUTE:
+                latitude, longitude = _absolute.unpack_from(body, offset)
+                offset += 8
+            elif latitude is None:
+                raise ValueError("First point must have absolute coordinates")
+            else:
+                delta_latitude, delta_longitude = _delta.unpack_from(body, offset)
+                latitude += delta_latitude
+                longitude += delta_longitude
+                offset += 4
+            timestamp = None
+            if flags & TIME_DELTA:
+                previous_time += _time_delta.unpack_from(body, offset)[0]
+                timestamp = previous_time
+                offset += 4
+            elif flags & TIME_ABSOLUTE:
+                previous_time = timestamp = _time_absolute.unpack_from(body, offset)[0]
+                offset += 8
+            if flags & PLACE:
+                values = []
+                for _ in PLACE_FIELDS:
+                    length = body[offset]
+                    offset += 1
+                    if length == NULL_LENGTH:
+                        values.append(None)
+                    else:
+                        values.append(body[offset:offset + length].decode())
+                        offset += length
+                place = tuple(values)
+            rows.append((latitude / COORD_SCALE, longitude / COORD_SCALE) + place + (timestamp,))
+        if offset != len(body):
+            raise ValueError("Trailing bytes after the last point")
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed point data: {e}")
+    return device_id or None, sent_at or None, rows